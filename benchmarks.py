@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# coding: utf-8
+'''Benchmarks for gitli. Only the standard library is required.
+
+The benchmarks run on synthetic trackers of several sizes. Each gitli
+function is timed in this process, with its peak memory measured by
+tracemalloc in a separate run, and each command is timed end-to-end by
+running git-li in a git repository:
+
+    python benchmarks.py -s 10000,100000 -o results.json
+    python benchmarks.py -s 10000,100000 -b results.json functions
+
+The presets run one suite with fixed options, e.g., the list preset times
+list_issues on trackers where every issue is open, whose time per issue must
+stay flat as the tracker grows, and the startup preset times git li list on
+an empty tracker, i.e., mostly the interpreter startup, the repository
+discovery, and the git config reads:
+
+    python benchmarks.py list startup
+
+The results can be saved as JSON and compared with a baseline: the exit
+status is 1 if a benchmark is slower than the baseline by more than the
+tolerance.
+'''
+from __future__ import unicode_literals
+import gitli
+import json
+import optparse
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+from codecs import open
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'git-li')
+
+
+class NullOutput(object):
+    '''A stdout replacement that discards everything.'''
+
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def generate_tracker(path, count, open_ratio=0.5, milestones=10, seed=0):
+    '''Generates a synthetic .gitli directory.
+
+    :param path: The path of the .gitli directory to create.
+    :param count: The number of issues.
+    :param open_ratio: The fraction of the issues that are open.
+    :param milestones: The number of distinct milestones.
+    :param seed: The seed of the random generator, for reproducible stores.
+    '''
+    rand = random.Random(seed)
+    gitli.init(path)
+    open_numbers = []
+    with open(os.path.join(path, gitli.ISSUES), 'w',
+            encoding='utf-8') as issues:
+        for number in range(1, count + 1):
+            milestone = '0.{0}'.format(number * milestones // (count + 1))
+            issues.write(gitli.format_issue((number,
+                'Synthetic issue {0} {1:x}'.format(number,
+                    rand.getrandbits(32)),
+                rand.randint(1, len(gitli.ITYPES)), milestone)))
+            if rand.random() < open_ratio:
+                open_numbers.append(number)
+
+    with open(os.path.join(path, gitli.OPEN), 'w', encoding='utf-8') as iopen:
+        iopen.write(''.join('{0}{1}'.format(number, gitli.OSEPARATOR) for
+            number in open_numbers))
+
+    with open(os.path.join(path, gitli.LAST), 'w', encoding='utf-8') as last:
+        last.write('{0}'.format(count))
+
+
+def timed(function, *args):
+    '''
+    :rtype: The wall time in seconds taken by function(*args), with stdout
+    discarded.
+    '''
+    stdout = sys.stdout
+    sys.stdout = NullOutput()
+    try:
+        start = time.time()
+        function(*args)
+        return time.time() - start
+    finally:
+        sys.stdout = stdout
+
+
+def traced(function, *args):
+    '''
+    :rtype: The peak memory in bytes allocated by function(*args), with
+    stdout discarded.
+    '''
+    stdout = sys.stdout
+    sys.stdout = NullOutput()
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        sys.stdout = stdout
+
+
+def new_issues(path):
+    for index in range(100):
+        gitli.new_issue(path, 'New issue {0}'.format(index))
+
+
+BCOLOR = gitli.BColors()
+BCOLOR.disable()
+
+# name -> (modifies the tracker, function of the .gitli path)
+FUNCTIONS = OrderedDict((
+    ('get_issues', (False, lambda path: gitli.get_issues(path, [],
+        gitli.get_open_issues(path), [], []))),
+    ('list_issues', (False, lambda path: gitli.list_issues(path, ['open'],
+        BCOLOR, False))),
+    ('list_issues_milestone', (False, lambda path: gitli.list_issues(path,
+        ['0.1', 'bug'], BCOLOR, False))),
+    ('show_issue', (False, lambda path: gitli.show_issue(path, '7',
+        BCOLOR))),
+    ('search_issues', (False, lambda path: gitli.search_issues(path,
+        ['synthetic', '7']))),
+    ('get_stats', (False, gitli.get_stats)),
+    ('new_issue_x100', (True, new_issues)),
+    ('remove_open', (True, lambda path: gitli.remove_open(path, '1'))),
+    ('close_issues', (True, lambda path: gitli.close_issues(path,
+        ['{0}'.format(number) for number in range(1, 1001)]))),
+    ('move_issues', (True, lambda path: gitli.move_issues(path, '1.0'))),
+))
+
+# name -> (modifies the tracker, git-li arguments)
+COMMANDS = OrderedDict((
+    ('list', (False, ['list', 'open'])),
+    ('list_milestone', (False, ['list', '0.1', 'bug'])),
+    ('show', (False, ['show', '7'])),
+    ('search', (False, ['search', 'synthetic', '7'])),
+    ('stats', (False, ['stats'])),
+    ('new', (True, ['new', 'New issue'])),
+    ('close', (True, ['close', '1-1000'])),
+    ('milestone_up', (True, ['milestone', '--up', '1.0'])),
+))
+
+
+def prepare(source, destination):
+    '''Replaces the destination .gitli directory by a copy of the source,
+    caches included.
+    '''
+    if os.path.exists(destination):
+        shutil.rmtree(destination)
+    shutil.copytree(source, destination)
+
+
+def bench_functions(tracker, work, runs, names):
+    '''Times the gitli functions and measures their peak memory.
+
+    :param tracker: The path of the pristine .gitli directory.
+    :param work: The path of the .gitli directory the functions run on.
+    :param runs: The number of timed runs of each function.
+    :param names: The names of the FUNCTIONS to run.
+    :rtype: A dict mapping the names to their result.
+    '''
+    results = OrderedDict()
+    prepare(tracker, work)
+    for name in names:
+        (modifies, function) = FUNCTIONS[name]
+        # The first run builds the caches of the working copy.
+        timed(function, work)
+        timings = []
+        for _ in range(runs):
+            if modifies:
+                prepare(tracker, work)
+            timings.append(timed(function, work))
+        if modifies:
+            prepare(tracker, work)
+        results[name] = summarize(timings)
+        results[name]['peak_bytes'] = traced(function, work)
+        if modifies:
+            prepare(tracker, work)
+    return results
+
+
+def bench_commands(tracker, work, runs, names):
+    '''Times git-li commands end-to-end, interpreter startup included.
+
+    :param tracker: The path of the pristine .gitli directory.
+    :param work: The path of the .gitli directory of a git repository.
+    :param runs: The number of timed runs of each command.
+    :param names: The names of the COMMANDS to run.
+    :rtype: A dict mapping the names to their result.
+    '''
+    results = OrderedDict()
+    repository = os.path.dirname(work)
+    prepare(tracker, work)
+    with open(os.devnull, 'w') as null:
+        def run(args):
+            start = time.time()
+            subprocess.check_call([sys.executable, SCRIPT] + args,
+                    stdout=null, cwd=repository)
+            return time.time() - start
+
+        for name in names:
+            (modifies, args) = COMMANDS[name]
+            run(args)
+            timings = []
+            for _ in range(runs):
+                if modifies:
+                    prepare(tracker, work)
+                timings.append(run(args))
+            if modifies:
+                prepare(tracker, work)
+            results[name] = summarize(timings)
+    return results
+
+
+def summarize(timings):
+    '''
+    :param timings: The wall times of the runs in seconds.
+    :rtype: A dict with the best and the median time.
+    '''
+    timings = sorted(timings)
+    return OrderedDict((('best', timings[0]),
+        ('median', timings[len(timings) // 2]), ('runs', len(timings))))
+
+
+def run_benchmarks(options, suites, label=None):
+    '''Generates a tracker per size and runs the benchmark suites on it.
+
+    :param label: The prefix of the result keys, the suite by default.
+    :rtype: The results as a dict ready to be saved in JSON.
+    '''
+    results = OrderedDict((
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('open_ratio', options.open_ratio),
+        ('milestones', options.milestones),
+        ('results', OrderedDict())))
+    tempdir = tempfile.mkdtemp()
+    environ = dict(os.environ)
+    try:
+        # The repository root cache of gitli must not touch the user cache.
+        os.environ['XDG_CACHE_HOME'] = os.path.join(tempdir, 'cache')
+        tracker = os.path.join(tempdir, 'tracker')
+        repository = os.path.join(tempdir, 'repository')
+        os.mkdir(repository)
+        subprocess.check_call(['git', 'init', '-q', repository])
+        work = os.path.join(repository, gitli.GITLIDIR)
+        for size in options.sizes if suites else ():
+            if os.path.exists(tracker):
+                shutil.rmtree(tracker)
+            generate_tracker(tracker, size, options.open_ratio,
+                    options.milestones)
+            for suite in suites:
+                if suite == 'functions':
+                    suite_results = bench_functions(tracker, work,
+                            options.runs, options.functions)
+                else:
+                    suite_results = bench_commands(tracker, work,
+                            options.runs, options.commands)
+                for (name, result) in suite_results.items():
+                    key = '{0}.{1}@{2}'.format(label or suite, name, size)
+                    results['results'][key] = result
+                    print_result(key, result)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(tempdir)
+    return results
+
+
+def print_result(key, result, baseline=None):
+    peak = result.get('peak_bytes')
+    print('{0:<40} {1:>10.2f} ms {2:>10.2f} ms {3:>12}{4}'.format(key,
+        result['best'] * 1000, result['median'] * 1000,
+        '' if peak is None else '{0:.1f} MB'.format(peak / 1048576.0),
+        '' if baseline is None else ' {0:>+7.1%}'.format(
+            result['best'] / baseline['best'] - 1)))
+
+
+def compare(results, baseline, tolerance):
+    '''Compares the best times with a baseline.
+
+    :param results: The results of run_benchmarks.
+    :param baseline: Results saved by a previous run.
+    :param tolerance: The accepted slowdown, e.g., 0.2 for 20%.
+    :rtype: The keys of the benchmarks slower than the baseline.
+    '''
+    regressions = []
+    print('\nCompared with the baseline:')
+    for (key, result) in results['results'].items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        print_result(key, result, base)
+        if result['best'] > base['best'] * (1 + tolerance):
+            regressions.append(key)
+    return regressions
+
+
+SUITES = ('functions', 'commands')
+
+# name -> (suite, options overriding the command line)
+PRESETS = OrderedDict((
+    ('list', ('functions', {'sizes': [1000, 10000, 100000], 'open_ratio': 1.0,
+        'functions': ['list_issues']})),
+    ('startup', ('commands', {'sizes': [0], 'commands': ['list'],
+        'runs': 20})),
+))
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(
+            usage='Usage: benchmarks.py [options] [{0}]...'.format(
+                '|'.join(SUITES + tuple(PRESETS))))
+    parser.add_option('-s', '--sizes',
+            dest='sizes',
+            default='10000,100000',
+            help='comma-separated tracker sizes, e.g., 10000,1000000.')
+    parser.add_option('--open-ratio',
+            dest='open_ratio',
+            type='float',
+            default=0.5,
+            help='fraction of the issues that are open.')
+    parser.add_option('--milestones',
+            dest='milestones',
+            type='int',
+            default=10,
+            help='number of distinct milestones.')
+    parser.add_option('-r', '--runs',
+            dest='runs',
+            type='int',
+            default=5,
+            help='number of timed runs of each benchmark.')
+    parser.add_option('-f', '--functions',
+            dest='functions',
+            default=','.join(FUNCTIONS),
+            help='comma-separated functions to benchmark.')
+    parser.add_option('-c', '--commands',
+            dest='commands',
+            default=','.join(COMMANDS),
+            help='comma-separated commands to benchmark.')
+    parser.add_option('-o', '--output',
+            dest='output',
+            help='file where the results are saved in JSON.')
+    parser.add_option('-b', '--baseline',
+            dest='baseline',
+            help='JSON results of a previous run to compare with.')
+    parser.add_option('-t', '--tolerance',
+            dest='tolerance',
+            type='float',
+            default=0.2,
+            help='accepted slowdown compared with the baseline.')
+    (options, args) = parser.parse_args()
+    options.sizes = [int(size) for size in options.sizes.split(',')]
+    options.functions = [name for name in options.functions.split(',') if
+            name]
+    options.commands = [name for name in options.commands.split(',') if
+            name]
+    for name in options.functions:
+        if name not in FUNCTIONS:
+            parser.error('unknown function {0}'.format(name))
+    for name in options.commands:
+        if name not in COMMANDS:
+            parser.error('unknown command {0}'.format(name))
+    for name in args:
+        if name not in SUITES and name not in PRESETS:
+            parser.error('unknown suite or preset {0}'.format(name))
+
+    print('{0:<40} {1:>13} {2:>13} {3:>12}'.format('benchmark', 'best',
+        'median', 'peak memory'))
+    suites = [name for name in args if name in SUITES]
+    results = run_benchmarks(options, suites if suites or args else SUITES)
+    for name in args:
+        if name in PRESETS:
+            (suite, overrides) = PRESETS[name]
+            preset_options = dict(vars(options))
+            preset_options.update(overrides)
+            results['results'].update(run_benchmarks(optparse.Values(
+                preset_options), [suite], name)['results'])
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as output:
+            output.write(json.dumps(results, indent=2))
+
+    if options.baseline:
+        with open(options.baseline, 'r', encoding='utf-8') as baseline:
+            regressions = compare(results, json.loads(baseline.read()),
+                    options.tolerance)
+        if regressions:
+            print('\nSlower than the baseline: {0}'.format(
+                ', '.join(regressions)))
+            sys.exit(1)
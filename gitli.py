@@ -4,9 +4,30 @@
 # For python 2 compatibility
 from __future__ import unicode_literals
 import sys
+import os
+import io
+import binascii
+import csv
+import errno
+import gzip
+import heapq
+import optparse
+import json
+import mmap
+import re
+import shlex
+import socket
+import struct
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager, closing
+from functools import wraps
+from itertools import islice
 from codecs import open
 from os.path import split, join, exists
-from os import getcwd, mkdir
+from os import getcwd, mkdir, stat, listdir, remove
+from bisect import bisect_left
 import subprocess
 
 #from traceback import print_exc
@@ -21,15 +42,36 @@ if major < 3:
 else:
     rinput = input
 
-if major == 2 and minor == 6:
-    check_output = lambda a: subprocess.Popen(a,
-            stdout=subprocess.PIPE).communicate()[0]
+if major < 3:
+    import SocketServer as socketserver
 else:
-    check_output = subprocess.check_output
+    import socketserver
+
+check_output = subprocess.check_output
+
+# array.tobytes and array.frombytes are named tostring and fromstring before
+# Python 3.2.
+array_to_bytes = getattr(array, 'tobytes', None) or array.tostring
+array_from_bytes = getattr(array, 'frombytes', None) or array.fromstring
+
+# os.replace is atomic on all platforms but only exists since Python 3.3.
+replace = getattr(os, 'replace', os.rename)
 
+# The gitli lock relies on flock, which is not available on Windows.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-COLOR = ['git', 'config', '--get', 'gitli.color']
-LIST = ['git', 'config', '--get', 'gitli.list.option']
+
+CONFIG = ['git', 'config', '-z', '--get-regexp', r'^(gitli\.|user\.name$)']
+GIT_DIRS = ['git', 'rev-parse', '--git-dir', '--git-common-dir']
+USER_NAME = 'user.name'
+COLOR = 'gitli.color'
+LIST = 'gitli.list.option'
+STORAGE = 'gitli.storage'
+USE_SNAPSHOT = 'gitli.snapshot'
+JOURNAL_STORAGE = 'journal'
 
 DEFAULT_LIST_FILTER = 'all'
 
@@ -40,10 +82,67 @@ OPEN = '.issues-open'
 LAST = '.issues-last'
 CURRENT = '.issues-current'
 COMMENTS = '.issues-comments'
+JOURNAL = '.issues-journal'
+ARCHIVE = '.archive'
+ARCHIVE_SEGMENTS = 'segments'
+IGNORE = '.gitignore'
+CACHE = '.cache'
+OFFSETS = 'offsets'
+COMMENTS_SLOTS = 'comments-slots'
+COMMENTS_ENTRIES = 'comments-entries'
+SNAPSHOT = 'snapshot'
+SOCKET = 'socket'
+LOCK = 'lock'
+POSTINGS = 'postings'
+TOKENS = 'tokens'
+REVISIONS = 'revisions'
+HISTORY = 'history'
+COUNTERS = 'counters'
+INDEX_STAMP = 'stamp'
+TOKENS_VOCABULARY = 'vocabulary'
+TOKENS_POSTINGS = 'postings'
+TOKENS_DELTA = 'delta'
+# The delta of the token index is merged when it holds more records.
+TOKENS_DELTA_LIMIT = 10000
+TOKEN = re.compile(r'\w+', re.UNICODE)
 MSEPARATOR = ','
 OSEPARATOR = '\n'
+ISSUE_RANGE = re.compile(r'^(\d+)(?:-(\d+))?$')
+
+# The number of issues formatted before each write on stdout.
+OUTPUT_CHUNK = 512
+
+# The commands that the client forwards to a running gitli server.
+SERVED_COMMANDS = ('list', 'show', 'search', 'new', 'add', 'open', 'close')
 
 ITYPES = ['Task', 'Bug', 'Enhancement']
+ITYPE_IDS = dict((index + 1, name.lower()) for (index, name) in
+        enumerate(ITYPES))
+
+# The offset index starts with the stamp of the issues file it was built from,
+# followed by one (offset, length) slot per issue number.
+OFFSETS_MAGIC = b'GITLIOF1'
+OFFSETS_HEADER = struct.Struct('<8sqqq')
+OFFSETS_SLOT = struct.Struct('<qq')
+
+# The comment index has one slot per issue number holding the last comment
+# of the issue (entry index + 1, 0 if none) and one entry per comment
+# holding its offset in the comments file and the previous comment of the
+# same issue. The slots file starts with the OFFSETS_HEADER.
+COMMENTS_MAGIC = b'GITLICM1'
+COMMENTS_SLOT = struct.Struct('<q')
+COMMENTS_ENTRY = struct.Struct('<qq')
+
+# The snapshot header holds the stamp of the issues file, the number of
+# issues, and the sizes of the milestone table and of the titles blob. The
+# columns that follow use the native byte order: the snapshot is never shared.
+SNAPSHOT_MAGIC = b'GITLISN1'
+SNAPSHOT_HEADER = struct.Struct('<8sqqqqqq')
+SNAPSHOT_COLUMNS = (('numbers', 'i'), ('types', 'b'), ('milestones', 'I'),
+        ('titles', 'I'))
+
+# The number of snapshots of past issues files kept in the cache.
+REVISIONS_LIMIT = 16
 
 
 class BColors:
@@ -63,15 +162,310 @@ class BColors:
         self.ENDC = ''
 
 
-def is_colored_output():
+# The environment variable that enables the tracing of the gitli phases:
+# 'json' prints the trace as a JSON object on stderr, any other value prints
+# a table.
+TRACE = 'GITLI_TRACE'
+
+# The I/O counters of the process, on Linux only.
+PROC_IO = '/proc/self/io'
+
+
+class Trace(object):
+    '''Accumulates, per phase of a command (e.g., 'config', 'parse',
+    'render'), the wall time, the bytes read and written by the process, and
+    the number of subprocesses started. Phases nest: a phase is only charged
+    with what happens outside of its inner phases, and what happens outside
+    of any phase is charged to 'main'.
     '''
-    :rtype: True if gitli.color is on in the git config.
+
+    def __init__(self):
+        self.phases = OrderedDict((('main', [1, 0.0, 0, 0, 0]),))
+        self.stack = ['main']
+        self.subprocesses = 0
+        self.io_overhead = 0
+        try:
+            self.io_fd = os.open(PROC_IO, os.O_RDONLY)
+        except OSError:
+            self.io_fd = None
+        self.start = time.time()
+        self.sample = self.take_sample()
+
+    def read_io(self):
+        '''
+        :rtype: (bytes read, bytes written) by the process so far or (None,
+        None) if the counters are not available.
+        '''
+        if self.io_fd is None:
+            return (None, None)
+        os.lseek(self.io_fd, 0, os.SEEK_SET)
+        data = os.read(self.io_fd, 4096)
+        counters = dict(line.split(b': ') for line in data.splitlines())
+        # The reads of the counters are not charged to the phases.
+        rchar = int(counters[b'rchar']) - self.io_overhead
+        self.io_overhead += len(data)
+        return (rchar, int(counters[b'wchar']))
+
+    def take_sample(self):
+        (read, written) = self.read_io()
+        return (time.time(), read, written, self.subprocesses)
+
+    def charge(self):
+        '''Charges the current phase with the work done since the last
+        charge.
+        '''
+        sample = self.take_sample()
+        record = self.phases[self.stack[-1]]
+        record[1] += sample[0] - self.sample[0]
+        if sample[1] is not None:
+            record[2] += sample[1] - self.sample[1]
+            record[3] += sample[2] - self.sample[2]
+        record[4] += sample[3] - self.sample[3]
+        self.sample = sample
+
+    @contextmanager
+    def phase(self, name):
+        self.charge()
+        record = self.phases.get(name)
+        if record is None:
+            record = self.phases[name] = [0, 0.0, 0, 0, 0]
+        record[0] += 1
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self.charge()
+            self.stack.pop()
+
+    def iterate(self, name, iterable):
+        '''Yields the items of an iterable, charging the production of the
+        items to the phase name. The items are produced by chunks of
+        OUTPUT_CHUNK so that entering the phase does not dominate the trace.
+        '''
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                chunk = list(islice(iterator, OUTPUT_CHUNK))
+            if not chunk:
+                return
+            for item in chunk:
+                yield item
+
+    def to_dict(self):
+        '''
+        :rtype: The trace as a dict ready to be dumped in JSON. The byte
+        counts are None if the counters are not available.
+        '''
+        self.charge()
+        available = self.io_fd is not None
+        phases = OrderedDict()
+        for (name, (calls, seconds, read, written, subprocesses)) in \
+                self.phases.items():
+            phases[name] = OrderedDict((('calls', calls),
+                ('seconds', seconds),
+                ('bytes_read', read if available else None),
+                ('bytes_written', written if available else None),
+                ('subprocesses', subprocesses)))
+        return OrderedDict((('seconds', time.time() - self.start),
+            ('subprocesses', self.subprocesses), ('phases', phases)))
+
+    def format(self):
+        '''
+        :rtype: The lines of the trace as a table.
+        '''
+        trace = self.to_dict()
+        lines = ['{0:<12} {1:>6} {2:>10} {3:>12} {4:>12} {5:>6}\n'.format(
+            'phase', 'calls', 'ms', 'read', 'written', 'procs')]
+        for (name, phase) in trace['phases'].items():
+            lines.append('{0:<12} {1:>6} {2:>10.2f} {3:>12} {4:>12} '
+                    '{5:>6}\n'.format(name, phase['calls'],
+                        phase['seconds'] * 1000,
+                        '-' if phase['bytes_read'] is None else
+                        phase['bytes_read'],
+                        '-' if phase['bytes_written'] is None else
+                        phase['bytes_written'], phase['subprocesses']))
+        lines.append('{0:<12} {1:>6} {2:>10.2f} {3:>12} {4:>12} '
+                '{5:>6}\n'.format('total', '', trace['seconds'] * 1000, '',
+                    '', trace['subprocesses']))
+        return lines
+
+    def close(self):
+        if self.io_fd is not None:
+            os.close(self.io_fd)
+            self.io_fd = None
+
+
+class NoPhase(object):
+    '''The phase used when tracing is off: it does nothing.'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NO_PHASE = NoPhase()
+
+_trace = None
+
+
+def trace_phase(name):
+    '''
+    :param name: The name of a phase, e.g., 'render'.
+    :rtype: A context manager that charges its block to the phase if tracing
+    is on.
+    '''
+    if _trace is None:
+        return NO_PHASE
+    return _trace.phase(name)
+
+
+def trace_iter(name, iterable):
+    '''
+    :param name: The name of a phase, e.g., 'parse'.
+    :param iterable: An iterable whose items are produced lazily.
+    :rtype: The iterable itself if tracing is off. Otherwise, an iterable of
+    the same items whose production is charged to the phase.
+    '''
+    if _trace is None:
+        return iterable
+    return _trace.iterate(name, iterable)
+
+
+def traced(name):
+    '''Decorates a function so that its calls are charged to the phase name
+    if tracing is on.
+    '''
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _trace is None:
+                return function(*args, **kwargs)
+            with _trace.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_subprocess():
+    '''Counts a subprocess started by gitli in the trace.'''
+    if _trace is not None:
+        _trace.subprocesses += 1
+
+
+@contextmanager
+def tracing(profile=None):
+    '''Traces the phases of the enclosed block if GITLI_TRACE is set and
+    prints the trace on stderr at the end of the block, even if the block
+    exits. Optionally, profiles the block with cProfile.
+
+    :param profile: If not None, the path of the file where the cProfile
+    statistics of the block are dumped (readable with pstats).
+    '''
+    global _trace
+    mode = os.environ.get(TRACE, '').strip().lower()
+    if mode and mode not in ('0', 'off', 'false', 'no'):
+        _trace = Trace()
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        if _trace is not None:
+            (trace, _trace) = (_trace, None)
+            if mode == 'json':
+                sys.stderr.write('{0}\n'.format(json.dumps(trace.to_dict())))
+            else:
+                sys.stderr.write(''.join(trace.format()))
+            trace.close()
+
+
+_config_cache = {}
+
+
+def get_config():
+    '''Reads all the gitli.* keys and user.name of the git config with a
+    single git process. The result is cached for the rest of the process, per
+    working directory.
+
+    :rtype: A dict mapping the lowercase keys (e.g., 'gitli.color') to their
+    values. If a key has several values, the last one wins, like with
+    git config --get.
+    '''
+    cwd = getcwd()
+    config = _config_cache.get(cwd)
+    if config is not None:
+        return config
+
+    config = {}
+    with trace_phase('config'):
+        count_subprocess()
+        try:
+            output = check_output(CONFIG).decode('utf-8')
+        except Exception:
+            # git config exits with 1 when no key matches.
+            output = ''
+
+    for entry in output.split('\0'):
+        if not entry:
+            continue
+        (key, separator, value) = entry.partition('\n')
+        # A key without a value (e.g., "[gitli] color") is a true boolean.
+        config[key.lower()] = value if separator else 'true'
+
+    _config_cache[cwd] = config
+    return config
+
+
+def get_config_paths():
+    '''
+    :rtype: The paths of the files read by git config in the working
+    directory: the config of the repository, whose git directory is resolved
+    by git so .git files and linked work trees are handled, and the global
+    and system configs. Some of the files may not exist.
     '''
     try:
-        value = check_output(COLOR).strip().lower().decode('utf-8')
-        return value in ('auto', 'on', 'true')
+        git_dirs = check_output(GIT_DIRS).decode('utf-8').splitlines()
     except Exception:
-        return False
+        git_dirs = []
+    paths = []
+    for git_dir in git_dirs:
+        # git before 2.5 prints the unknown --git-common-dir as is.
+        if git_dir and not git_dir.startswith('--'):
+            git_dir = os.path.abspath(git_dir)
+            paths.extend((join(git_dir, 'config'),
+                join(git_dir, 'config.worktree')))
+
+    home = os.path.expanduser('~')
+    paths.extend((os.environ.get('GIT_CONFIG_GLOBAL') or join(home,
+        '.gitconfig'), join(os.environ.get('XDG_CONFIG_HOME') or join(home,
+            '.config'), 'git', 'config'),
+        os.environ.get('GIT_CONFIG_SYSTEM') or '/etc/gitconfig'))
+    return list(OrderedDict((config_path, True) for config_path in paths))
+
+
+def is_config_enabled(key):
+    '''
+    :param key: A gitli config key, e.g., 'gitli.snapshot'.
+    :rtype: True if the key is set to a true boolean in the git config.
+    '''
+    return get_config().get(key, '').strip().lower() in ('on', 'true', 'yes',
+            '1')
+
+
+def is_colored_output():
+    '''
+    :rtype: True if gitli.color is on in the git config.
+    '''
+    value = get_config().get(COLOR, '')
+    return value.strip().lower() in ('auto', 'on', 'true')
 
 
 def get_default_list_filter():
@@ -79,14 +473,11 @@ def get_default_list_filter():
     :rtype: The default list filter specified in the git config or
     DEFAULT_LIST_FILTER.
     '''
-    try:
-        value = check_output(LIST)
-        if not value:
-            return DEFAULT_LIST_FILTER
-        else:
-            return value.strip().lower().decode('utf-8')
-    except Exception:
+    value = get_config().get(LIST, '').strip().lower()
+    if not value:
         return DEFAULT_LIST_FILTER
+    else:
+        return value
 
 
 def ask_type(verbose=False, default=1):
@@ -106,14 +497,20 @@ def ask_type(verbose=False, default=1):
 
     if not ttype:
         return default
-    elif ttype in ('1', 'task'):
-        return 1
-    elif ttype in ('2', 'bug'):
-        return 2
-    elif ttype in ('3', 'enhancement'):
-        return 3
     else:
-        return 1
+        return parse_type(ttype) or 1
+
+
+def parse_type(value):
+    '''
+    :param value: An issue type number or name, e.g., '2' or 'bug'.
+    :rtype: The issue type id or None if value is not an issue type.
+    '''
+    value = value.strip().lower()
+    for (type_id, name) in ITYPE_IDS.items():
+        if value in ('{0}'.format(type_id), name):
+            return type_id
+    return None
 
 
 def ask_milestone(path, verbose=False, default=None):
@@ -159,20 +556,42 @@ def remove_open(path, issue_number):
     :param path: The path to the .gitli directory.
     :param issue_number: The issue to close.
     '''
+    update_open(path, [issue_number], [])
+
+
+def update_open(path, closed, opened):
+    '''Removes and adds issue numbers to the issues-open file with a single
+    read and a single write.
+
+    :param path: The path to the .gitli directory.
+    :param closed: The issue numbers to remove.
+    :param opened: The issue numbers to add at the end of the file. They are
+    never added twice.
+    :rtype: A tuple (closed, opened) of the sets of issue numbers whose
+    status changed.
+    '''
+    removed = frozenset(closed) | frozenset(opened)
     with open(join(path, OPEN), 'r', encoding='utf-8') as iopen:
         issues = iopen.read().split(OSEPARATOR)
 
-    new_issues = OSEPARATOR.join((issue for issue in issues if issue !=
-        issue_number))
+    new_issues = [issue for issue in issues if issue and issue not in
+            removed]
+    new_issues.extend(OrderedDict((number, True) for number in opened))
 
-    with open(join(path, OPEN), 'w', encoding='utf-8') as iopen:
-        iopen.write(new_issues)
+    write_file(join(path, OPEN), ''.join('{0}{1}'.format(issue, OSEPARATOR)
+        for issue in new_issues))
 
+    was_open = frozenset(issues)
+    return (frozenset(number for number in closed if number in was_open) -
+            frozenset(opened), frozenset(number for number in opened if
+                number not in was_open))
 
-def get_open_issues(path):
+
+def read_open_file(path):
     '''
     :param path: The path to the .gitli directory.
-    :rtype: A list of issue numbers that are open.
+    :rtype: A list of the issue numbers stored in the issues-open file,
+    ignoring the journal.
     '''
     with open(join(path, OPEN), 'r', encoding='utf-8') as iopen:
         issues = iopen.read().split(OSEPARATOR)
@@ -180,9 +599,85 @@ def get_open_issues(path):
     return issues
 
 
+@traced('open')
+def get_open_issues(path):
+    '''
+    :param path: The path to the .gitli directory.
+    :rtype: A list of issue numbers that are open.
+    '''
+    if has_journal(path):
+        return list(get_journal_state(path).open_issues)
+
+    return read_open_file(path)
+
+
+class IssueFilter(object):
+    '''A filter compiled once from the list filters and applied to every
+    issue. Membership tests use frozensets and the issue types are compared
+    by type id so that filtering an issue is O(1).
+    '''
+
+    def __init__(self, filters, open_issues, milestones, itypes):
+        '''
+        :param filters: A list of filters, [str]. e.g., 'close', '0.1', 'task'.
+        :param open_issues: An iterable of the issue numbers that are open.
+        :param milestones: A list of milestones, [str], that the issue must be
+        associated with. If empty, the issue milestone is not checked.
+        :param itypes: A list of issue types, [str], used to filter the issue.
+        If the list is empty, the issue type is not checked.
+        '''
+        self.open_only = 'open' in filters
+        self.closed_only = 'close' in filters
+        self.open_issues = frozenset(open_issues)
+        self.milestones = frozenset(milestones)
+        self.itypes = frozenset(type_id for (type_id, name) in
+                ITYPE_IDS.items() if name in itypes)
+
+    def __call__(self, issue):
+        '''
+        :param issue: The issue tuple to filter.
+        :rtype: True if the issue passes all filters.
+        '''
+        if self.open_only and issue[0] not in self.open_issues:
+            return False
+
+        if self.closed_only and issue[0] in self.open_issues:
+            return False
+
+        if self.milestones and issue[3] not in self.milestones:
+            return False
+
+        if self.itypes and issue[2] not in self.itypes:
+            return False
+
+        return True
+
+
+def parse_filters(filters):
+    '''Splits the filters provided on the command line.
+
+    :param filters: A list of filters such as ['open', '0.1', 'task']. 'all'
+    disables all filters.
+    :rtype: A tuple (filters, milestones, itypes) of lists of lowercase str.
+    '''
+    filters = [ifilter.strip().lower() for ifilter in filters]
+
+    if 'all' in filters:
+        filters = []
+
+    itypes = [ifilter for ifilter in filters if ifilter in
+        ('task', 'bug', 'enhancement')]
+
+    milestones = [ifilter for ifilter in filters if ifilter not in
+        ('open', 'close', 'task', 'bug', 'enhancement')]
+
+    return (filters, milestones, itypes)
+
+
 def filter_issues(issue, filters, open_issues, milestones, itypes):
     '''Indicate whether or not an issue should be displayed (True) or not
-    (False).
+    (False). To filter many issues, build an IssueFilter once instead.
+
     :param issue: The issue tuple to filter.
     (issue_number, title, issue_type, milestone)
     :param filters: A list of filters, [str]. e.g., 'close', '0.1', 'task'.
@@ -194,265 +689,2879 @@ def filter_issues(issue, filters, open_issues, milestones, itypes):
     :rtype: True if the issue passes all filters and can be displayed. False
     otherwise.
     '''
-    if 'open' in filters and issue[0] not in open_issues:
-        return False
+    return IssueFilter(filters, open_issues, milestones, itypes)(issue)
 
-    if 'close' in filters and issue[0] in open_issues:
-        return False
 
-    if len(milestones) > 0 and issue[3] not in milestones:
-        return False
+def parse_issue(lines):
+    '''
+    :param lines: The four lines of an issue record.
+    :rtype: A tuple (issue_number, title, issue_type, milestone).
+    '''
+    return (
+        lines[0].strip(),
+        lines[1].strip(),
+        int(lines[2].strip()),
+        lines[3].strip())
 
-    if len(itypes) > 0 and ITYPES[issue[2] - 1].lower() not in itypes:
-        return False
 
-    return True
+def format_issue(issue):
+    '''
+    :param issue: A tuple (issue_number, title, issue_type, milestone).
+    :rtype: The record representing the issue in the issues file.
+    '''
+    return '{0}\n{1}\n{2}\n{3}\n'.format(issue[0], issue[1], issue[2],
+            issue[3])
 
 
-def get_issue(path, issue_number):
-    '''Return a tuple (issue_number, title, issue_type, milestone).
+def get_stamp(file_path):
+    '''
+    :param file_path: The path of the file to stamp.
+    :rtype: A tuple (mtime, size, inode) that changes whenever the file is
+    modified, or None if the file does not exist.
+    '''
+    try:
+        file_stat = stat(file_path)
+    except OSError:
+        return None
+    mtime = getattr(file_stat, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(file_stat.st_mtime * 1000000000)
+    return (mtime, file_stat.st_size, file_stat.st_ino)
+
+
+def get_cache_path(path, name):
+    '''Return the path of a cache file, creating the cache directory if
+    necessary. Cache files can be deleted at any time: they are rebuilt from
+    the gitli files when needed. The cache directory ignores itself with a
+    .gitignore, so the caches of existing .gitli directories are never
+    committed either.
 
     :param path: The path to the .gitli directory.
-    :param issue_number: The number of the issue to retrieve.
-    :rtype: A tuple representing the issue or None if not found.
+    :param name: The name of the cache file.
     '''
-
-    with open(join(path, ISSUES), 'r', encoding='utf-8') as issues_file:
-        lines = issues_file.readlines()
-    size = len(lines)
-    index = 0
-    issue = None
-    while index < size:
-        issue = (
-            lines[index].strip(),
-            lines[index + 1].strip(),
-            int(lines[index + 2].strip()),
-            lines[index + 3].strip())
-        if issue[0] == issue_number:
-            break
+    cache_dir = join(path, CACHE)
+    if not exists(cache_dir):
+        try:
+            mkdir(cache_dir)
+        except OSError as error:
+            # Another gitli process may have created it in the meantime.
+            if error.errno != errno.EEXIST:
+                raise
         else:
-            issue = None
-            index += 4
+            with open(join(cache_dir, IGNORE), 'w', encoding='utf-8') as \
+                    ignore:
+                ignore.write('*\n')
+    return join(cache_dir, name)
 
-    return issue
 
+_lock_depths = {}
 
-def get_issues(path, filters, open_issues, milestones, itypes):
-    '''Returns a list of issues that match the filters.
-    [(issue_number, title, issue_type, milestone)]
+
+@contextmanager
+def gitli_lock(path):
+    '''Holds an exclusive lock on the .gitli directory, so that concurrent
+    gitli processes modify the issue files one at a time. The lock is
+    reentrant within a process and is released when the process dies.
 
     :param path: The path to the .gitli directory.
-    :param filters: A list of filters, [str]. e.g., 'close', '0.1', 'task'.
-    :param open_issues: A list of the issue numbers that are open. [str]
-    :param milestones: A list of milestones, [str], that the issue must be
-    associated with. If empty, the issue milestone is not checked.
-    :param itypes: A list of issue types, [str], used to filter the issue. If
-    the list is empty, the issue type is not checked.
-    :rtype: A list of issue tuples matching the filters.
     '''
-    with open(join(path, ISSUES), 'r', encoding='utf-8') as issues_file:
-        lines = issues_file.readlines()
-    issues = []
-    size = len(lines)
-    index = 0
-    while index < size:
-        issue = (
-            lines[index].strip(),
-            lines[index + 1].strip(),
-            int(lines[index + 2].strip()),
-            lines[index + 3].strip())
-        if filter_issues(issue, filters, open_issues, milestones, itypes):
-            issues.append(issue)
-        index += 4
+    depth = _lock_depths.get(path, 0)
+    if depth or fcntl is None:
+        _lock_depths[path] = depth + 1
+        try:
+            yield
+        finally:
+            _lock_depths[path] = depth
+        return
 
-    return issues
+    with open(get_cache_path(path, LOCK), 'ab') as lock_file:
+        with trace_phase('lock'):
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        _lock_depths[path] = 1
+        try:
+            yield
+        finally:
+            _lock_depths[path] = 0
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
 
 
-def print_issues(issues, open_issues, bcolor):
-    '''Prints the issues on stdout.
-    [(issue_number, title, issue_type, milestone)]
+def locked(function):
+    '''Decorates a function whose first argument is the path to the .gitli
+    directory so that it runs while holding the gitli lock.
+    '''
+    @wraps(function)
+    def wrapper(path, *args, **kwargs):
+        with gitli_lock(path):
+            return function(path, *args, **kwargs)
+    return wrapper
 
-    :param issues: The list of tuples representing the issues to print.
-    :param open_issues: The list of the issue numbers that are open.
-    :param bcolor: An instance of the BColors class used to colorize the
-    output.
+
+@traced('write')
+def write_cache(cache_path, data):
+    '''Writes a cache file in a temporary file and moves it in place so
+    readers never see a partial cache.
+
+    :param cache_path: The path of the cache file.
+    :param data: The bytes to write.
     '''
-    for (number, title, type_id, milestone) in issues:
-        if number in open_issues:
-            open_text = 'open'
-            color = bcolor.YELLOW
-        else:
-            open_text = 'closed'
-            color = bcolor.GREEN
+    temp_path = '{0}.{1}.tmp'.format(cache_path, os.getpid())
+    with open(temp_path, 'wb') as cache_file:
+        cache_file.write(data)
+    replace(temp_path, cache_path)
 
-        milestone_text = '[' + milestone + ']'
-        type_text = '[' + ITYPES[type_id - 1] + ']'
 
-        print('{5}#{0:<4}{9} {6}{1:<48}{9} {7}{2:<6} {3:<7}{9} - {8}{4}{9}'
-            .format(number, title, type_text, milestone_text, open_text,
-            bcolor.CYAN, bcolor.WHITE, bcolor.BLUE, color, bcolor.ENDC))
+def iter_record_spans(issues_file):
+    '''Yields (offset, length, lines) for each issue record of an issues file
+    opened in binary mode.
 
+    :param issues_file: A file object opened in binary mode.
+    '''
+    offset = 0
+    start = 0
+    lines = []
+    for line in issues_file:
+        if not lines:
+            start = offset
+        lines.append(line)
+        offset += len(line)
+        if len(lines) == 4:
+            yield (start, offset - start, lines)
+            lines = []
 
-def init(path):
-    '''Initialize the .gitli directory by creating the gitli files.
+
+def build_offset_index(path):
+    '''Builds the offset index of the issues file and saves it in the cache.
 
     :param path: The path to the .gitli directory.
+    :rtype: The stamp of the indexed issues file and a bytearray of slots.
     '''
-    if not exists(path):
-        mkdir(path)
+    issues_path = join(path, ISSUES)
+    stamp = get_stamp(issues_path)
+    spans = []
+    top = 0
+    with open(issues_path, 'rb') as issues_file:
+        for (offset, length, lines) in iter_record_spans(issues_file):
+            number = int(lines[0].strip())
+            top = max(top, number)
+            spans.append((number, offset, length))
 
-    new_path = join(path, ISSUES)
-    if not exists(new_path):
-        open(new_path, 'w', encoding='utf-8').close()
+    slots = bytearray(OFFSETS_SLOT.size * (top + 1))
+    for (number, offset, length) in spans:
+        OFFSETS_SLOT.pack_into(slots, number * OFFSETS_SLOT.size, offset,
+                length)
 
-    new_path = join(path, OPEN)
-    if not exists(new_path):
-        open(new_path, 'w', encoding='utf-8').close()
+    header = OFFSETS_HEADER.pack(OFFSETS_MAGIC, *stamp)
+    write_cache(get_cache_path(path, OFFSETS), header + bytes(slots))
+    return (stamp, slots)
 
-    new_path = join(path, COMMENTS)
-    if not exists(new_path):
-        open(new_path, 'w', encoding='utf-8').close()
 
-    new_path = join(path, LAST)
-    if not exists(new_path):
-        with open(new_path, 'w', encoding='utf-8') as last:
-            last.write('0')
+def read_offset_slot(index_path, stamp, number):
+    '''
+    :param index_path: The path of the offset index.
+    :param stamp: The current stamp of the issues file.
+    :param number: The issue number to look up.
+    :rtype: False if the index is missing or stale, None if the issue is not
+    in the index, and a tuple (offset, length) otherwise.
+    '''
+    try:
+        index_file = open(index_path, 'rb')
+    except IOError:
+        return False
 
-    new_path = join(path, CURRENT)
-    if not exists(new_path):
-        with open(new_path, 'w', encoding='utf-8') as current:
-            current.write('0.1')
+    with index_file:
+        header = index_file.read(OFFSETS_HEADER.size)
+        if len(header) != OFFSETS_HEADER.size:
+            return False
+        values = OFFSETS_HEADER.unpack(header)
+        if values[0] != OFFSETS_MAGIC or values[1:] != stamp:
+            return False
+        index_file.seek(OFFSETS_HEADER.size + number * OFFSETS_SLOT.size)
+        slot = index_file.read(OFFSETS_SLOT.size)
 
+    if len(slot) != OFFSETS_SLOT.size:
+        return None
+    (offset, length) = OFFSETS_SLOT.unpack(slot)
+    if length == 0:
+        return None
+    return (offset, length)
 
-def new_issue(path, title, verbose=False):
-    '''Creates a new issue: add the issue to the issues file, add the issue
-    number to the issues-open file, and increment the last issue number in
-    issues-last.
+
+def get_issue_span(path, issue_number):
+    '''Looks up the position of an issue in the issues file using the offset
+    index. The index is rebuilt if the issues file changed since it was built.
 
     :param path: The path to the .gitli directory.
-    :param title: The title of the issue.
-    :param verbose: If True, ask the user for the issue type and milestone.
+    :param issue_number: The number of the issue to find.
+    :rtype: A tuple (offset, length) or None if the issue does not exist.
     '''
-    with open(join(path, LAST), 'r', encoding='utf-8') as last:
-        issue_number = int(last.read().strip()) + 1
+    try:
+        number = int(issue_number)
+    except ValueError:
+        return None
+    if number < 0:
+        return None
 
-    ttype = ask_type(verbose)
-    milestone = ask_milestone(path, verbose)
+    stamp = get_stamp(join(path, ISSUES))
+    span = read_offset_slot(get_cache_path(path, OFFSETS), stamp, number)
+    if span is not False:
+        return span
 
-    with open(join(path, ISSUES), 'a', encoding='utf-8') as issues:
-        issues.write('{0}\n{1}\n{2}\n{3}\n'.format(issue_number, title,
-            ttype, milestone))
+    (stamp, slots) = build_offset_index(path)
+    position = number * OFFSETS_SLOT.size
+    if position >= len(slots):
+        return None
+    (offset, length) = OFFSETS_SLOT.unpack_from(slots, position)
+    if length == 0:
+        return None
+    return (offset, length)
 
-    add_open(path, issue_number)
 
-    with open(join(path, LAST), 'w', encoding='utf-8') as last:
-        last.write('{0}'.format(issue_number))
+def open_offset_index(path):
+    '''
+    :param path: The path to the .gitli directory.
+    :rtype: The offset index opened in binary mode. The index is rebuilt
+    first if the issues file changed since it was built.
+    '''
+    index_path = get_cache_path(path, OFFSETS)
+    if read_offset_slot(index_path, get_stamp(join(path, ISSUES)), 0) is \
+            False:
+        build_offset_index(path)
+    return open(index_path, 'rb')
 
 
-def close_issue(path, issue_number):
-    '''Closes the issue by removing its number from the issues-open file.
+def set_offset_slot(path, stamp, number, span):
+    '''Records the position of an issue appended to the issues file in the
+    offset index. The index must be up to date before the append.
 
     :param path: The path to the .gitli directory.
-    :param issue_number: The number of the issue to close.
+    :param stamp: The new stamp of the issues file.
+    :param number: The number of the issue.
+    :param span: The (offset, length) of the issue in the issues file.
     '''
-    remove_open(path, issue_number)
+    # The header is written last: if the slot is not written, the index keeps
+    # the old stamp and is rebuilt.
+    with open(get_cache_path(path, OFFSETS), 'r+b') as index_file:
+        index_file.seek(OFFSETS_HEADER.size + number * OFFSETS_SLOT.size)
+        index_file.write(OFFSETS_SLOT.pack(*span))
+        index_file.seek(0)
+        index_file.write(OFFSETS_HEADER.pack(OFFSETS_MAGIC, *stamp))
 
 
-def list_issues(path, filters=None, bcolor=BColors()):
-    '''Prints a list of issues matching the provided filters.
+def iter_issue_records_by_number(path, numbers):
+    '''Yields the issues of the issues file whose numbers are provided,
+    ignoring the journal. Each issue is read with one seek in the offset
+    index and one seek in the issues file.
 
     :param path: The path to the .gitli directory.
-    :param filters: A list of filters such as ['open', '0.1', 'task']
-    :param bcolor: An instance of the BColors class to colorize the output.
+    :param numbers: An iterable of issue numbers, [int].
+    :rtype: A generator of issue tuples. Unknown numbers are skipped.
     '''
-    if filters is None or len(filters) == 0:
-        filters = [get_default_list_filter()]
-    else:
-        filters = [ifilter.strip().lower() for ifilter in filters]
+    for (offset, data) in iter_located_records(path, numbers):
+        yield parse_issue(data.decode('utf-8').split('\n'))
 
-    if 'all' in filters:
-        filters = []
 
-    open_issues = get_open_issues(path)
+def iter_located_records(path, numbers):
+    '''
+    :param path: The path to the .gitli directory.
+    :param numbers: An iterable of issue numbers, [int].
+    :rtype: A generator of (offset, record) where record are the bytes of
+    the issue in the issues file. Unknown numbers are skipped.
+    '''
+    with open_offset_index(path) as index_file:
+        with open(join(path, ISSUES), 'rb') as issues_file:
+            for number in numbers:
+                index_file.seek(OFFSETS_HEADER.size + number *
+                        OFFSETS_SLOT.size)
+                slot = index_file.read(OFFSETS_SLOT.size)
+                if len(slot) != OFFSETS_SLOT.size:
+                    continue
+                (offset, length) = OFFSETS_SLOT.unpack(slot)
+                if length == 0:
+                    continue
+                issues_file.seek(offset)
+                yield (offset, issues_file.read(length))
+
 
-    itypes = [ifilter for ifilter in filters if ifilter in
-        ('task', 'bug', 'enhancement')]
+def restamp_offset_index(path):
+    '''Marks the offset index as up to date after the issues file was
+    modified without moving any record.
 
-    milestones = [ifilter for ifilter in filters if ifilter not in
-        ('open', 'close', 'task', 'bug', 'enhancement')]
+    :param path: The path to the .gitli directory.
+    '''
+    with open(get_cache_path(path, OFFSETS), 'r+b') as index_file:
+        index_file.write(OFFSETS_HEADER.pack(OFFSETS_MAGIC,
+            *get_stamp(join(path, ISSUES))))
 
-    issues = get_issues(path, filters, open_issues, milestones, itypes)
 
-    print_issues(issues, open_issues, bcolor)
+@traced('write')
+def patch_issues_file(path, patches):
+    '''Replaces byte ranges of the issues file. If every patch keeps the
+    same length, the file is modified in place and the records do not move.
+    Unlike the other writes, this is not atomic: an interrupted write can
+    leave a record partly patched. Otherwise, the file is rewritten by
+    copying the bytes between the patches, without parsing any record.
 
-    # Useful for testing
-    return issues
+    :param path: The path to the .gitli directory.
+    :param patches: A list of (offset, old_length, new_bytes) sorted by
+    offset.
+    :rtype: True if the file was modified in place.
+    '''
+    issues_path = join(path, ISSUES)
+    if all(old_length == len(data) for (offset, old_length, data) in
+            patches):
+        with open(issues_path, 'r+b') as issues_file:
+            for (offset, old_length, data) in patches:
+                issues_file.seek(offset)
+                issues_file.write(data)
+        return True
 
+    temp_path = '{0}.{1}.tmp'.format(issues_path, os.getpid())
+    with open(issues_path, 'rb') as issues_file:
+        with open(temp_path, 'wb') as temp:
+            position = 0
+            for (offset, old_length, data) in patches:
+                copy_bytes(issues_file, temp, offset - position)
+                temp.write(data)
+                issues_file.seek(old_length, os.SEEK_CUR)
+                position = offset + old_length
+            copy_bytes(issues_file, temp, -1)
+            sync_file(temp)
+    replace(temp_path, issues_path)
+    return False
 
-def move_issues(path, milestone):
-    '''Updates the milestone of all open issues.
 
-    :param path: The path to the .gitli directory.
-    :param milestone: The new milestone
+def sync_file(file_object):
+    '''Flushes a file to the disk, so that a temporary file moved in place
+    of an issue file survives a crash.
     '''
-    open_issues = get_open_issues(path)
-    issues = get_issues(path, [], [], [], [])
+    file_object.flush()
+    os.fsync(file_object.fileno())
 
-    with open(join(path, ISSUES), 'w', encoding='utf-8') as issues_file:
-        for (number, title, itype, imilestone) in issues:
-            if number in open_issues:
-                imilestone = milestone
-            issues_file.write('{0}\n{1}\n{2}\n{3}\n'.format(
-                    number,
-                    title,
-                    itype,
-                    imilestone
-                    ))
 
+def copy_bytes(source, destination, size, chunk_size=1 << 20):
+    '''Copies size bytes (or everything if size is negative) from a file to
+    another by chunks.
+    '''
+    while size != 0:
+        data = source.read(chunk_size if size < 0 else min(size, chunk_size))
+        if not data:
+            break
+        destination.write(data)
+        if size > 0:
+            size -= len(data)
 
-def reopen_issue(path, issue_number):
-    '''Reopens an issue by adding its number back to the issues-open file.
-    If the issue is already opened, this operation does nothing.
 
+def read_issue_record(path, span):
+    '''
     :param path: The path to the .gitli directory.
-    :param issue_number: The number of the issue to reopen.
+    :param span: The (offset, length) of the issue in the issues file.
+    :rtype: The issue tuple stored at this position.
     '''
-    # To make sure that we don't add the issue twice... that would be bad
-    remove_open(path, issue_number)
-    add_open(path, issue_number)
+    (offset, length) = span
+    with open(join(path, ISSUES), 'rb') as issues_file:
+        issues_file.seek(offset)
+        data = issues_file.read(length)
+    return parse_issue(data.decode('utf-8').split('\n'))
 
 
-def show_issue(path, issue_number, bcolor=BColors()):
-    '''Prints information about an issue.
+def replace_issue_record(path, span, record):
+    '''Replaces the bytes of an issue record in the issues file without
+    parsing the other records.
 
     :param path: The path to the .gitli directory.
-    :param issue_number: The number of the issue to display.
-    :param bcolor: A BColors instance to colorize the output.
+    :param span: The (offset, length) of the issue in the issues file.
+    :param record: The new record (an empty string removes the issue).
     '''
-    issue = get_issue(path, issue_number)
-    if issue is not None:
-        open_issues = get_open_issues(path)
-        print_issues([issue], open_issues, bcolor)
-    else:
-        print('Issue #{0} not found'.format(issue_number))
+    (offset, length) = span
+    patch_issues_file(path, [(offset, length, record.encode('utf-8'))])
 
 
-def edit_issue(path, issue_number):
+@traced('parse')
+def get_issue(path, issue_number):
+    '''Return a tuple (issue_number, title, issue_type, milestone).
+
+    :param path: The path to the .gitli directory.
+    :param issue_number: The number of the issue to retrieve.
+    :rtype: A tuple representing the issue or None if not found.
+    '''
+    span = get_issue_span(path, issue_number)
+    if span is None:
+        return None
+
+    issue = read_issue_record(path, span)
+    if has_journal(path):
+        issue = get_journal_state(path).apply(issue)
+    return issue
+
+
+def format_comment(comment):
+    '''
+    :param comment: A tuple (issue_number, date, author, text).
+    :rtype: The record representing the comment in the comments file, a JSON
+    array on one line.
+    '''
+    return '{0}\n'.format(json.dumps([int(comment[0])] + list(comment[1:])))
+
+
+def parse_comment(line):
+    '''
+    :param line: A line of the comments file, in bytes.
+    :rtype: A tuple (issue_number, date, author, text).
+    '''
+    (number, date, author, text) = json.loads(line.decode('utf-8'))
+    return ('{0}'.format(number), date, author, text)
+
+
+def read_comment_header(path):
+    '''
+    :param path: The path to the .gitli directory.
+    :rtype: The stamp of the comments file recorded in the comment index, or
+    None if the index is missing.
+    '''
+    try:
+        with open(get_cache_path(path, COMMENTS_SLOTS), 'rb') as slots_file:
+            header = slots_file.read(OFFSETS_HEADER.size)
+    except IOError:
+        return None
+    if len(header) != OFFSETS_HEADER.size:
+        return None
+    values = OFFSETS_HEADER.unpack(header)
+    if values[0] != COMMENTS_MAGIC:
+        return None
+    return values[1:]
+
+
+def build_comment_index(path):
+    '''Builds the comment index of the comments file in a single pass and
+    saves it in the cache.
+
+    :param path: The path to the .gitli directory.
+    :rtype: A tuple (slots, entries) of lists, two values per entry.
+    '''
+    comments_path = join(path, COMMENTS)
+    stamp = get_stamp(comments_path)
+    # Lists rather than arrays: the 'q' type code is missing before Python
+    # 3.3.
+    (slots, entries) = ([], [])
+    with open(comments_path, 'rb') as comments_file:
+        offset = 0
+        for line in comments_file:
+            if line.strip():
+                number = int(line[1:line.index(b',')])
+                if number >= len(slots):
+                    slots.extend([0] * (number + 1 - len(slots)))
+                entries.append(offset)
+                entries.append(slots[number])
+                slots[number] = len(entries) // 2
+            offset += len(line)
+
+    write_cache(get_cache_path(path, COMMENTS_ENTRIES), struct.pack(
+        '<{0}q'.format(len(entries)), *entries))
+    write_cache(get_cache_path(path, COMMENTS_SLOTS),
+            OFFSETS_HEADER.pack(COMMENTS_MAGIC, *stamp) + struct.pack(
+                '<{0}q'.format(len(slots)), *slots))
+    return (slots, entries)
+
+
+def get_comment_offsets(path, issue_number):
+    '''Looks up the comments of an issue in the comment index, which is
+    rebuilt first if the comments file changed since it was built. Only the
+    entries of this issue are read.
+
+    :param path: The path to the .gitli directory.
+    :param issue_number: The number of the issue.
+    :rtype: The offsets of the comments in the comments file, oldest first.
+    '''
+    number = int(issue_number)
+    stamp = get_stamp(join(path, COMMENTS))
+    if stamp is None or stamp[1] == 0:
+        return []
+
+    offsets = []
+    if read_comment_header(path) == stamp:
+        with open(get_cache_path(path, COMMENTS_SLOTS), 'rb') as slots_file:
+            slots_file.seek(OFFSETS_HEADER.size + number *
+                    COMMENTS_SLOT.size)
+            slot = slots_file.read(COMMENTS_SLOT.size)
+        last = COMMENTS_SLOT.unpack(slot)[0] if len(slot) == \
+                COMMENTS_SLOT.size else 0
+        with open(get_cache_path(path, COMMENTS_ENTRIES), 'rb') as \
+                entries_file:
+            while last:
+                entries_file.seek((last - 1) * COMMENTS_ENTRY.size)
+                (offset, last) = COMMENTS_ENTRY.unpack(entries_file.read(
+                    COMMENTS_ENTRY.size))
+                offsets.append(offset)
+    else:
+        (slots, entries) = build_comment_index(path)
+        last = slots[number] if number < len(slots) else 0
+        while last:
+            offsets.append(entries[(last - 1) * 2])
+            last = entries[(last - 1) * 2 + 1]
+
+    offsets.reverse()
+    return offsets
+
+
+@traced('comments')
+def get_comments(path, issue_number):
+    '''
+    :param path: The path to the .gitli directory.
+    :param issue_number: The number of the issue.
+    :rtype: A list of the comments of the issue, oldest first. Each comment
+    is a tuple (issue_number, date, author, text).
+    '''
+    offsets = get_comment_offsets(path, issue_number)
+    comments = []
+    if offsets:
+        with open(join(path, COMMENTS), 'rb') as comments_file:
+            for offset in offsets:
+                comments_file.seek(offset)
+                comments.append(parse_comment(comments_file.readline()))
+    return comments
+
+
+@locked
+def add_comment(path, issue_number, text, author=None, date=None):
+    '''Appends a comment to the comments file and to the comment index if the
+    index is up to date.
+
+    :param path: The path to the .gitli directory.
+    :param issue_number: The number of the issue.
+    :param text: The text of the comment.
+    :param author: The author of the comment. The default is the git
+    user.name.
+    :param date: The date of the comment, e.g., '2012-04-01 14:00'. The
+    default is the current UTC time.
+    '''
+    if author is None:
+        author = get_config().get(USER_NAME, '')
+    if date is None:
+        date = time.strftime('%Y-%m-%d %H:%M', time.gmtime())
+    record = format_comment((issue_number, date, author, text)).encode(
+            'utf-8')
+
+    comments_path = join(path, COMMENTS)
+    stamp = get_stamp(comments_path)
+    fresh = stamp is not None and read_comment_header(path) == stamp
+
+    with open(comments_path, 'ab') as comments_file:
+        comments_file.write(record)
+
+    # The new comment is linked to the previous comment of the issue instead
+    # of rebuilding the index.
+    if fresh:
+        number = int(issue_number)
+        slots_path = get_cache_path(path, COMMENTS_SLOTS)
+        entries_path = get_cache_path(path, COMMENTS_ENTRIES)
+        with open(slots_path, 'r+b') as slots_file:
+            slots_file.seek(OFFSETS_HEADER.size + number *
+                    COMMENTS_SLOT.size)
+            slot = slots_file.read(COMMENTS_SLOT.size)
+            previous = COMMENTS_SLOT.unpack(slot)[0] if len(slot) == \
+                    COMMENTS_SLOT.size else 0
+            with open(entries_path, 'ab') as entries_file:
+                entries_file.write(COMMENTS_ENTRY.pack(stamp[1], previous))
+                last = entries_file.tell() // COMMENTS_ENTRY.size
+            slots_file.seek(OFFSETS_HEADER.size + number *
+                    COMMENTS_SLOT.size)
+            slots_file.write(COMMENTS_SLOT.pack(last))
+            slots_file.seek(0)
+            slots_file.write(OFFSETS_HEADER.pack(COMMENTS_MAGIC,
+                *get_stamp(comments_path)))
+
+
+def remove_comments(path, issue_numbers):
+    '''Removes the comments of several issues, rewriting the comments file
+    only if one of the issues has comments.
+
+    :param path: The path to the .gitli directory.
+    :param issue_numbers: The numbers of the issues.
+    '''
+    numbers = frozenset(int(number) for number in issue_numbers if
+            '{0}'.format(number).isdigit())
+    if not any(get_comment_offsets(path, number) for number in numbers):
+        return
+
+    comments_path = join(path, COMMENTS)
+    temp_path = '{0}.{1}.tmp'.format(comments_path, os.getpid())
+    with open(comments_path, 'rb') as comments_file:
+        with open(temp_path, 'wb') as temp:
+            for line in comments_file:
+                if line.strip() and int(line[1:line.index(b',')]) not in \
+                        numbers:
+                    temp.write(line)
+            sync_file(temp)
+    replace(temp_path, comments_path)
+
+
+def iter_issues(path, reverse=False):
+    '''Yields the issues one at a time, reading the issues file lazily so
+    that callers can stop early and memory use stays constant. Changes
+    recorded in the journal are applied to the issues.
+
+    :param path: The path to the .gitli directory.
+    :param reverse: If True, the issues are yielded from the last to the
+    first, i.e., from the newest to the oldest.
+    :rtype: A generator of tuples (issue_number, title, issue_type,
+    milestone).
+    '''
+    if not has_journal(path):
+        return iter_issue_records(path, reverse)
+
+    state = get_journal_state(path)
+    return (issue for issue in (state.apply(record) for record in
+        iter_issue_records(path, reverse)) if issue is not None)
+
+
+# The server keeps the parsed issues files in memory: path -> (stamp, list).
+_records_cache = None
+
+
+def iter_issue_records(path, reverse=False):
+    '''Yields the issues stored in the issues file, ignoring the journal.
+
+    :param path: The path to the .gitli directory.
+    :param reverse: If True, the issues are yielded from the last to the
+    first.
+    :rtype: An iterator of tuples (issue_number, title, issue_type,
+    milestone).
+    '''
+    if _records_cache is None:
+        if reverse:
+            return read_issue_records_reversed(path)
+        return read_issue_records(path)
+
+    stamp = get_stamp(join(path, ISSUES))
+    cached = _records_cache.get(path)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, list(read_issue_records(path)))
+        _records_cache[path] = cached
+    if reverse:
+        return reversed(cached[1])
+    return iter(cached[1])
+
+
+def read_issue_records(path):
+    '''Reads the issues file lazily.
+
+    :param path: The path to the .gitli directory.
+    :rtype: A generator of issue tuples.
+    '''
+    # Only \n ends a line, like in the offset index.
+    with io.open(join(path, ISSUES), 'r', encoding='utf-8',
+            newline='\n') as issues_file:
+        for issue in parse_issue_lines(issues_file):
+            yield issue
+
+
+def read_issue_records_reversed(path, block_size=1 << 16):
+    '''Reads the issues file lazily from the end, by blocks, so that the
+    newest issues are read first and the oldest are never read if the caller
+    stops early.
+
+    :param path: The path to the .gitli directory.
+    :param block_size: The number of bytes read at a time.
+    :rtype: A generator of issue tuples, from the last to the first.
+    '''
+    with open(join(path, ISSUES), 'rb') as issues_file:
+        issues_file.seek(0, os.SEEK_END)
+        position = issues_file.tell()
+        if position:
+            issues_file.seek(position - 1)
+            if issues_file.read(1) == b'\n':
+                position -= 1
+        lines = []
+        remainder = b''
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            issues_file.seek(position)
+            # A new line byte never occurs inside an UTF-8 character.
+            block_lines = (issues_file.read(size) + remainder).split(b'\n')
+            remainder = block_lines[0] if position else None
+            for line in reversed(block_lines[1 if position else 0:]):
+                lines.append(line)
+                if len(lines) == 4:
+                    lines.reverse()
+                    yield parse_issue([line.decode('utf-8') for line in
+                        lines])
+                    lines = []
+
+
+def parse_issue_lines(issue_lines):
+    '''
+    :param issue_lines: An iterable of the lines of an issues file.
+    :rtype: A generator of issue tuples.
+    '''
+    lines = []
+    for line in issue_lines:
+        lines.append(line)
+        if len(lines) == 4:
+            yield parse_issue(lines)
+            lines = []
+
+
+def get_issues(path, filters, open_issues, milestones, itypes):
+    '''Returns a list of issues that match the filters.
+    [(issue_number, title, issue_type, milestone)]
+
+    :param path: The path to the .gitli directory.
+    :param filters: A list of filters, [str]. e.g., 'close', '0.1', 'task'.
+    :param open_issues: An iterable of the issue numbers that are open. [str]
+    :param milestones: A list of milestones, [str], that the issue must be
+    associated with. If empty, the issue milestone is not checked.
+    :param itypes: A list of issue types, [str], used to filter the issue. If
+    the list is empty, the issue type is not checked.
+    :rtype: A list of issue tuples matching the filters.
+    '''
+    issue_filter = IssueFilter(filters, open_issues, milestones, itypes)
+    return list(iter_selected_issues(path, issue_filter))
+
+
+def iter_selected_issues(path, issue_filter, reverse=False):
+    '''Yields the issues that pass a filter. If the filter has milestones or
+    issue types, only the issues found in their posting lists are read.
+    Otherwise, if gitli.snapshot is enabled, the filter is applied to the
+    columns of the snapshot and only the issues that pass are decoded.
+
+    :param path: The path to the .gitli directory.
+    :param issue_filter: An IssueFilter instance.
+    :param reverse: If True, the issues are yielded from the newest to the
+    oldest.
+    :rtype: A generator of issue tuples.
+    '''
+    if issue_filter.milestones or issue_filter.itypes:
+        return trace_iter('parse', iter_posted_issues(path, issue_filter,
+            reverse))
+
+    if is_config_enabled(USE_SNAPSHOT) and not has_journal(path):
+        return trace_iter('parse', get_snapshot(path).select(issue_filter,
+            reverse))
+
+    return trace_iter('filter', (issue for issue in trace_iter('parse',
+        iter_issues(path, reverse)) if issue_filter(issue)))
+
+
+class Snapshot(object):
+    '''A columnar copy of the issues file. The numbers, the type ids, the
+    milestone ids and the title offsets are stored in typed arrays and the
+    titles are decoded from the memory-mapped file only when an issue is
+    selected, so an issue costs a dozen bytes of memory.
+    '''
+
+    def __init__(self, snapshot_file):
+        '''
+        :param snapshot_file: The snapshot file opened in binary mode.
+        '''
+        self.data = mmap.mmap(snapshot_file.fileno(), 0,
+                access=mmap.ACCESS_READ)
+        values = SNAPSHOT_HEADER.unpack_from(self.data, 0)
+        (magic, self.stamp) = (values[0], values[1:4])
+        (count, milestones_size, titles_size) = values[4:]
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('Invalid snapshot')
+
+        position = SNAPSHOT_HEADER.size
+        for (name, typecode) in SNAPSHOT_COLUMNS:
+            column = array(typecode)
+            size = column.itemsize * (count + (name == 'titles'))
+            array_from_bytes(column, self.data[position:position + size])
+            setattr(self, name, column)
+            position += size
+
+        self.milestone_names = json.loads(self.data[position:position +
+            milestones_size].decode('utf-8'))
+        self.titles_position = position + milestones_size
+        if self.titles_position + titles_size != len(self.data):
+            raise ValueError('Truncated snapshot')
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def issue(self, index):
+        '''
+        :param index: The position of the issue in the issues file.
+        :rtype: The issue tuple.
+        '''
+        start = self.titles_position + self.titles[index]
+        end = self.titles_position + self.titles[index + 1]
+        return ('{0}'.format(self.numbers[index]),
+                self.data[start:end].decode('utf-8'),
+                self.types[index],
+                self.milestone_names[self.milestones[index]])
+
+    def select(self, issue_filter, reverse=False):
+        '''Yields the issues that pass the filter, checking the columns
+        before building any tuple.
+
+        :param issue_filter: An IssueFilter instance.
+        :param reverse: If True, the issues are yielded from the last to the
+        first.
+        :rtype: A generator of issue tuples.
+        '''
+        open_numbers = frozenset(int(number) for number in
+                issue_filter.open_issues if number)
+        check_open = issue_filter.open_only or issue_filter.closed_only
+        milestone_ids = frozenset(index for (index, name) in
+                enumerate(self.milestone_names) if name in
+                issue_filter.milestones)
+        (numbers, types, milestones) = (self.numbers, self.types,
+                self.milestones)
+
+        if reverse:
+            indexes = range(len(numbers) - 1, -1, -1)
+        else:
+            indexes = range(len(numbers))
+        for index in indexes:
+            if issue_filter.itypes and types[index] not in \
+                    issue_filter.itypes:
+                continue
+            if issue_filter.milestones and milestones[index] not in \
+                    milestone_ids:
+                continue
+            if check_open and (numbers[index] in open_numbers) != \
+                    issue_filter.open_only:
+                continue
+            yield self.issue(index)
+
+
+def build_snapshot(path):
+    '''Builds the snapshot of the issues file in a single pass and saves it
+    in the cache.
+
+    :param path: The path to the .gitli directory.
+    '''
+    write_snapshot(get_cache_path(path, SNAPSHOT),
+            get_stamp(join(path, ISSUES)), iter_issue_records(path))
+
+
+def write_snapshot(snapshot_path, stamp, issues):
+    '''Writes a snapshot file.
+
+    :param snapshot_path: The path of the snapshot file.
+    :param stamp: The stamp of the issues file, recorded in the header.
+    :param issues: An iterable of issue tuples.
+    '''
+    columns = dict((name, array(typecode)) for (name, typecode) in
+            SNAPSHOT_COLUMNS)
+    milestone_ids = {}
+    titles = []
+    titles_size = 0
+    columns['titles'].append(0)
+    for (number, title, itype, milestone) in issues:
+        title = title.encode('utf-8')
+        titles.append(title)
+        titles_size += len(title)
+        columns['numbers'].append(int(number))
+        columns['types'].append(itype)
+        columns['milestones'].append(milestone_ids.setdefault(milestone,
+            len(milestone_ids)))
+        columns['titles'].append(titles_size)
+
+    milestone_names = sorted(milestone_ids, key=milestone_ids.get)
+    milestones = json.dumps(milestone_names).encode('utf-8')
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, stamp[0], stamp[1],
+            stamp[2], len(columns['numbers']), len(milestones), titles_size)
+    write_cache(snapshot_path, b''.join([header] +
+        [array_to_bytes(columns[name]) for (name, _) in SNAPSHOT_COLUMNS] +
+        [milestones] + titles))
+
+
+_snapshot_cache = {}
+
+
+@traced('snapshot')
+def get_snapshot(path):
+    '''Returns the snapshot of the issues file, rebuilding it if the issues
+    file changed since it was built.
+
+    :param path: The path to the .gitli directory.
+    :rtype: A Snapshot instance.
+    '''
+    stamp = get_stamp(join(path, ISSUES))
+    snapshot = _snapshot_cache.get(path)
+    if snapshot is not None and snapshot.stamp == stamp:
+        return snapshot
+
+    snapshot_path = get_cache_path(path, SNAPSHOT)
+    snapshot = None
+    if exists(snapshot_path):
+        try:
+            with open(snapshot_path, 'rb') as snapshot_file:
+                snapshot = Snapshot(snapshot_file)
+        except (ValueError, struct.error):
+            snapshot = None
+
+    if snapshot is None or snapshot.stamp != stamp:
+        build_snapshot(path)
+        with open(snapshot_path, 'rb') as snapshot_file:
+            snapshot = Snapshot(snapshot_file)
+
+    _snapshot_cache[path] = snapshot
+    return snapshot
+
+
+class CatFile(object):
+    '''A git cat-file --batch process that stays alive to read any number of
+    git objects without starting a process for each object.
+    '''
+
+    def __init__(self, work_tree):
+        '''
+        :param work_tree: The directory of the git repository.
+        '''
+        count_subprocess()
+        self.process = subprocess.Popen(['git', 'cat-file', '--batch'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                cwd=work_tree)
+
+    def read(self, name):
+        '''
+        :param name: An object name, e.g., a SHA or 'HEAD~2:.gitli'.
+        :rtype: A tuple (sha, object_type, data) or None if the object does
+        not exist.
+        '''
+        self.process.stdin.write(name.encode('utf-8') + b'\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            return None
+        (sha, object_type, size) = header
+        data = self.process.stdout.read(int(size))
+        self.process.stdout.read(1)
+        return (sha.decode('ascii'), object_type.decode('ascii'), data)
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+# work tree -> CatFile
+_cat_files = {}
+
+
+def get_cat_file(path):
+    '''
+    :param path: The path to the .gitli directory.
+    :rtype: The CatFile of the repository, started on first use.
+    '''
+    work_tree = split(os.path.abspath(path))[0]
+    cat_file = _cat_files.get(work_tree)
+    if cat_file is None or cat_file.process.poll() is not None:
+        cat_file = _cat_files[work_tree] = CatFile(work_tree)
+    return cat_file
+
+
+def read_tree(data, hash_size):
+    '''
+    :param data: The content of a git tree object.
+    :param hash_size: The size of the object ids in bytes, e.g., 20.
+    :rtype: A dict mapping the names of the entries to their hex SHA.
+    '''
+    entries = {}
+    position = 0
+    while position < len(data):
+        space = data.index(b' ', position)
+        end = data.index(b'\0', space)
+        entries[data[space + 1:end].decode('utf-8')] = binascii.hexlify(
+                data[end + 1:end + 1 + hash_size]).decode('ascii')
+        position = end + 1 + hash_size
+    return entries
+
+
+def get_revision_snapshot(path, sha):
+    '''Returns the snapshot of an issues file stored in git. The snapshot is
+    built once per blob and kept in the cache, so a revision is parsed only
+    the first time it is read.
+
+    :param path: The path to the .gitli directory.
+    :param sha: The SHA of the issues file blob.
+    :rtype: A Snapshot instance.
+    '''
+    snapshot = _snapshot_cache.get(sha)
+    if snapshot is not None:
+        return snapshot
+
+    revisions_path = get_cache_path(path, REVISIONS)
+    if not exists(revisions_path):
+        mkdir(revisions_path)
+    snapshot_path = join(revisions_path, sha)
+    if not exists(snapshot_path):
+        data = get_cat_file(path).read(sha)[2]
+        issues = parse_issue_lines(io.TextIOWrapper(io.BytesIO(data),
+            encoding='utf-8', newline='\n'))
+        write_snapshot(snapshot_path, (0, 0, 0), issues)
+        names = sorted(listdir(revisions_path), key=lambda name:
+                stat(join(revisions_path, name)).st_mtime)
+        for name in names[:-REVISIONS_LIMIT]:
+            remove(join(revisions_path, name))
+
+    with open(snapshot_path, 'rb') as snapshot_file:
+        snapshot = _snapshot_cache[sha] = Snapshot(snapshot_file)
+    return snapshot
+
+
+# tree SHA of the .gitli directory -> (snapshot, state)
+_revision_cache = OrderedDict()
+
+
+@traced('revision')
+def get_revision(path, revision):
+    '''Reads the issues as they were in a git revision, without checking it
+    out. All the git objects are read through a single git process.
+
+    :param path: The path to the .gitli directory.
+    :param revision: A git revision, e.g., 'v1.0' or 'HEAD~3'.
+    :rtype: A tuple (snapshot, state) where snapshot is the Snapshot of the
+    issues file and state is the JournalState of the issues-open file and of
+    the journal in this revision.
+    '''
+    cat_file = get_cat_file(path)
+    tree = cat_file.read('{0}:{1}'.format(revision,
+        split(os.path.abspath(path))[1]))
+    if tree is None or tree[1] != 'tree':
+        raise ValueError('No issues in revision {0}'.format(revision))
+    cached = _revision_cache.get(tree[0])
+    if cached is not None:
+        return cached
+
+    files = read_tree(tree[2], len(tree[0]) // 2)
+    if ISSUES not in files:
+        raise ValueError('No issues in revision {0}'.format(revision))
+
+    snapshot = get_revision_snapshot(path, files[ISSUES])
+    open_issues = []
+    if OPEN in files:
+        open_issues = cat_file.read(files[OPEN])[2].decode('utf-8').split(
+                OSEPARATOR)
+    state = JournalState(open_issues)
+    if JOURNAL in files:
+        for line in cat_file.read(files[JOURNAL])[2].decode(
+                'utf-8').splitlines():
+            if line.strip():
+                state.replay(json.loads(line))
+
+    _revision_cache[tree[0]] = (snapshot, state)
+    while len(_revision_cache) > REVISIONS_LIMIT:
+        _revision_cache.popitem(last=False)
+    return (snapshot, state)
+
+
+def iter_revision_issues(snapshot, state):
+    '''
+    :param snapshot: The Snapshot of an issues file.
+    :param state: The JournalState to apply to the issues.
+    :rtype: A generator of the issue tuples.
+    '''
+    for index in range(len(snapshot)):
+        issue = state.apply(snapshot.issue(index))
+        if issue is not None:
+            yield issue
+
+
+def iter_gitli_commits(path):
+    '''Yields the commits of the first-parent history of the current branch
+    that modified the .gitli directory, oldest first, with the SHA of the
+    files they modified. A single git log process is used.
+
+    :param path: The path to the .gitli directory.
+    :rtype: A generator of tuples (commit, timestamp, changes) where changes
+    maps the names of the modified gitli files to their new blob SHA (None
+    if the file was deleted).
+    '''
+    (work_tree, name) = split(os.path.abspath(path))
+    count_subprocess()
+    process = subprocess.Popen(['git', 'log', '--first-parent', '--reverse',
+        '--raw', '--no-abbrev', '--format=%x01%H %ct', '--', name],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=work_tree)
+    commit = None
+    for line in process.stdout:
+        line = line.decode('utf-8').rstrip('\n')
+        if line.startswith('\x01'):
+            if commit is not None:
+                yield commit
+            (sha, timestamp) = line[1:].split()
+            commit = (sha, int(timestamp), {})
+        elif line.startswith(':') and commit is not None:
+            (info, file_path) = line.split('\t', 1)
+            blob = info.split()[3]
+            commit[2][file_path.rsplit('/', 1)[-1]] = None if \
+                    blob.strip('0') == '' else blob
+    if commit is not None:
+        yield commit
+    process.wait()
+
+
+class HistoryState(object):
+    '''The open issues per milestone at a point of the history. The issues
+    file and the issues-open file are given as they change, and only the
+    difference with the previous version is applied to the counts: the
+    issues appended to the issues file are the only ones parsed, and the
+    counts move by the issues opened and closed since the previous commit.
+
+    Only the open issues of the journal are taken into account, not the
+    edits.
+    '''
+
+    def __init__(self):
+        # number -> milestone
+        self.milestones = {}
+        self.issues_data = b''
+        self.base_open = frozenset()
+        self.journal = []
+        self.open_issues = frozenset()
+        # milestone -> number of open issues
+        self.counts = {}
+
+    def count(self, numbers, step):
+        counts = self.counts
+        milestones = self.milestones
+        for number in numbers:
+            milestone = milestones.get(number)
+            if milestone is not None:
+                counts[milestone] = counts.get(milestone, 0) + step
+
+    def set_issues(self, data):
+        '''
+        :param data: The content of the issues file.
+        '''
+        if data.startswith(self.issues_data):
+            issues = parse_issue_lines(io.TextIOWrapper(io.BytesIO(
+                data[len(self.issues_data):]), encoding='utf-8',
+                newline='\n'))
+            for (number, title, itype, milestone) in issues:
+                if number in self.milestones and number in self.open_issues:
+                    self.count([number], -1)
+                self.milestones[number] = milestone
+                if number in self.open_issues:
+                    self.count([number], 1)
+        else:
+            issues = parse_issue_lines(io.TextIOWrapper(io.BytesIO(data),
+                encoding='utf-8', newline='\n'))
+            self.milestones = dict((number, milestone) for (number, title,
+                itype, milestone) in issues)
+            self.counts = {}
+            self.count(self.open_issues, 1)
+        self.issues_data = data
+
+    def set_open(self, data):
+        '''
+        :param data: The content of the issues-open file.
+        '''
+        self.base_open = frozenset(filter(None, data.decode(
+            'utf-8').split(OSEPARATOR)))
+        self.update_open()
+
+    def set_journal(self, data):
+        '''
+        :param data: The content of the journal.
+        '''
+        self.journal = [json.loads(line) for line in
+                data.decode('utf-8').splitlines() if line.strip()]
+        self.update_open()
+
+    def update_open(self):
+        open_issues = self.base_open
+        if self.journal:
+            state = JournalState(open_issues)
+            for record in self.journal:
+                state.replay(record)
+            open_issues = frozenset(state.open_issues)
+        self.count(self.open_issues - open_issues, -1)
+        self.count(open_issues - self.open_issues, 1)
+        self.open_issues = open_issues
+
+    def record(self, commit, timestamp):
+        '''
+        :rtype: A dict describing the state at a commit.
+        '''
+        return OrderedDict((
+            ('commit', commit),
+            ('date', time.strftime('%Y-%m-%d %H:%M', time.gmtime(
+                timestamp))),
+            ('open', sum(self.counts.values())),
+            ('total', len(self.milestones)),
+            ('milestones', OrderedDict(sorted((milestone, count) for
+                (milestone, count) in self.counts.items() if count)))))
+
+
+@traced('history')
+def get_history(path):
+    '''Computes the number of open issues per milestone after each commit
+    that modified the issues. The records are cached by commit, so only the
+    commits that are not in the cache are processed. All the blobs are read
+    through a single git cat-file process.
+
+    :param path: The path to the .gitli directory.
+    :rtype: A list of dicts with the commit, its date, the number of open
+    issues, the number of issues, and the open issues per milestone.
+    '''
+    history_path = get_cache_path(path, HISTORY)
+    cached = {}
+    if exists(history_path):
+        with io.open(history_path, 'r', encoding='utf-8') as history_file:
+            for line in history_file:
+                record = json.loads(line, object_pairs_hook=OrderedDict)
+                cached[record['commit']] = record
+
+    commits = list(iter_gitli_commits(path))
+    records = []
+    for (commit, timestamp, changes) in commits:
+        if commit not in cached:
+            break
+        records.append(cached[commit])
+    if len(records) == len(commits):
+        return records
+
+    cat_file = get_cat_file(path)
+    state = HistoryState()
+    if records:
+        # The state of the last cached commit is read once in full.
+        tree = cat_file.read('{0}:{1}'.format(records[-1]['commit'],
+            split(os.path.abspath(path))[1]))
+        changes = read_tree(tree[2], len(tree[0]) // 2) if tree else {}
+        for name in (ISSUES, OPEN, JOURNAL):
+            changes.setdefault(name, None)
+        apply_history_changes(state, cat_file, changes)
+
+    for (commit, timestamp, changes) in commits[len(records):]:
+        apply_history_changes(state, cat_file, changes)
+        records.append(state.record(commit, timestamp))
+
+    write_cache(history_path, ''.join('{0}\n'.format(json.dumps(record))
+        for record in records).encode('utf-8'))
+    return records
+
+
+def apply_history_changes(state, cat_file, changes):
+    '''
+    :param state: A HistoryState instance.
+    :param cat_file: The CatFile used to read the blobs.
+    :param changes: A dict mapping the names of gitli files to their blob
+    SHA, or None if the file does not exist.
+    '''
+    for (name, setter) in ((ISSUES, state.set_issues),
+            (OPEN, state.set_open), (JOURNAL, state.set_journal)):
+        if name in changes:
+            blob = changes[name]
+            setter(cat_file.read(blob)[2] if blob else b'')
+
+
+def get_postings_path(path, name=None):
+    '''
+    :param path: The path to the .gitli directory.
+    :param name: The name of a file in the postings directory.
+    :rtype: The path of the postings directory or of one of its files. The
+    directory is created if necessary.
+    '''
+    postings_dir = get_cache_path(path, POSTINGS)
+    if not exists(postings_dir):
+        mkdir(postings_dir)
+    if name is None:
+        return postings_dir
+    return join(postings_dir, name)
+
+
+def get_posting_name(kind, value):
+    '''
+    :param kind: 'm' for a milestone or 't' for an issue type.
+    :param value: The milestone or the issue type id.
+    :rtype: The name of the file holding the posting list.
+    '''
+    value = '{0}'.format(value).encode('utf-8')
+    return '{0}-{1}'.format(kind, binascii.hexlify(value).decode('ascii'))
+
+
+def are_postings_fresh(path):
+    '''
+    :param path: The path to the .gitli directory.
+    :rtype: True if the posting lists were built from the current issues
+    file.
+    '''
+    try:
+        with open(get_postings_path(path, INDEX_STAMP), 'r',
+                encoding='utf-8') as stamp_file:
+            stamp = json.loads(stamp_file.read())
+    except (IOError, ValueError):
+        return False
+    return stamp == list(get_stamp(join(path, ISSUES)))
+
+
+def write_postings_stamp(path):
+    '''Marks the posting lists as built from the current issues file.
+
+    :param path: The path to the .gitli directory.
+    '''
+    write_cache(get_postings_path(path, INDEX_STAMP), json.dumps(
+        list(get_stamp(join(path, ISSUES)))).encode('utf-8'))
+
+
+def build_postings(path):
+    '''Builds the posting lists of the milestones and of the issue types,
+    i.e., the sorted numbers of the issues of each milestone and type, in a
+    single pass over the issues file. The journal is ignored.
+
+    :param path: The path to the .gitli directory.
+    '''
+    postings_dir = get_postings_path(path)
+    for name in listdir(postings_dir):
+        remove(join(postings_dir, name))
+
+    stamp = get_stamp(join(path, ISSUES))
+    postings = {}
+    for (number, title, itype, milestone) in iter_issue_records(path):
+        number = int(number)
+        postings.setdefault(('m', milestone), array('i')).append(number)
+        postings.setdefault(('t', itype), array('i')).append(number)
+
+    for ((kind, value), numbers) in postings.items():
+        write_cache(join(postings_dir, get_posting_name(kind, value)),
+                array_to_bytes(array('i', sorted(numbers))))
+
+    write_cache(join(postings_dir, INDEX_STAMP), json.dumps(
+        list(stamp)).encode('utf-8'))
+
+
+def read_posting(path, kind, value):
+    '''
+    :param path: The path to the .gitli directory.
+    :param kind: 'm' for a milestone or 't' for an issue type.
+    :param value: The milestone or the issue type id.
+    :rtype: An array of the sorted issue numbers of the milestone or type.
+    '''
+    numbers = array('i')
+    try:
+        with open(get_postings_path(path, get_posting_name(kind, value)),
+                'rb') as posting_file:
+            array_from_bytes(numbers, posting_file.read())
+    except IOError:
+        pass
+    return numbers
+
+
+def update_postings(path, removed, added):
+    '''Updates the posting lists after the issues file was changed. The
+    posting lists must have been up to date before the change.
+
+    :param path: The path to the .gitli directory.
+    :param removed: The issue tuples that were removed or replaced.
+    :param added: The issue tuples that were added or that replaced others.
+    '''
+    changes = {}
+    for (issues, delta) in ((removed, -1), (added, 1)):
+        for (number, title, itype, milestone) in issues:
+            for key in (('m', milestone), ('t', itype)):
+                numbers_delta = changes.setdefault(key, {})
+                number = int(number)
+                numbers_delta[number] = numbers_delta.get(number, 0) + delta
+
+    for ((kind, value), numbers_delta) in changes.items():
+        # A replaced issue that keeps its milestone or type cancels out.
+        numbers_delta = sorted((number, delta) for (number, delta) in
+                numbers_delta.items() if delta)
+        if not numbers_delta:
+            continue
+        posting_path = get_postings_path(path, get_posting_name(kind, value))
+        numbers = read_posting(path, kind, value)
+        size = len(numbers)
+        changed = False
+        for (number, delta) in numbers_delta:
+            index = bisect_left(numbers, number)
+            found = index < len(numbers) and numbers[index] == number
+            if delta < 0 and found:
+                numbers.pop(index)
+                changed = True
+            elif delta > 0 and not found:
+                numbers.insert(index, number)
+                changed = True
+
+        if not changed:
+            continue
+        elif len(numbers) == size + 1 and numbers[-1] == numbers_delta[-1][0]:
+            # Appending a new issue is the common case.
+            with open(posting_path, 'ab') as posting_file:
+                posting_file.write(array_to_bytes(numbers[-1:]))
+        else:
+            write_cache(posting_path, array_to_bytes(numbers))
+
+    write_postings_stamp(path)
+
+
+@traced('index')
+def get_fresh_indexes(path):
+    '''Call before modifying the issues file and pass the result to
+    update_indexes once the file is modified.
+
+    :param path: The path to the .gitli directory.
+    :rtype: The names of the indexes that are up to date with the issues
+    file.
+    '''
+    fresh = []
+    if are_postings_fresh(path):
+        fresh.append(POSTINGS)
+    if is_token_index_fresh(path):
+        fresh.append(TOKENS)
+    return fresh
+
+
+@traced('index')
+def update_indexes(path, fresh, removed, added):
+    '''Updates the indexes that were up to date before the issues file was
+    modified. The other indexes are rebuilt when they are needed.
+
+    :param path: The path to the .gitli directory.
+    :param fresh: The names of the indexes returned by get_fresh_indexes.
+    :param removed: The issue tuples that were removed or replaced.
+    :param added: The issue tuples that were added or that replaced others.
+    '''
+    if POSTINGS in fresh:
+        update_postings(path, removed, added)
+    if TOKENS in fresh:
+        update_token_index(path, removed, added)
+
+
+def get_counters_stamps(path):
+    '''
+    :param path: The path to the .gitli directory.
+    :rtype: The stamps of the files the counters are computed from, as
+    lists, like in the counters file.
+    '''
+    return [None if stamp is None else list(stamp) for stamp in
+            (get_stamp(join(path, name)) for name in (ISSUES, OPEN, JOURNAL))]
+
+
+def write_counters(path, counts):
+    '''Saves the counters in the cache, stamped with the current gitli
+    files.
+
+    :param path: The path to the .gitli directory.
+    :param counts: A dict mapping (milestone, issue type id) to [closed,
+    open].
+    '''
+    write_cache(get_cache_path(path, COUNTERS), json.dumps({
+        'stamps': get_counters_stamps(path),
+        'counts': [[milestone, itype, closed, opened] for ((milestone,
+            itype), (closed, opened)) in sorted(counts.items()) if closed or
+            opened]}).encode('utf-8'))
+
+
+def build_counters(path):
+    '''Counts the issues per milestone and issue type in a single pass and
+    saves the counters in the cache.
+
+    :param path: The path to the .gitli directory.
+    :rtype: A dict mapping (milestone, issue type id) to [closed, open].
+    '''
+    stamps = get_counters_stamps(path)
+    open_issues = frozenset(get_open_issues(path))
+    counts = {}
+    for issue in iter_issues(path):
+        count = counts.setdefault((issue[3], int(issue[2])), [0, 0])
+        count[issue[0] in open_issues] += 1
+    if get_counters_stamps(path) == stamps:
+        write_counters(path, counts)
+    return counts
+
+
+def get_fresh_counters(path):
+    '''Call before modifying the gitli files and pass the result to
+    update_counters once they are modified.
+
+    :param path: The path to the .gitli directory.
+    :rtype: A dict mapping (milestone, issue type id) to [closed, open] if
+    the counters are up to date with the gitli files, None otherwise.
+    '''
+    try:
+        with open(get_cache_path(path, COUNTERS), 'r',
+                encoding='utf-8') as counters_file:
+            counters = json.loads(counters_file.read())
+    except (IOError, ValueError):
+        return None
+    if counters['stamps'] != get_counters_stamps(path):
+        return None
+    return dict(((milestone, itype), [closed, opened]) for (milestone, itype,
+        closed, opened) in counters['counts'])
+
+
+def update_counters(path, counts, removed, added):
+    '''Updates the counters after the gitli files were modified. Does
+    nothing if the counters were not up to date before the change: they are
+    rebuilt when they are needed.
+
+    :param path: The path to the .gitli directory.
+    :param counts: The counters returned by get_fresh_counters.
+    :param removed: The (milestone, issue type id, is open) of the issues
+    that were removed or changed.
+    :param added: The (milestone, issue type id, is open) of the issues that
+    were added or of the changed issues.
+    '''
+    if counts is None:
+        return
+    for (issues, delta) in ((removed, -1), (added, 1)):
+        for (milestone, itype, is_open) in issues:
+            counts.setdefault((milestone, int(itype)), [0, 0])[is_open] += \
+                    delta
+    write_counters(path, counts)
+
+
+@traced('counters')
+def get_counters(path):
+    '''
+    :param path: The path to the .gitli directory.
+    :rtype: A dict mapping (milestone, issue type id) to [closed, open] for
+    the issues that are not archived. The counters are rebuilt if they are
+    not up to date with the gitli files.
+    '''
+    counts = get_fresh_counters(path)
+    if counts is None:
+        counts = build_counters(path)
+    return counts
+
+
+def iter_posted_issues(path, issue_filter, reverse=False):
+    '''Yields the issues that pass a filter with milestones or issue types
+    by intersecting their posting lists. Only the candidate issues are read,
+    in the order of the issues file.
+
+    :param path: The path to the .gitli directory.
+    :param issue_filter: An IssueFilter instance.
+    :param reverse: If True, the issues are read in the reverse order.
+    :rtype: A generator of issue tuples.
+    '''
+    if not are_postings_fresh(path):
+        build_postings(path)
+
+    candidates = None
+    for (kind, values) in (('m', issue_filter.milestones),
+            ('t', issue_filter.itypes)):
+        if not values:
+            continue
+        numbers = set()
+        for value in values:
+            numbers.update(read_posting(path, kind, value))
+        candidates = numbers if candidates is None else candidates & numbers
+
+    if issue_filter.open_only:
+        candidates &= set(int(number) for number in
+                issue_filter.open_issues if number)
+
+    state = None
+    if has_journal(path):
+        # The posting lists ignore the journal, so the edited issues are
+        # always candidates.
+        state = get_journal_state(path)
+        candidates.update(int(number) for number in state.overrides)
+
+    for issue in iter_issue_records_by_number(path, sorted(candidates,
+            reverse=reverse)):
+        if state is not None:
+            issue = state.apply(issue)
+        if issue is not None and issue_filter(issue):
+            yield issue
+
+
+def tokenize(text):
+    '''
+    :param text: An issue title or a search query.
+    :rtype: The list of lowercase words of the text.
+    '''
+    return TOKEN.findall(text.lower())
+
+
+def get_tokens_path(path, name=None):
+    '''
+    :param path: The path to the .gitli directory.
+    :param name: The name of a file of the token index.
+    :rtype: The path of the token index directory or of one of its files.
+    The directory is created if necessary.
+    '''
+    tokens_dir = get_cache_path(path, TOKENS)
+    if not exists(tokens_dir):
+        mkdir(tokens_dir)
+    if name is None:
+        return tokens_dir
+    return join(tokens_dir, name)
+
+
+def is_token_index_fresh(path):
+    '''
+    :param path: The path to the .gitli directory.
+    :rtype: True if the token index matches the current issues file.
+    '''
+    try:
+        with open(get_tokens_path(path, INDEX_STAMP), 'r',
+                encoding='utf-8') as stamp_file:
+            stamp = json.loads(stamp_file.read())
+    except (IOError, ValueError):
+        return False
+    return stamp == list(get_stamp(join(path, ISSUES)))
+
+
+def build_token_index(path):
+    '''Builds the token index of the issue titles in a single pass over the
+    issues file. The journal is ignored.
+
+    The vocabulary file holds one "token\\toffset\\tcount" line per token,
+    sorted by token, so a token or a prefix is found with a binary search.
+    The postings file holds the sorted issue numbers of each token.
+
+    :param path: The path to the .gitli directory.
+    '''
+    stamp = get_stamp(join(path, ISSUES))
+    postings = {}
+    for (number, title, itype, milestone) in iter_issue_records(path):
+        number = int(number)
+        for token in set(tokenize(title)):
+            postings.setdefault(token.encode('utf-8'), array('i')).append(
+                    number)
+
+    vocabulary = []
+    data = []
+    offset = 0
+    for token in sorted(postings):
+        numbers = array('i', sorted(postings[token]))
+        vocabulary.append(token + '\t{0}\t{1}\n'.format(offset,
+            len(numbers)).encode('ascii'))
+        data.append(array_to_bytes(numbers))
+        offset += len(numbers)
+
+    write_cache(get_tokens_path(path, TOKENS_POSTINGS), b''.join(data))
+    write_cache(get_tokens_path(path, TOKENS_VOCABULARY), b''.join(
+        vocabulary))
+    write_cache(get_tokens_path(path, TOKENS_DELTA), b'')
+    write_cache(get_tokens_path(path, INDEX_STAMP), json.dumps(
+        list(stamp)).encode('utf-8'))
+
+
+def update_token_index(path, removed, added):
+    '''Records the changed titles in the delta of the token index. The
+    token index must have been up to date before the change.
+
+    :param path: The path to the .gitli directory.
+    :param removed: The issue tuples that were removed or replaced.
+    :param added: The issue tuples that were added or that replaced others.
+    '''
+    # A replaced issue whose title, hence whose tokens, did not change needs
+    # no record.
+    unchanged = set(('{0}'.format(issue[0]), issue[1]) for issue in
+            removed) & set(('{0}'.format(issue[0]), issue[1]) for issue in
+                    added)
+    records = [['-', issue[0]] for issue in removed if
+            ('{0}'.format(issue[0]), issue[1]) not in unchanged] + \
+            [['+', issue[0], issue[1]] for issue in added if
+                    ('{0}'.format(issue[0]), issue[1]) not in unchanged]
+    if records:
+        with io.open(get_tokens_path(path, TOKENS_DELTA), 'a',
+                encoding='utf-8') as delta:
+            delta.write(''.join('{0}\n'.format(json.dumps(record)) for
+                record in records))
+    write_cache(get_tokens_path(path, INDEX_STAMP), json.dumps(
+        list(get_stamp(join(path, ISSUES)))).encode('utf-8'))
+
+
+def find_token(vocabulary, prefix):
+    '''Binary search in the sorted vocabulary file.
+
+    :param vocabulary: The content of the vocabulary file (e.g., a mmap).
+    :param prefix: The token or prefix to look for, in bytes.
+    :rtype: The position of the first line whose token is not smaller than
+    prefix.
+    '''
+    (low, high) = (0, len(vocabulary))
+    while low < high:
+        start = vocabulary.rfind(b'\n', low, (low + high) // 2) + 1
+        start = max(start, low)
+        end = vocabulary.find(b'\n', start)
+        if vocabulary[start:vocabulary.find(b'\t', start)] < prefix:
+            low = end + 1
+        else:
+            high = start
+    return low
+
+
+class PostingList(object):
+    '''A sorted posting list read lazily from the memory-mapped postings
+    file of the token index, so it can be searched with bisect.
+    '''
+
+    ITEM = struct.Struct('=i')
+
+    def __init__(self, postings, offset, count):
+        self.postings = postings
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.ITEM.unpack_from(self.postings, (self.offset + index) *
+                self.ITEM.size)[0]
+
+    def __contains__(self, number):
+        index = bisect_left(self, number)
+        return index < self.count and self[index] == number
+
+    def __iter__(self):
+        numbers = array('i')
+        array_from_bytes(numbers, self.postings[self.offset * self.ITEM.size:
+            (self.offset + self.count) * self.ITEM.size])
+        return iter(numbers)
+
+
+def lookup_token(vocabulary, postings, term, prefix):
+    '''
+    :param vocabulary: The memory-mapped vocabulary file.
+    :param postings: The memory-mapped postings file.
+    :param term: A lowercase word.
+    :param prefix: If True, all the tokens starting with term match.
+    :rtype: A list of (exact, PostingList) for the matching tokens, where
+    exact is True if the token is the term.
+    '''
+    term = term.encode('utf-8')
+    matches = []
+    position = find_token(vocabulary, term)
+    while position < len(vocabulary):
+        end = vocabulary.find(b'\n', position)
+        (token, offset, count) = vocabulary[position:end].split(b'\t')
+        if token != term and not (prefix and token.startswith(term)):
+            break
+        matches.append((token == term, PostingList(postings, int(offset),
+            int(count))))
+        position = end + 1
+    return matches
+
+
+def map_file(file_path):
+    '''
+    :param file_path: The path of a file.
+    :rtype: The file memory-mapped for reading, or b'' if it is empty.
+    '''
+    with open(file_path, 'rb') as mapped_file:
+        if not stat(file_path).st_size:
+            return b''
+        return mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@traced('search')
+def search_issues(path, query):
+    '''Finds the issues whose title contains all the terms of the query.
+    A term ending with * matches all the words starting with it. The issues
+    are ranked by the number of terms matching whole words, then from the
+    newest to the oldest.
+
+    The most selective term is read first. The posting lists of the other
+    terms are only probed for the remaining candidates when this is cheaper
+    than reading them.
+
+    :param path: The path to the .gitli directory.
+    :param query: The search terms, e.g., ['crash', 'pars*'].
+    :rtype: A list of ranked issue tuples.
+    '''
+    terms = []
+    for word in query:
+        prefix = word.strip().endswith('*')
+        terms.extend((token, prefix) for token in tokenize(word))
+    if not terms:
+        return []
+
+    if not is_token_index_fresh(path):
+        build_token_index(path)
+
+    # The delta holds the titles changed since the index was built.
+    delta = {}
+    with io.open(get_tokens_path(path, TOKENS_DELTA), 'r',
+            encoding='utf-8') as delta_file:
+        for line in delta_file:
+            record = json.loads(line)
+            delta[int(record[1])] = record[2] if record[0] == '+' else None
+    if len(delta) > TOKENS_DELTA_LIMIT:
+        build_token_index(path)
+        delta = {}
+
+    # The journal is not indexed: edited issues are checked one by one.
+    state = get_journal_state(path) if has_journal(path) else None
+    if state is not None:
+        for number in state.overrides:
+            number = int(number)
+            if number not in delta:
+                issue = get_issue(path, '{0}'.format(number))
+                delta[number] = None if issue is None else issue[1]
+
+    vocabulary = map_file(get_tokens_path(path, TOKENS_VOCABULARY))
+    postings = map_file(get_tokens_path(path, TOKENS_POSTINGS))
+    lookups = [(term, prefix, lookup_token(vocabulary, postings, term,
+        prefix)) for (term, prefix) in terms]
+    lookups.sort(key=lambda lookup: sum(len(posting) for (exact, posting) in
+        lookup[2]))
+
+    scores = None
+    for (term, prefix, tokens) in lookups:
+        matches = {}
+        size = sum(len(posting) for (exact, posting) in tokens)
+        if scores is None or size < len(scores) * len(tokens) * 16:
+            for (exact, posting) in tokens:
+                for number in posting:
+                    matches[number] = matches.get(number, False) or exact
+        else:
+            for number in scores:
+                for (exact, posting) in tokens:
+                    if number in posting:
+                        matches[number] = matches.get(number, False) or \
+                                exact
+
+        for (number, title) in delta.items():
+            matches.pop(number, None)
+            if title is None:
+                continue
+            for token in tokenize(title):
+                if token == term or (prefix and token.startswith(term)):
+                    matches[number] = matches.get(number, False) or \
+                            token == term
+
+        if scores is None:
+            scores = dict((number, int(exact)) for (number, exact) in
+                    matches.items())
+        else:
+            scores = dict((number, score + int(matches[number])) for
+                    (number, score) in scores.items() if number in matches)
+        if not scores:
+            return []
+
+    ranked = sorted(scores, key=lambda number: (-scores[number], -number))
+    issues = dict((int(issue[0]), issue) for issue in
+            iter_issue_records_by_number(path, sorted(ranked)))
+    results = []
+    for number in ranked:
+        issue = issues.get(number)
+        if issue is not None and state is not None:
+            issue = state.apply(issue)
+        if issue is not None:
+            results.append(issue)
+    return results
+
+
+class JournalState(object):
+    '''The state of the issues once the journal records are replayed over
+    the issues and issues-open files.
+
+    Each journal record is a JSON list on its own line:
+
+    - ["close", number]
+    - ["reopen", number]
+    - ["remove", number]
+    - ["edit", number, title, issue_type, milestone]
+    - ["move", milestone, last]: moves the issues open at that time, i.e.,
+      whose number is not greater than last, to milestone.
+    '''
+
+    def __init__(self, open_issues):
+        '''
+        :param open_issues: The issue numbers of the issues-open file.
+        '''
+        self.open_issues = OrderedDict.fromkeys(filter(None, open_issues),
+                True)
+        self.removed = set()
+        # number -> [title, issue_type, milestone], None means unchanged.
+        self.overrides = {}
+
+    def replay(self, record):
+        '''Applies a journal record to the state.
+
+        :param record: A journal record, e.g., ['close', '3'].
+        '''
+        operation = record[0]
+        if operation == 'move':
+            (milestone, last) = (record[1], int(record[2]))
+            for number in self.open_issues:
+                if int(number) <= last:
+                    self.overrides.setdefault(number, [None, None, None])[2] =\
+                            milestone
+            return
+
+        number = record[1]
+        if operation == 'close':
+            self.open_issues.pop(number, None)
+        elif operation == 'reopen':
+            if number not in self.removed:
+                self.open_issues[number] = True
+        elif operation == 'remove':
+            self.open_issues.pop(number, None)
+            self.overrides.pop(number, None)
+            self.removed.add(number)
+        elif operation == 'edit':
+            self.overrides[number] = list(record[2:5])
+
+    def apply(self, issue):
+        '''
+        :param issue: An issue tuple read from the issues file.
+        :rtype: The issue tuple updated by the journal or None if the issue
+        was removed.
+        '''
+        if issue[0] in self.removed:
+            return None
+        override = self.overrides.get(issue[0])
+        if override is None:
+            return issue
+        return (issue[0],
+                issue[1] if override[0] is None else override[0],
+                issue[2] if override[1] is None else override[1],
+                issue[3] if override[2] is None else override[2])
+
+
+_journal_cache = {}
+
+
+def has_journal(path):
+    '''
+    :param path: The path to the .gitli directory.
+    :rtype: True if the journal contains records that are not compacted yet.
+    '''
+    stamp = get_stamp(join(path, JOURNAL))
+    return stamp is not None and stamp[1] > 0
+
+
+def get_journal_state(path):
+    '''Replays the journal. The state is cached for the rest of the process
+    until the journal or the issues-open file changes.
+
+    :param path: The path to the .gitli directory.
+    :rtype: A JournalState instance.
+    '''
+    journal_path = join(path, JOURNAL)
+    key = (get_stamp(join(path, OPEN)), get_stamp(journal_path))
+    cached = _journal_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    state = JournalState(read_open_file(path))
+    with io.open(journal_path, 'r', encoding='utf-8') as journal:
+        for line in journal:
+            if line.strip():
+                state.replay(json.loads(line))
+
+    _journal_cache[path] = (key, state)
+    return state
+
+
+def use_journal(path):
+    '''Indicates whether changes must be appended to the journal. If the
+    journal storage is disabled, the pending journal records are compacted
+    first so that the issue files can be modified directly.
+
+    :param path: The path to the .gitli directory.
+    :rtype: True if gitli.storage is set to journal in the git config.
+    '''
+    if get_config().get(STORAGE, '').strip().lower() == JOURNAL_STORAGE:
+        return True
+
+    compact(path)
+    return False
+
+
+@traced('write')
+def append_journal(path, *records):
+    '''Appends records to the journal.
+
+    :param path: The path to the .gitli directory.
+    :param records: Journal records, e.g., ['close', '3'].
+    '''
+    with io.open(join(path, JOURNAL), 'a', encoding='utf-8') as journal:
+        journal.write(''.join('{0}\n'.format(json.dumps(record)) for record
+            in records))
+
+
+@traced('write')
+def write_file(file_path, text):
+    '''Writes a gitli file in a temporary file and moves it in place.
+
+    :param file_path: The path of the file to write.
+    :param text: The new content of the file. UTF-8 bytes are accepted for
+    the command line arguments of Python 2.
+    '''
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    temp_path = '{0}.{1}.tmp'.format(file_path, os.getpid())
+    with io.open(temp_path, 'w', encoding='utf-8', newline='') as temp:
+        temp.write(text)
+        sync_file(temp)
+    replace(temp_path, file_path)
+
+
+def compact(path):
+    '''Folds the journal into the issues and issues-open files and empties
+    the journal. Does nothing if the journal is empty.
+
+    :param path: The path to the .gitli directory.
+    '''
+    if not has_journal(path):
+        return
+
+    with gitli_lock(path):
+        # Another process may have compacted the journal before we got the
+        # lock.
+        if not has_journal(path):
+            return
+        state = get_journal_state(path)
+        write_file(join(path, ISSUES), ''.join(format_issue(issue) for issue
+            in iter_issues(path)))
+        write_file(join(path, OPEN), ''.join('{0}{1}'.format(number,
+            OSEPARATOR) for number in state.open_issues))
+        write_file(join(path, JOURNAL), '')
+
+
+def get_issue_formats(bcolor):
+    '''Compiles the format of the issue lines once, with the colors already
+    in the format strings.
+
+    :param bcolor: An instance of the BColors class used to colorize the
+    output.
+    :rtype: A dict mapping True (open) and False (closed) to a function
+    formatting (number, title, type_text, milestone_text) as a line.
+    '''
+    formats = {}
+    for (is_open, open_text, color) in ((True, 'open', bcolor.YELLOW),
+            (False, 'closed', bcolor.GREEN)):
+        formats[is_open] = (bcolor.CYAN + '#{0:<4}' + bcolor.ENDC + ' ' +
+            bcolor.WHITE + '{1:<48}' + bcolor.ENDC + ' ' + bcolor.BLUE +
+            '{2:<6} {3:<7}' + bcolor.ENDC + ' - ' + color + open_text +
+            bcolor.ENDC + '\n').format
+    return formats
+
+
+def silence_stdout():
+    '''Redirects stdout to the null device once the reader of a pipe went
+    away, so that flushing stdout at exit does not fail again.
+    '''
+    try:
+        null = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(null, sys.stdout.fileno())
+        os.close(null)
+    except (OSError, ValueError, AttributeError, io.UnsupportedOperation):
+        pass
+
+
+def issue_to_dict(issue, open_issues):
+    '''
+    :param issue: An issue tuple.
+    :param open_issues: The issue numbers that are open.
+    :rtype: A dict describing the issue for the machine-readable formats.
+    '''
+    (number, title, type_id, milestone) = issue
+    return OrderedDict((
+        ('number', int(number)),
+        ('title', title),
+        ('type', ITYPES[type_id - 1]),
+        ('milestone', milestone),
+        ('status', 'open' if number in open_issues else 'closed')))
+
+
+def format_text(issues, open_issues, bcolor):
+    '''Yields the lines of the issues in the fixed-width text format.'''
+    formats = get_issue_formats(bcolor)
+    type_texts = dict((type_id, '[' + ITYPES[type_id - 1] + ']') for type_id
+            in ITYPE_IDS)
+    for (number, title, type_id, milestone) in issues:
+        type_text = type_texts.get(type_id)
+        if type_text is None:
+            type_text = '[' + ITYPES[type_id - 1] + ']'
+        yield formats[number in open_issues](number, title, type_text,
+                '[' + milestone + ']')
+
+
+def format_records(records, output_format, columns):
+    '''Yields the lines of records in a machine-readable format.
+
+    :param records: An iterable of dicts.
+    :param output_format: json, jsonl, csv, or tsv.
+    :param columns: The keys of the records, in the order of the csv and tsv
+    columns. Dict and list values are written as JSON in these formats.
+    '''
+    if output_format == 'jsonl':
+        for record in records:
+            yield json.dumps(record) + '\n'
+    elif output_format == 'json':
+        separator = '[\n'
+        for record in records:
+            yield separator + json.dumps(record)
+            separator = ',\n'
+        yield '[]\n' if separator == '[\n' else '\n]\n'
+    else:
+        # The csv module of Python 2 only writes UTF-8 byte strings.
+        line = io.BytesIO() if major < 3 else io.StringIO()
+        writer = csv.writer(line, delimiter=str('\t' if output_format ==
+            'tsv' else ','), lineterminator=str('\n'))
+
+        def write_row(values):
+            if major < 3:
+                values = [value.encode('utf-8') if isinstance(value,
+                    type('')) else value for value in values]
+            writer.writerow(values)
+            value = line.getvalue()
+            line.seek(0)
+            line.truncate()
+            return value.decode('utf-8') if major < 3 else value
+
+        header = write_row(columns)
+        for record in records:
+            yield header + write_row([json.dumps(record[column]) if
+                isinstance(record[column], (dict, list)) else record[column]
+                for column in columns])
+            header = ''
+        yield header
+
+
+ISSUE_COLUMNS = ('number', 'title', 'type', 'milestone', 'status')
+
+
+def format_json(issues, open_issues, bcolor):
+    '''Yields the lines of a JSON array of the issues.'''
+    return format_records((issue_to_dict(issue, open_issues) for issue in
+        issues), 'json', ISSUE_COLUMNS)
+
+
+def format_jsonl(issues, open_issues, bcolor):
+    '''Yields one JSON object per issue and per line.'''
+    return format_records((issue_to_dict(issue, open_issues) for issue in
+        issues), 'jsonl', ISSUE_COLUMNS)
+
+
+def format_csv(issues, open_issues, bcolor):
+    '''Yields a header line and one CSV line per issue.'''
+    return format_records((issue_to_dict(issue, open_issues) for issue in
+        issues), 'csv', ISSUE_COLUMNS)
+
+
+def format_tsv(issues, open_issues, bcolor):
+    '''Yields a header line and one tab-separated line per issue.'''
+    return format_records((issue_to_dict(issue, open_issues) for issue in
+        issues), 'tsv', ISSUE_COLUMNS)
+
+
+OUTPUT_FORMATS = OrderedDict((
+    ('text', format_text),
+    ('json', format_json),
+    ('jsonl', format_jsonl),
+    ('csv', format_csv),
+    ('tsv', format_tsv)))
+
+
+def get_stdout_write():
+    '''
+    :rtype: A function writing text on stdout. The files of Python 2 write
+    byte strings, so the text is encoded with the encoding of the terminal,
+    or in UTF-8 if stdout is not a terminal.
+    '''
+    stdout = sys.stdout
+    if major < 3 and not isinstance(stdout, io.TextIOBase):
+        encoding = getattr(stdout, 'encoding', None) or 'utf-8'
+        return lambda text: stdout.write(text.encode(encoding, 'replace'))
+    return stdout.write
+
+
+def write_lines(lines):
+    '''Writes lines on stdout by chunks of OUTPUT_CHUNK lines. If stdout is
+    a pipe closed by its reader (e.g., head), writing stops silently and the
+    remaining lines are not produced.
+
+    :param lines: An iterable of str ending with a new line.
+    '''
+    write = get_stdout_write()
+    chunk = []
+    try:
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) == OUTPUT_CHUNK:
+                write(''.join(chunk))
+                chunk = []
+        write(''.join(chunk))
+        sys.stdout.flush()
+    except IOError as error:
+        if error.errno != errno.EPIPE:
+            raise
+        silence_stdout()
+
+
+@traced('render')
+def print_issues(issues, open_issues, bcolor, output_format='text'):
+    '''Prints the issues on stdout as they are produced by the issues
+    iterable. [(issue_number, title, issue_type, milestone)]
+
+    :param issues: An iterable of tuples representing the issues to print.
+    :param open_issues: The issue numbers that are open. A set is faster.
+    :param bcolor: An instance of the BColors class used to colorize the
+    output.
+    :param output_format: One of the OUTPUT_FORMATS: text, json, jsonl, csv,
+    or tsv.
+    '''
+    write_lines(OUTPUT_FORMATS[output_format](issues, open_issues, bcolor))
+
+
+def init(path):
+    '''Initialize the .gitli directory by creating the gitli files.
+
+    :param path: The path to the .gitli directory.
+    '''
+    if not exists(path):
+        mkdir(path)
+
+    new_path = join(path, ISSUES)
+    if not exists(new_path):
+        open(new_path, 'w', encoding='utf-8').close()
+
+    new_path = join(path, OPEN)
+    if not exists(new_path):
+        open(new_path, 'w', encoding='utf-8').close()
+
+    new_path = join(path, COMMENTS)
+    if not exists(new_path):
+        open(new_path, 'w', encoding='utf-8').close()
+
+    new_path = join(path, LAST)
+    if not exists(new_path):
+        with open(new_path, 'w', encoding='utf-8') as last:
+            last.write('0')
+
+    new_path = join(path, CURRENT)
+    if not exists(new_path):
+        with open(new_path, 'w', encoding='utf-8') as current:
+            current.write('0.1')
+
+
+def new_issue(path, title, verbose=False):
+    '''Creates a new issue: add the issue to the issues file, add the issue
+    number to the issues-open file, and increment the last issue number in
+    issues-last.
+
+    :param path: The path to the .gitli directory.
+    :param title: The title of the issue.
+    :param verbose: If True, ask the user for the issue type and milestone.
+    :rtype: The number of the new issue.
+    '''
+    # The user is asked before taking the lock, which is held only while the
+    # files are written.
+    ttype = ask_type(verbose)
+    milestone = ask_milestone(path, verbose)
+    return append_issue(path, title, ttype, milestone)
+
+
+@locked
+def append_issue(path, title, ttype, milestone):
+    '''Creates a new issue with the next issue number. The last issue number
+    is written first so that an interrupted append never hands out the same
+    number twice.
+
+    :param path: The path to the .gitli directory.
+    :param title: The title of the issue.
+    :param ttype: The issue type id.
+    :param milestone: The milestone of the issue.
+    :rtype: The number of the new issue.
+    '''
+    with open(join(path, LAST), 'r', encoding='utf-8') as last:
+        issue_number = int(last.read().strip()) + 1
+    write_file(join(path, LAST), '{0}'.format(issue_number))
+
+    issue = ('{0}'.format(issue_number), title, ttype, milestone)
+    record = format_issue(issue)
+
+    issues_path = join(path, ISSUES)
+    stamp = get_stamp(issues_path)
+    fresh_offsets = read_offset_slot(get_cache_path(path, OFFSETS), stamp,
+            0) is not False
+    fresh_indexes = get_fresh_indexes(path)
+    counts = get_fresh_counters(path)
+
+    with open(issues_path, 'a', encoding='utf-8') as issues:
+        issues.write(record)
+
+    # The caches are updated instead of being rebuilt on the next read.
+    if fresh_offsets:
+        set_offset_slot(path, get_stamp(issues_path), issue_number,
+                (stamp[1], len(record.encode('utf-8'))))
+    update_indexes(path, fresh_indexes, [], [issue])
+
+    add_open(path, issue_number)
+    update_counters(path, counts, [], [(milestone, ttype, True)])
+    return issue_number
+
+
+def close_issue(path, issue_number):
+    '''Closes the issue by removing its number from the issues-open file.
+
+    :param path: The path to the .gitli directory.
+    :param issue_number: The number of the issue to close.
+    '''
+    close_issues(path, [issue_number])
+
+
+@locked
+def close_issues(path, issue_numbers):
+    '''Closes several issues with a single write of the issues-open file.
+
+    :param path: The path to the .gitli directory.
+    :param issue_numbers: The numbers of the issues to close.
+    :raises ValueError: If one of the issues is archived.
+    '''
+    check_not_archived(path, issue_numbers)
+    if use_journal(path):
+        append_journal(path, *[['close', number] for number in
+            issue_numbers])
+    else:
+        counts = get_fresh_counters(path)
+        (closed, opened) = update_open(path, issue_numbers, [])
+        update_status_counters(path, counts, closed, False)
+
+
+def list_issues(path, filters=None, bcolor=BColors(), collect=True,
+        output_format='text', revision=None, sort=None, reverse=False,
+        limit=None, offset=0):
+    '''Prints a list of issues matching the provided filters.
+
+    :param path: The path to the .gitli directory.
+    :param filters: A list of filters such as ['open', '0.1', 'task']
+    :param bcolor: An instance of the BColors class to colorize the output.
+    :param collect: If True, the issues are gathered in a list before being
+    printed and the list is returned. If False, the issues are printed as
+    they are read and None is returned.
+    :param output_format: One of the OUTPUT_FORMATS, e.g., 'jsonl'.
+    :param revision: If not None, the issues are read from this git revision
+    instead of the working tree.
+    :param sort: One of the SORT_KEYS. The issues are sorted by number if
+    None.
+    :param reverse: If True, the issues are printed in the reverse order.
+    :param limit: If not None, the maximum number of issues printed.
+    :param offset: The number of matching issues skipped before printing.
+    '''
+    if filters is None or len(filters) == 0:
+        filters = [get_default_list_filter()]
+
+    (filters, milestones, itypes) = parse_filters(filters)
+
+    # The issues are read in number order, so sorting by number only means
+    # reading them forwards or backwards.
+    by_number = sort in (None, 'number')
+    backwards = by_number and reverse
+    if revision is None:
+        open_issues = frozenset(get_open_issues(path))
+        issue_filter = IssueFilter(filters, open_issues, milestones, itypes)
+        issues = iter_selected_issues(path, issue_filter, backwards)
+        if not issue_filter.open_only and get_archive_segments(path,
+                issue_filter.milestones):
+            sign = -1 if backwards else 1
+            archived = trace_iter('archive', iter_archived_issues(path,
+                issue_filter, backwards))
+            issues = (issue for (number, issue) in heapq.merge(
+                ((sign * int(issue[0]), issue) for issue in archived),
+                ((sign * int(issue[0]), issue) for issue in issues)))
+    else:
+        (snapshot, state) = get_revision(path, revision)
+        open_issues = frozenset(state.open_issues)
+        issue_filter = IssueFilter(filters, open_issues, milestones, itypes)
+        if state.overrides or state.removed:
+            issues = (issue for issue in iter_revision_issues(snapshot,
+                state) if issue_filter(issue))
+            by_number = by_number and not reverse
+        else:
+            issues = snapshot.select(issue_filter, backwards)
+
+    if not by_number:
+        issues = sort_issues(issues, SORT_KEYS[sort or 'number'], reverse,
+                None if limit is None else offset + limit)
+    if offset or limit is not None:
+        issues = islice(issues, offset, None if limit is None else
+                offset + limit)
+
+    if collect:
+        # Useful for testing
+        issues = list(issues)
+        print_issues(issues, open_issues, bcolor, output_format)
+        return issues
+    else:
+        print_issues(issues, open_issues, bcolor, output_format)
+
+
+SORT_KEYS = OrderedDict((
+    ('number', lambda issue: int(issue[0])),
+    ('milestone', lambda issue: (issue[3], int(issue[0]))),
+    ('type', lambda issue: (int(issue[2]), int(issue[0]))),
+))
+
+
+def sort_issues(issues, key, reverse=False, count=None):
+    '''Sorts a stream of issues. If only the first issues are needed, they
+    are kept in a heap as the issues are read, so the memory used does not
+    depend on the number of issues.
+
+    :param issues: An iterable of issue tuples.
+    :param key: A function returning the sort key of an issue, e.g., one of
+    the SORT_KEYS.
+    :param reverse: If True, the issues are sorted in the descending order.
+    :param count: If not None, only the first count issues are returned.
+    :rtype: A list of issue tuples.
+    '''
+    if count is None:
+        return sorted(issues, key=key, reverse=reverse)
+    elif reverse:
+        return heapq.nlargest(count, issues, key=key)
+    else:
+        return heapq.nsmallest(count, issues, key=key)
+
+
+@locked
+def move_issues(path, milestone):
+    '''Updates the milestone of all open issues. Only the records of the
+    open issues are read and rewritten.
+
+    :param path: The path to the .gitli directory.
+    :param milestone: The new milestone
+    '''
+    if use_journal(path):
+        with open(join(path, LAST), 'r', encoding='utf-8') as last:
+            append_journal(path, ['move', milestone, int(last.read().strip())])
+        return
+
+    # Only the records of the open issues are read and patched.
+    numbers = sorted(int(number) for number in get_open_issues(path) if
+            number.isdigit())
+    fresh_indexes = get_fresh_indexes(path)
+    counts = get_fresh_counters(path)
+    milestone_data = milestone.encode('utf-8')
+    (patches, removed, added) = ([], [], [])
+
+    for (offset, data) in iter_located_records(path, numbers):
+        issue = parse_issue(data.decode('utf-8').split('\n'))
+        if issue[3] == milestone:
+            continue
+        lines = data.split(b'\n')
+        patches.append((offset + sum(len(line) + 1 for line in lines[:3]),
+            len(lines[3]), milestone_data))
+        removed.append(issue)
+        added.append(issue[:3] + (milestone,))
+
+    if not patches:
+        return
+
+    patches.sort()
+    if patch_issues_file(path, patches):
+        restamp_offset_index(path)
+
+    update_indexes(path, fresh_indexes, removed, added)
+    update_counters(path, counts, [(issue[3], issue[2], True) for issue in
+        removed], [(issue[3], issue[2], True) for issue in added])
+
+
+def reopen_issue(path, issue_number):
+    '''Reopens an issue by adding its number back to the issues-open file.
+    If the issue is already opened, this operation does nothing.
+
+    :param path: The path to the .gitli directory.
+    :param issue_number: The number of the issue to reopen.
+    '''
+    reopen_issues(path, [issue_number])
+
+
+@locked
+def reopen_issues(path, issue_numbers):
+    '''Reopens several issues with a single write of the issues-open file.
+
+    :param path: The path to the .gitli directory.
+    :param issue_numbers: The numbers of the issues to reopen.
+    :raises ValueError: If one of the issues is archived.
+    '''
+    check_not_archived(path, issue_numbers)
+    if use_journal(path):
+        append_journal(path, *[['reopen', number] for number in
+            issue_numbers])
+    else:
+        # update_open makes sure that we don't add an issue twice... that
+        # would be bad
+        counts = get_fresh_counters(path)
+        (closed, opened) = update_open(path, [], issue_numbers)
+        update_status_counters(path, counts, opened, True)
+
+
+def update_status_counters(path, counts, issue_numbers, is_open):
+    '''Updates the counters after issues were closed or reopened.
+
+    :param path: The path to the .gitli directory.
+    :param counts: The counters returned by get_fresh_counters.
+    :param issue_numbers: The numbers of the issues whose status changed.
+    :param is_open: The new status of the issues.
+    '''
+    if counts is None:
+        return
+    keys = []
+    if issue_numbers:
+        keys = [(issue[3], issue[2]) for issue in
+                iter_issue_records_by_number(path, sorted(int(number) for
+                    number in issue_numbers if number.isdigit()))]
+    update_counters(path, counts, [key + (not is_open,) for key in keys],
+            [key + (is_open,) for key in keys])
+
+
+def show_issue(path, issue_number, bcolor=BColors(), output_format='text',
+        revision=None):
+    '''Prints information about an issue.
+
+    :param path: The path to the .gitli directory.
+    :param issue_number: The number of the issue to display.
+    :param bcolor: A BColors instance to colorize the output.
+    :param output_format: One of the OUTPUT_FORMATS. With json, the issue and
+    its comments are printed as a JSON object (null if the issue does not
+    exist). The other machine-readable formats only print the issue.
+    :param revision: If not None, the issue is read from this git revision
+    instead of the working tree, without its comments.
+    '''
+    if revision is None:
+        issue = get_issue(path, issue_number)
+        if issue is None:
+            issue = get_archived_issue(path, issue_number)
+        open_issues = get_open_issues(path)
+        comments = get_comments(path, issue_number) if issue else []
+    else:
+        (snapshot, state) = get_revision(path, revision)
+        try:
+            index = snapshot.numbers.index(int(issue_number))
+        except ValueError:
+            issue = None
+        else:
+            issue = state.apply(snapshot.issue(index))
+        open_issues = state.open_issues
+        comments = []
+
+    if output_format == 'json':
+        if issue is not None:
+            issue = issue_to_dict(issue, frozenset(open_issues))
+            issue['comments'] = [OrderedDict((('date', date),
+                ('author', author), ('text', text))) for (number, date,
+                    author, text) in comments]
+        print(json.dumps(issue))
+    elif issue is not None:
+        print_issues([issue], frozenset(open_issues), bcolor, output_format)
+        if output_format == 'text':
+            write_lines(format_comments(comments, bcolor))
+    else:
+        print('Issue #{0} not found'.format(issue_number))
+
+
+def format_comments(comments, bcolor):
+    '''Yields the lines of the comments in the text format.
+
+    :param comments: A list of comment tuples.
+    :param bcolor: An instance of the BColors class to colorize the output.
+    '''
+    for (number, date, author, text) in comments:
+        yield '\n    {0}{1}{2} {3}{4}{2}\n'.format(bcolor.CYAN, date,
+                bcolor.ENDC, bcolor.WHITE, author)
+        for line in text.splitlines() or ['']:
+            yield '    {0}\n'.format(line)
+
+
+def comment_issue(path, issue_number, text):
+    '''Adds a comment to an existing issue.
+
+    :param path: The path to the .gitli directory.
+    :param issue_number: The number of the issue to comment.
+    :param text: The text of the comment.
+    '''
+    if get_issue(path, issue_number) is None:
+        if get_archived_issue(path, issue_number) is None:
+            print('Issue #{0} unknown'.format(issue_number))
+        else:
+            print('Archived issues cannot be modified: #{0}'.format(
+                issue_number))
+    elif not text.strip():
+        print('A comment cannot be empty')
+    else:
+        add_comment(path, issue_number, text)
+
+
+def get_archive_segments(path, milestones=None):
+    '''
+    :param path: The path to the .gitli directory.
+    :param milestones: If not empty, only the segments of these milestones
+    are returned.
+    :rtype: A list of dicts describing the archived segments (name,
+    milestone, count, count per issue type id, first and last issue
+    numbers), oldest first.
+    '''
+    segments_path = join(path, ARCHIVE, ARCHIVE_SEGMENTS)
+    if not exists(segments_path):
+        return []
+    with io.open(segments_path, 'r', encoding='utf-8') as segments_file:
+        segments = [json.loads(line, object_pairs_hook=OrderedDict) for line
+                in segments_file if line.strip()]
+    if milestones:
+        segments = [segment for segment in segments if segment['milestone']
+                in milestones]
+    return segments
+
+
+def read_archive_segment(path, segment):
+    '''
+    :param path: The path to the .gitli directory.
+    :param segment: A segment dict returned by get_archive_segments.
+    :rtype: A generator of the issue tuples of the segment, sorted by number.
+    '''
+    with gzip.open(join(path, ARCHIVE, segment['name']), 'rb') as \
+            segment_file:
+        # The gzip files of Python 2 cannot be wrapped by io.TextIOWrapper.
+        for issue in parse_issue_lines(line.decode('utf-8') for line in
+                segment_file):
+            yield issue
+
+
+def iter_archived_issues(path, issue_filter, reverse=False):
+    '''Yields the archived issues that pass a filter. The archived issues
+    are all closed, so no segment is read if the filter only accepts open
+    issues, and only the segments of the milestones of the filter are read.
+
+    :param path: The path to the .gitli directory.
+    :param issue_filter: An IssueFilter instance.
+    :param reverse: If True, the issues are sorted from the newest to the
+    oldest. A compressed segment cannot be read backwards, so the issues of
+    each segment that pass the filter are then read in memory.
+    :rtype: A generator of issue tuples sorted by number.
+    '''
+    if issue_filter.open_only:
+        return iter(())
+    segments = get_archive_segments(path, issue_filter.milestones)
+    sign = -1 if reverse else 1
+    streams = [((sign * int(issue[0]), issue) for issue in
+        read_archive_segment(path, segment) if issue_filter(issue)) for
+        segment in segments]
+    if reverse:
+        streams = [reversed(list(stream)) for stream in streams]
+    return (issue for (number, issue) in heapq.merge(*streams))
+
+
+@traced('archive')
+def get_archived_issue(path, issue_number):
+    '''
+    :param path: The path to the .gitli directory.
+    :param issue_number: The number of the issue to find.
+    :rtype: The archived issue or None. Only the segments whose range of
+    numbers contains the issue are read.
+    '''
+    if not issue_number.isdigit():
+        return None
+    number = int(issue_number)
+    for segment in get_archive_segments(path):
+        if segment['first'] <= number <= segment['last']:
+            for issue in read_archive_segment(path, segment):
+                if int(issue[0]) == number:
+                    return issue
+    return None
+
+
+def get_archived_numbers(path, issue_numbers):
+    '''
+    :param path: The path to the .gitli directory.
+    :param issue_numbers: The issue numbers to look up, [str].
+    :rtype: The set of the issue numbers that are archived. Only the segments
+    whose range of numbers contains one of the issues are read.
+    '''
+    numbers = sorted(set(int(number) for number in issue_numbers if
+        number.isdigit()))
+    wanted = frozenset('{0}'.format(number) for number in numbers)
+    archived = set()
+    if not numbers:
+        return archived
+    for segment in get_archive_segments(path):
+        index = bisect_left(numbers, segment['first'])
+        if index < len(numbers) and numbers[index] <= segment['last']:
+            archived.update(issue[0] for issue in read_archive_segment(path,
+                segment) if issue[0] in wanted)
+    return archived
+
+
+def check_not_archived(path, issue_numbers):
+    '''Archived issues are read only.
+
+    :param path: The path to the .gitli directory.
+    :param issue_numbers: The numbers of the issues to modify, [str].
+    :raises ValueError: If one of the issues is archived.
+    '''
+    archived = get_archived_numbers(path, issue_numbers)
+    if archived:
+        raise ValueError('Archived issues cannot be modified: {0}'.format(
+            ', '.join('#{0}'.format(number) for number in sorted(archived,
+                key=int))))
+
+
+@locked
+def archive_milestone(path, milestone):
+    '''Moves the closed issues of a milestone from the issues file to a new
+    compressed segment in the archive directory. Archived issues are read
+    only: they are listed and shown, but they cannot be modified.
+
+    :param path: The path to the .gitli directory.
+    :param milestone: The milestone to archive.
+    :rtype: The number of archived issues.
+    '''
+    compact(path)
+    counts = get_fresh_counters(path)
+    open_issues = frozenset(get_open_issues(path))
+    archived = []
+    kept = []
+    types = {}
+    for issue in iter_issue_records(path):
+        if issue[3] == milestone and issue[0] not in open_issues:
+            archived.append(format_issue(issue))
+            types[issue[2]] = types.get(issue[2], 0) + 1
+        else:
+            kept.append(format_issue(issue))
+    if not archived:
+        return 0
+
+    archive_path = join(path, ARCHIVE)
+    if not exists(archive_path):
+        mkdir(archive_path)
+    segments = get_archive_segments(path)
+    numbers = [int(record.split('\n', 1)[0]) for record in archived]
+    segment = OrderedDict((
+        ('name', '{0:06d}.gz'.format(len(segments) + 1)),
+        ('milestone', milestone),
+        ('count', len(archived)),
+        ('types', OrderedDict(('{0}'.format(itype), count) for (itype,
+            count) in sorted(types.items()))),
+        ('first', min(numbers)),
+        ('last', max(numbers))))
+
+    # The segment is written before the issues are removed from the issues
+    # file: an interruption can duplicate issues but never lose them.
+    segment_path = join(archive_path, segment['name'])
+    temp_path = '{0}.{1}.tmp'.format(segment_path, os.getpid())
+    with open(temp_path, 'wb') as temp:
+        # mtime=0 so that archiving the same issues gives the same file.
+        with gzip.GzipFile(filename='', mode='wb', fileobj=temp,
+                mtime=0) as segment_file:
+            segment_file.write(''.join(archived).encode('utf-8'))
+        sync_file(temp)
+    replace(temp_path, segment_path)
+    write_file(join(archive_path, ARCHIVE_SEGMENTS), ''.join(
+        '{0}\n'.format(json.dumps(value)) for value in segments +
+        [segment]))
+    write_file(join(path, ISSUES), ''.join(kept))
+    if counts is not None:
+        # The archived issues are closed and are counted from the segments.
+        for (itype, count) in types.items():
+            counts[(milestone, itype)][0] -= count
+        write_counters(path, counts)
+    return len(archived)
+
+
+def get_stats(path, itypes=None):
+    '''Counts the issues from the counters of the cache, so the issues file
+    is only read if the counters are not up to date.
+
+    :param path: The path to the .gitli directory.
+    :param itypes: If not empty, only the issues of these issue type ids are
+    counted.
+    :rtype: A list of dicts with the number of open, closed, and all issues
+    of each milestone, sorted by milestone.
+    '''
+    counts = {}
+    for ((milestone, itype), (closed, opened)) in get_counters(path).items():
+        if not itypes or itype in itypes:
+            count = counts.setdefault(milestone, [0, 0])
+            count[0] += closed
+            count[1] += opened
+    for segment in get_archive_segments(path):
+        count = counts.setdefault(segment['milestone'], [0, 0])
+        if not itypes:
+            count[0] += segment['count']
+        else:
+            count[0] += sum(segment['types'].get('{0}'.format(itype), 0) for
+                    itype in itypes)
+    return [OrderedDict((('milestone', milestone), ('open', opened),
+        ('closed', closed), ('total', opened + closed))) for (milestone,
+            (closed, opened)) in sorted(counts.items()) if opened + closed]
+
+
+def show_stats(path, filters=None, bcolor=BColors(), output_format='text',
+        history=False):
+    '''Prints the number of open and closed issues per milestone or, with
+    history, the number of open issues per milestone after each commit that
+    modified the issues.
+
+    :param path: The path to the .gitli directory.
+    :param filters: A list of milestones and issue types such as ['0.1',
+    'bug']. If not empty, only the issues of these milestones and types are
+    counted. The history ignores the issue types.
+    :param bcolor: An instance of the BColors class to colorize the output.
+    :param output_format: One of the OUTPUT_FORMATS.
+    :param history: If True, prints the history instead of the current
+    counts.
+    '''
+    (filters, milestones, itypes) = parse_filters(filters or [])
+    milestones = frozenset(milestones)
+    if history:
+        records = get_history(path)
+        if milestones:
+            for record in records:
+                record['milestones'] = OrderedDict((milestone, count) for
+                        (milestone, count) in record['milestones'].items() if
+                        milestone in milestones)
+                record['open'] = sum(record['milestones'].values())
+        columns = ('commit', 'date', 'open', 'total', 'milestones')
+    else:
+        records = [record for record in get_stats(path, [type_id for
+            (type_id, name) in ITYPE_IDS.items() if name in itypes]) if not
+            milestones or record['milestone'] in milestones]
+        columns = ('milestone', 'open', 'closed', 'total')
+
+    if output_format != 'text':
+        write_lines(format_records(records, output_format, columns))
+    elif history:
+        write_lines('{0}{1}{2} {3}{4}{2} {5:>6} open / {6:<6} {7}\n'.format(
+            bcolor.CYAN, record['date'], bcolor.ENDC, bcolor.WHITE,
+            record['commit'][:7], record['open'], record['total'],
+            '  '.join('{0}: {1}'.format(milestone, count) for (milestone,
+                count) in record['milestones'].items())) for record in
+            records)
+    else:
+        totals = OrderedDict((('milestone', 'Total'), ('open', sum(record[
+            'open'] for record in records)), ('closed', sum(record['closed']
+                for record in records)), ('total', sum(record['total'] for
+                    record in records))))
+        lines = ['{0}{1:<12} {2:>7} {3:>7} {4:>7}{5}\n'.format(bcolor.WHITE,
+            'Milestone', 'Open', 'Closed', 'Total', bcolor.ENDC)]
+        lines.extend('{0:<12} {1:>7} {2:>7} {3:>7}\n'.format(
+            record['milestone'], record['open'], record['closed'],
+            record['total']) for record in records + [totals])
+        write_lines(lines)
+
+
+def search(path, query, bcolor=BColors()):
+    '''Prints the issues whose title contains all the terms of the query.
+
+    :param path: The path to the .gitli directory.
+    :param query: The search terms, e.g., ['crash', 'pars*'].
+    :param bcolor: A BColors instance to colorize the output.
+    '''
+    issues = search_issues(path, query)
+    print_issues(issues, frozenset(get_open_issues(path)), bcolor)
+
+    # Useful for testing
+    return issues
+
+
+def edit_issue(path, issue_number):
     '''Enables the user to edit an issue by asking several questions (title,
     issue type, milestone).
 
     :param path: The path to the .gitli directory.
     :param issue_number: The number of the issue to edit.
     '''
-    issues = get_issues(path, [], [], [], [])
-    issue = None
-    index = -1
-    for i, temp_issue in enumerate(issues):
-        if temp_issue[0] == issue_number:
-            issue = temp_issue
-            index = i
+    issue = get_issue(path, issue_number)
 
-    if issue is None:
+    if issue is None and get_archived_issue(path, issue_number) is not None:
+        print('Archived issues cannot be modified: #{0}'.format(
+            issue_number))
+        return
+    elif issue is None:
         print('Issue #{0} unknown'.format(issue_number))
         return
     else:
@@ -461,22 +3570,34 @@ def edit_issue(path, issue_number):
             title = issue[1]
         ttype = ask_type(True, issue[2])
         milestone = ask_milestone(path, True, issue[3])
-        new_issue = (issue_number, title, ttype, milestone)
-
-        with open(join(path, ISSUES), 'w', encoding='utf-8') as issues_file:
-            for i, temp_issue in enumerate(issues):
-                if i != index:
-                    issues_file.write('{0}\n{1}\n{2}\n{3}\n'.format(
-                        temp_issue[0],
-                        temp_issue[1],
-                        temp_issue[2],
-                        temp_issue[3]))
-                else:
-                    issues_file.write('{0}\n{1}\n{2}\n{3}\n'.format(
-                        new_issue[0],
-                        new_issue[1],
-                        new_issue[2],
-                        new_issue[3]))
+        save_issue(path, (issue[0], title, ttype, milestone))
+
+
+@locked
+def save_issue(path, new_issue):
+    '''Replaces an issue by a new version of the issue.
+
+    :param path: The path to the .gitli directory.
+    :param new_issue: The issue tuple with the new title, type, and
+    milestone.
+    '''
+    if use_journal(path):
+        append_journal(path, ['edit'] + list(new_issue))
+        return
+
+    # The issue is read again because it may have moved or been removed
+    # while the user was answering.
+    issue = get_issue(path, new_issue[0])
+    if issue is not None:
+        fresh_indexes = get_fresh_indexes(path)
+        counts = get_fresh_counters(path)
+        replace_issue_record(path, get_issue_span(path, issue[0]),
+                format_issue(new_issue))
+        update_indexes(path, fresh_indexes, [issue], [new_issue])
+        if counts is not None:
+            is_open = issue[0] in read_open_file(path)
+            update_counters(path, counts, [(issue[3], issue[2], is_open)],
+                    [(new_issue[3], new_issue[2], is_open)])
 
 
 def remove_an_issue(path, issue_number):
@@ -485,14 +3606,30 @@ def remove_an_issue(path, issue_number):
     :param path: The path to the .gitli directory.
     :param issue_number: The number of the issue to remove.
     '''
-    issues = get_issues(path, [], [], [], [])
-    with open(join(path, ISSUES), 'w', encoding='utf-8') as issues_file:
-        for issue in issues:
-            if issue[0] != issue_number:
-                issues_file.write('{0}\n{1}\n{2}\n{3}\n'.format(issue[0],
-                    issue[1], issue[2], issue[3]))
+    span = get_issue_span(path, issue_number)
+    if span is not None:
+        replace_issue_record(path, span, '')
+
+
+def remove_issue_records(path, issue_numbers):
+    '''Removes several issues from the issues file in a single pass.
+
+    :param path: The path to the .gitli directory.
+    :param issue_numbers: The numbers of the issues to remove.
+    '''
+    numbers = frozenset(number.encode('utf-8') for number in issue_numbers)
+    issues_path = join(path, ISSUES)
+    temp_path = '{0}.{1}.tmp'.format(issues_path, os.getpid())
+    with open(issues_path, 'rb') as issues_file:
+        with open(temp_path, 'wb') as temp:
+            for (offset, length, lines) in iter_record_spans(issues_file):
+                if lines[0].strip() not in numbers:
+                    temp.write(b''.join(lines))
+            sync_file(temp)
+    replace(temp_path, issues_path)
 
 
+@locked
 def edit_milestone(path, milestone, up):
     '''Changes the current milestone by overwriting the issues-current file.
 
@@ -502,9 +3639,7 @@ def edit_milestone(path, milestone, up):
     milestone.
     '''
     if milestone:
-        current_path = join(path, CURRENT)
-        with open(current_path, 'w', encoding='utf-8') as current:
-            current.write(milestone)
+        write_file(join(path, CURRENT), milestone)
     if up:
         move_issues(path, milestone)
 
@@ -528,8 +3663,672 @@ def remove_issue(path, issue_number):
     :param path: The path of the .gitli directory.
     :param issue_number: The number of the issue to remove.
     '''
-    remove_open(path, issue_number)
-    remove_an_issue(path, issue_number)
+    remove_issues(path, [issue_number])
+
+
+@locked
+def remove_issues(path, issue_numbers):
+    '''Removes several issues with a single write of the issues-open and
+    the issues files.
+
+    :param path: The path of the .gitli directory.
+    :param issue_numbers: The numbers of the issues to remove.
+    :raises ValueError: If one of the issues is archived.
+    '''
+    check_not_archived(path, issue_numbers)
+    remove_comments(path, issue_numbers)
+    if use_journal(path):
+        append_journal(path, *[['remove', number] for number in
+            issue_numbers])
+        return
+
+    fresh_indexes = get_fresh_indexes(path)
+    counts = get_fresh_counters(path)
+    removed = []
+    if fresh_indexes or counts is not None:
+        numbers = (int(number) for number in issue_numbers if
+                number.isdigit())
+        removed = list(iter_issue_records_by_number(path, numbers))
+
+    (closed, opened) = update_open(path, issue_numbers, [])
+    if len(issue_numbers) == 1:
+        remove_an_issue(path, issue_numbers[0])
+    elif issue_numbers:
+        remove_issue_records(path, issue_numbers)
+
+    update_indexes(path, fresh_indexes, removed, [])
+    update_counters(path, counts, [(issue[3], issue[2], issue[0] in closed)
+        for issue in removed], [])
+
+
+def select_issues(path, args):
+    '''Selects the issues targeted by a command such as close or remove.
+
+    :param path: The path of the .gitli directory.
+    :param args: A list of issue numbers (e.g., '4'), ranges of issue numbers
+    (e.g., '100-400'), and list filters (e.g., 'open', '0.3', 'bug'). If both
+    numbers and filters are provided, the issues must match both.
+    :rtype: A list of issue numbers, [str].
+    '''
+    ranges = []
+    filters = []
+    for arg in args:
+        match = ISSUE_RANGE.match(arg.strip())
+        if match is None:
+            filters.append(arg)
+        else:
+            first = int(match.group(1))
+            ranges.append((first, int(match.group(2) or first)))
+
+    if not filters:
+        with open(join(path, LAST), 'r', encoding='utf-8') as last:
+            top = int(last.read().strip())
+        numbers = OrderedDict()
+        for (first, last) in ranges:
+            for number in range(first, min(last, top) + 1):
+                numbers['{0}'.format(number)] = True
+        return list(numbers)
+
+    def in_ranges(number):
+        number = int(number)
+        for (first, last) in ranges:
+            if first <= number <= last:
+                return True
+        return not ranges
+
+    (filters, milestones, itypes) = parse_filters(filters)
+    issue_filter = IssueFilter(filters, get_open_issues(path), milestones,
+            itypes)
+    return [issue[0] for issue in iter_selected_issues(path, issue_filter)
+            if in_ranges(issue[0])]
+
+
+def split_command(line):
+    '''
+    :param line: A command line, text or UTF-8 bytes.
+    :rtype: The words of the line, split like in a shell. Comments (#) are
+    ignored.
+    '''
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    if major < 3:
+        # The shlex module of Python 2 only splits byte strings.
+        return [word.decode('utf-8') for word in
+                shlex.split(line.encode('utf-8'), comments=True)]
+    return shlex.split(line, comments=True)
+
+
+@locked
+def run_batch(path, commands):
+    '''Executes many commands in memory and then writes each modified gitli
+    file once. If a command fails, no file is modified.
+
+    The commands are read one per line and their arguments are split like in
+    a shell. Empty lines and comments (#) are ignored.
+
+    - new <TITLE> [TYPE] [MILESTONE]
+    - close <NUMBER>
+    - reopen <NUMBER>
+    - edit <NUMBER> <TITLE> [TYPE] [MILESTONE] (an empty title is not changed)
+    - remove <NUMBER> (the comments of the issue are removed too)
+    - milestone <MILESTONE> [up]
+
+    :param path: The path to the .gitli directory.
+    :param commands: An iterable of command lines, e.g., sys.stdin.
+    :rtype: The number of commands executed.
+    '''
+    issues = OrderedDict((issue[0], issue) for issue in iter_issues(path))
+    open_issues = OrderedDict((number, True) for number in
+            get_open_issues(path) if number)
+    with open(join(path, LAST), 'r', encoding='utf-8') as last_file:
+        last = int(last_file.read().strip())
+    with open(join(path, CURRENT), 'r', encoding='utf-8') as current_file:
+        current = current_file.read()
+
+    # The journal is folded in the issue files that are written at the end.
+    modified = set()
+    if has_journal(path):
+        modified.update((ISSUES, OPEN, JOURNAL))
+
+    # The archive is checked once all the commands are read.
+    targets = OrderedDict()
+    removed = []
+    count = 0
+    for (line_number, line) in enumerate(commands, 1):
+        words = split_command(line)
+        if not words:
+            continue
+        (command, args) = (words[0].lower(), words[1:])
+        error = None
+
+        if command in ('new', 'add', 'open', 'edit'):
+            if command == 'edit':
+                number = args.pop(0) if args else None
+                issue = issues.get(number)
+                if issue is None and number is not None and \
+                        get_archived_issue(path, number) is not None:
+                    error = 'Archived issues cannot be modified: #{0}'.format(
+                            number)
+                elif issue is None:
+                    error = 'Issue #{0} unknown'.format(number)
+            else:
+                last += 1
+                number = '{0}'.format(last)
+                issue = (number, '', 1, current)
+                open_issues[number] = True
+                modified.update((OPEN, LAST))
+
+            if error is None and (not args or (command != 'edit' and
+                    not args[0].strip())):
+                error = 'a title is required'
+            elif error is None:
+                ttype = parse_type(args[1]) if len(args) > 1 else issue[2]
+                if ttype is None:
+                    error = 'unknown issue type {0}'.format(args[1])
+                else:
+                    issues[number] = (number, args[0].strip() or issue[1],
+                            ttype, args[2] if len(args) > 2 else issue[3])
+                    modified.add(ISSUES)
+        elif command in ('close', 'reopen', 'remove', 'delete') and args:
+            number = args[0]
+            targets.setdefault(number, line_number)
+            if command == 'reopen' and number not in issues:
+                # An unknown or removed issue would be added to the
+                # issues-open file.
+                if get_archived_issue(path, number) is not None:
+                    error = 'Archived issues cannot be modified: #{0}'.format(
+                            number)
+                else:
+                    error = 'Issue #{0} unknown'.format(number)
+            elif command == 'reopen':
+                open_issues[number] = True
+            else:
+                open_issues.pop(number, None)
+            if command in ('remove', 'delete'):
+                removed.append(number)
+                issues.pop(number, None)
+                modified.add(ISSUES)
+            modified.add(OPEN)
+        elif command == 'milestone' and args:
+            current = args[0]
+            modified.add(CURRENT)
+            if args[1:] in (['up'], ['--up'], ['-u']):
+                for number in open_issues:
+                    if number in issues:
+                        issues[number] = issues[number][:3] + (current,)
+                modified.add(ISSUES)
+        else:
+            error = 'invalid command: {0}'.format(line.strip())
+
+        if error is not None:
+            raise ValueError('Line {0}: {1}'.format(line_number, error))
+        count += 1
+
+    archived = get_archived_numbers(path, targets)
+    for (number, line_number) in targets.items():
+        if number.isdigit() and '{0}'.format(int(number)) in archived:
+            raise ValueError('Line {0}: Archived issues cannot be modified: '
+                    '#{1}'.format(line_number, number))
+
+    if ISSUES in modified:
+        write_file(join(path, ISSUES), ''.join(format_issue(issue) for issue
+            in issues.values()))
+    if OPEN in modified:
+        write_file(join(path, OPEN), ''.join('{0}{1}'.format(number,
+            OSEPARATOR) for number in open_issues))
+    if LAST in modified:
+        write_file(join(path, LAST), '{0}'.format(last))
+    if CURRENT in modified:
+        write_file(join(path, CURRENT), current)
+    if JOURNAL in modified:
+        write_file(join(path, JOURNAL), '')
+    remove_comments(path, removed)
+
+    return count
+
+
+def iter_import_records(import_file, import_format):
+    '''Reads the issues to import, in the format written by list --format.
+
+    :param import_file: A text file.
+    :param import_format: jsonl, csv, or tsv. With csv and tsv, the first line
+    names the columns.
+    :rtype: An iterator of (line_number, record) where record is a dict.
+    '''
+    if import_format == 'jsonl':
+        decode = json.JSONDecoder().decode
+        for (line_number, line) in enumerate(import_file, 1):
+            if line.strip():
+                try:
+                    record = decode(line)
+                except ValueError:
+                    raise ValueError('Line {0}: invalid JSON'.format(
+                        line_number))
+                if not isinstance(record, dict):
+                    raise ValueError('Line {0}: an object is expected'.format(
+                        line_number))
+                yield (line_number, record)
+    elif major < 3:
+        # The csv module of Python 2 only reads UTF-8 byte strings.
+        reader = csv.DictReader((line.encode('utf-8') for line in
+            import_file), delimiter=str('\t' if import_format == 'tsv' else
+                ','))
+        for record in reader:
+            yield (reader.line_num, dict((key, value.decode('utf-8') if
+                isinstance(value, bytes) else value) for (key, value) in
+                record.items()))
+    else:
+        reader = csv.DictReader(import_file,
+                delimiter='\t' if import_format == 'tsv' else ',')
+        for record in reader:
+            yield (reader.line_num, record)
+
+
+@locked
+def import_issues(path, import_file, import_format='jsonl'):
+    '''Creates an issue for each record of import_file. The issues receive
+    consecutive numbers after the last issue number. The issues and
+    issues-open files are written once, in temporary files that are moved in
+    place only if every record is valid: the import either completes or
+    leaves the issue files untouched.
+
+    A record has a title and optionally a type (name or number, Task by
+    default), a milestone (the current milestone by default), and a status
+    (open by default, or closed). Other fields such as the number are
+    ignored, so the output of list --format can be imported.
+
+    :param path: The path to the .gitli directory.
+    :param import_file: A text file opened for reading.
+    :param import_format: jsonl, csv, or tsv.
+    :rtype: The number of imported issues.
+    '''
+    with open(join(path, LAST), 'r', encoding='utf-8') as last_file:
+        last = int(last_file.read().strip())
+    with open(join(path, CURRENT), 'r', encoding='utf-8') as current_file:
+        current = current_file.read().strip()
+
+    issues_path = join(path, ISSUES)
+    open_path = join(path, OPEN)
+    issues_temp_path = '{0}.{1}.tmp'.format(issues_path, os.getpid())
+    open_temp_path = '{0}.{1}.tmp'.format(open_path, os.getpid())
+    number = last
+    type_ids = {}
+    try:
+        with io.open(issues_temp_path, 'wb') as issues_temp, \
+                io.open(open_temp_path, 'wb') as open_temp:
+            for (file_path, temp) in ((issues_path, issues_temp),
+                    (open_path, open_temp)):
+                with io.open(file_path, 'rb') as source:
+                    copy_bytes(source, temp, -1)
+
+            for (line_number, record) in iter_import_records(import_file,
+                    import_format):
+                title = ' '.join((record.get('title') or '').splitlines())
+                title = title.strip()
+                type_value = '{0}'.format(record.get('type') or 1)
+                ttype = type_ids.get(type_value)
+                if ttype is None:
+                    ttype = type_ids[type_value] = parse_type(type_value)
+                milestone = '{0}'.format(record.get('milestone') or
+                        current).strip()
+                status = (record.get('status') or 'open').strip().lower()
+                if not title:
+                    error = 'a title is required'
+                elif ttype is None:
+                    error = 'unknown issue type {0}'.format(type_value)
+                elif not milestone or '\n' in milestone:
+                    error = 'invalid milestone {0!r}'.format(milestone)
+                elif status not in ('open', 'close', 'closed'):
+                    error = 'unknown status {0}'.format(status)
+                else:
+                    error = None
+                if error is not None:
+                    raise ValueError('Line {0}: {1}'.format(line_number,
+                        error))
+
+                number += 1
+                issues_temp.write(format_issue((number, title, ttype,
+                    milestone)).encode('utf-8'))
+                if status == 'open':
+                    open_temp.write('{0}{1}'.format(number,
+                        OSEPARATOR).encode('utf-8'))
+            sync_file(issues_temp)
+            sync_file(open_temp)
+        if number > last:
+            # The last number is saved first: if the import is interrupted
+            # before the issue files are in place, numbers are skipped but
+            # never reused.
+            write_file(join(path, LAST), '{0}'.format(number))
+            # The caches are stamped with the issues file and are rebuilt
+            # when read.
+            replace(issues_temp_path, issues_path)
+            replace(open_temp_path, open_path)
+    finally:
+        for temp_path in (issues_temp_path, open_temp_path):
+            if exists(temp_path):
+                remove(temp_path)
+
+    return number - last
+
+
+# The number of working directories remembered in the roots cache.
+ROOTS_LIMIT = 64
+
+
+def get_roots_cache_path():
+    '''
+    :rtype: The path of the file remembering the work tree of the last
+    working directories, in the user cache directory.
+    '''
+    cache_home = os.environ.get('XDG_CACHE_HOME') or join(
+            os.path.expanduser('~'), '.cache')
+    return join(cache_home, 'gitli', 'roots')
+
+
+def is_work_tree(path):
+    '''
+    :param path: A directory.
+    :rtype: True if the directory has a .git directory, or a .git file
+    pointing to the git directory (submodules and worktrees).
+    '''
+    git_path = join(path, '.git')
+    if os.path.isdir(git_path):
+        return True
+    try:
+        with open(git_path, 'r', encoding='utf-8') as git_file:
+            return git_file.read(7) == 'gitdir:'
+    except (IOError, OSError):
+        return False
+
+
+def read_roots_cache():
+    '''
+    :rtype: An OrderedDict mapping working directories to a list [work
+    tree, stamp of the working directory, stamp of the .git of the work
+    tree].
+    '''
+    try:
+        with open(get_roots_cache_path(), 'r', encoding='utf-8') as \
+                roots_file:
+            return json.loads(roots_file.read(),
+                    object_pairs_hook=OrderedDict)
+    except (IOError, OSError, ValueError):
+        return OrderedDict()
+
+
+def write_roots_cache(roots):
+    '''Saves the roots cache. Errors are ignored: the cache is only an
+    optimization.
+
+    :param roots: An OrderedDict mapping working directories to a list [work
+    tree, stamp of the working directory, stamp of the .git of the work
+    tree], the most recent last.
+    '''
+    while len(roots) > ROOTS_LIMIT:
+        roots.popitem(last=False)
+    roots_path = get_roots_cache_path()
+    try:
+        if not exists(split(roots_path)[0]):
+            os.makedirs(split(roots_path)[0])
+        write_cache(roots_path, json.dumps(roots).encode('utf-8'))
+    except (IOError, OSError):
+        pass
+
+
+def find_work_tree():
+    '''Finds the top of the work tree containing the working directory, like
+    git does: GIT_WORK_TREE and GIT_DIR are honored, and the parents of the
+    working directory are searched for a .git directory or file, without
+    entering GIT_CEILING_DIRECTORIES.
+
+    The result is remembered in the roots cache. A cached work tree is used
+    if neither the working directory nor the .git of the work tree changed
+    since, so a command run deep in a work tree makes two stats instead of
+    one per parent. A repository created in the working directory is found,
+    but not one created in a directory between it and the work tree.
+
+    :rtype: The path of the work tree or None if there is no git repository.
+    '''
+    if os.environ.get('GIT_WORK_TREE'):
+        return os.path.abspath(os.environ['GIT_WORK_TREE'])
+    cwd = getcwd()
+    if os.environ.get('GIT_DIR'):
+        # Like git, the working directory is the top of the work tree.
+        return cwd
+
+    ceilings = frozenset(os.path.abspath(ceiling) for ceiling in
+            os.environ.get('GIT_CEILING_DIRECTORIES', '').split(os.pathsep)
+            if ceiling)
+    # The cache ignores the ceilings, so it is not used with them.
+    roots = None if ceilings else read_roots_cache()
+    entry = roots.get(cwd) if roots else None
+    cwd_stamp = get_stamp(cwd)
+    if isinstance(entry, list) and len(entry) == 3 and \
+            cwd_stamp is not None and entry[1] == list(cwd_stamp):
+        git_stamp = get_stamp(join(entry[0], '.git'))
+        if git_stamp is not None and entry[2] == list(git_stamp):
+            return entry[0]
+
+    path = cwd
+    while not (exists(join(path, '.git')) and is_work_tree(path)):
+        (parent, extra) = split(path)
+        if not extra or parent in ceilings:
+            return None
+        path = parent
+
+    git_stamp = get_stamp(join(path, '.git'))
+    if roots is not None and cwd_stamp is not None and git_stamp is not None:
+        roots.pop(cwd, None)
+        roots[cwd] = [path, list(cwd_stamp), list(git_stamp)]
+        write_roots_cache(roots)
+    return path
+
+
+@traced('discovery')
+def find_gitli_path():
+    '''
+    :rtype: The path of the .gitli directory of the git repository
+    containing the working directory or None if there is no git repository.
+    '''
+    root = find_work_tree()
+    if root is None:
+        return None
+    return join(root, GITLIDIR)
+
+
+class ServerHandler(socketserver.StreamRequestHandler):
+    '''Executes one command sent by a client. The request is a JSON object
+    with the command line arguments and options on one line. The response is
+    a JSON object with the output and the exit status of the command.
+    '''
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # is_server_running connects without sending a request.
+            return
+        request = json.loads(line.decode('utf-8'))
+        response = self.server.execute(request['args'], request['options'])
+        self.wfile.write('{0}\n'.format(json.dumps(response)).encode(
+            'utf-8'))
+
+
+class CapturedOutput(io.StringIO):
+    '''Captures the output of a command. The print statement of Python 2 also
+    writes byte strings, which are decoded.
+    '''
+
+    def write(self, text):
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        return io.StringIO.write(self, text)
+
+
+class Server(socketserver.UnixStreamServer):
+    '''A gitli server listening on a Unix domain socket in the cache of a
+    .gitli directory. It keeps the parsed issues and the git config in memory
+    and reloads them when their files change.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: The path to the .gitli directory.
+        '''
+        self.path = path
+        self.socket_path = get_cache_path(path, SOCKET)
+        self.config_paths = get_config_paths()
+        self.config_stamps = self.get_config_stamps()
+        socketserver.UnixStreamServer.__init__(self, self.socket_path,
+                ServerHandler)
+
+    def get_config_stamps(self):
+        '''
+        :rtype: The stamps of the git config files, None for the missing
+        ones.
+        '''
+        return [get_stamp(config_path) for config_path in self.config_paths]
+
+    def execute(self, args, options):
+        '''Executes a command and captures its output.
+
+        :param args: The command line arguments, e.g., ['list', 'open'].
+        :param options: A dict of the command line options.
+        :rtype: A dict with the output and the exit status of the command.
+        '''
+        if not args or args[0] not in SERVED_COMMANDS or \
+                options.get('edit'):
+            return {'output': 'The gitli server does not execute this '
+                    'command.\n', 'status': 1}
+
+        config_stamps = self.get_config_stamps()
+        if config_stamps != self.config_stamps:
+            _config_cache.clear()
+            self.config_stamps = config_stamps
+
+        bcolor = BColors()
+        if not is_colored_output():
+            bcolor.disable()
+
+        stdout = sys.stdout
+        sys.stdout = output = CapturedOutput()
+        status = 0
+        try:
+            run_command(self.path, args[0], args[1:],
+                    optparse.Values(options), bcolor)
+        except SystemExit as error:
+            status = error.code
+        except Exception as error:
+            print('Error: {0}'.format(error))
+            status = 1
+        finally:
+            sys.stdout = stdout
+
+        return {'output': output.getvalue(), 'status': status}
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if exists(self.socket_path):
+            remove(self.socket_path)
+
+
+def is_server_running(path):
+    '''
+    :param path: The path to the .gitli directory.
+    :rtype: True if a gitli server accepts connections for this directory.
+    '''
+    socket_path = join(path, CACHE, SOCKET)
+    if not hasattr(socket, 'AF_UNIX') or not exists(socket_path):
+        return False
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        client.close()
+
+
+def serve(path):
+    '''Starts a gitli server for the .gitli directory and serves requests
+    until it is interrupted.
+
+    :param path: The path to the .gitli directory.
+    '''
+    global _records_cache
+
+    if not hasattr(socket, 'AF_UNIX'):
+        print('The server requires Unix domain sockets.')
+        sys.exit(1)
+
+    if is_server_running(path):
+        print('A gitli server is already running.')
+        sys.exit(1)
+
+    socket_path = join(path, CACHE, SOCKET)
+    if exists(socket_path):
+        # Left by a server that did not stop cleanly.
+        remove(socket_path)
+
+    _records_cache = {}
+    server = Server(path)
+    print('Serving {0}'.format(server.socket_path))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@traced('forward')
+def forward(options, args):
+    '''Sends a command to the gitli server of the repository if one is
+    running and prints its output. Interactive and profiled commands are
+    never forwarded. The command is only executed locally if the server
+    cannot be reached: once it is sent, a failure is reported.
+
+    :param options: The command line options (an optparse.Values instance).
+    :param args: The command line arguments, e.g., ['list', 'open'].
+    :rtype: False if the command must be executed locally.
+    '''
+    if not args or args[0] not in SERVED_COMMANDS or \
+            getattr(options, 'edit', False) or \
+            getattr(options, 'profile', None) or \
+            not hasattr(socket, 'AF_UNIX'):
+        return False
+
+    path = find_gitli_path()
+    if path is None or not exists(join(path, CACHE, SOCKET)):
+        return False
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(join(path, CACHE, SOCKET))
+        except socket.error:
+            return False
+        try:
+            client.sendall('{0}\n'.format(json.dumps({'args': args,
+                'options': vars(options)})).encode('utf-8'))
+            # The socket files of Python 2 are not context managers.
+            with closing(client.makefile('rb')) as response_file:
+                response = json.loads(response_file.readline().decode(
+                    'utf-8'))
+        except (socket.error, ValueError) as error:
+            # The server may have executed the command: running it again
+            # locally could create or close issues twice.
+            print('The gitli server did not answer: {0}'.format(error))
+            sys.exit(1)
+    finally:
+        client.close()
+
+    get_stdout_write()(response['output'])
+    if response['status']:
+        sys.exit(response['status'])
+    return True
 
 
 def main(options, args, parser):
@@ -541,32 +4340,110 @@ def main(options, args, parser):
         parser.print_help()
         sys.exit(1)
 
-    command = args[0]
-    args = args[1:]
-    path = getcwd()
-    while not exists(join(path, ".git")):
-        path, extra = split(path)
-        if not extra:
-            print("Unable to find a git repository. ")
+    path = find_gitli_path()
+    if path is None:
+        print("Unable to find a git repository. ")
+        sys.exit(1)
+
+    run_command(path, args[0], args[1:], options, bcolor)
+
+
+def run_command(path, command, args, options, bcolor):
+    '''Executes a gitli command.
+
+    :param path: The path to the .gitli directory.
+    :param command: The name of the command, e.g., 'list'.
+    :param args: The arguments of the command.
+    :param options: The command line options.
+    :param bcolor: A BColors instance to colorize the output.
+    '''
+    output_format = getattr(options, 'format', None) or 'text'
+    if output_format not in OUTPUT_FORMATS:
+        print('Unknown format {0}. Use one of: {1}'.format(output_format,
+            ', '.join(OUTPUT_FORMATS)))
+        sys.exit(1)
+
+    revision = getattr(options, 'rev', None)
+    if revision is not None:
+        try:
+            get_revision(path, revision)
+        except ValueError as error:
+            print(error)
             sys.exit(1)
 
-    path = join(path, GITLIDIR)
     if command == 'init':
         init(path)
     elif command in ('new', 'add', 'open'):
         new_issue(path, args[0].strip(), options.edit)
-    elif command == 'close':
-        close_issue(path, args[0].strip())
+    elif command in ('close', 'reopen', 'remove', 'delete'):
+        modify = {'close': close_issues, 'reopen': reopen_issues}.get(command,
+                remove_issues)
+        try:
+            modify(path, select_issues(path, args))
+        except ValueError as error:
+            print(error)
+            sys.exit(1)
     elif command == 'list':
-        list_issues(path, args, bcolor)
-    elif command == 'reopen':
-        reopen_issue(path, args[0].strip())
+        sort = getattr(options, 'sort', None)
+        if sort is not None and sort not in SORT_KEYS:
+            print('Unknown sort key {0}. Use one of: {1}'.format(sort,
+                ', '.join(SORT_KEYS)))
+            sys.exit(1)
+        limit = getattr(options, 'limit', None)
+        offset = getattr(options, 'offset', None) or 0
+        if (limit is not None and limit < 0) or offset < 0:
+            print('The limit and the offset cannot be negative')
+            sys.exit(1)
+        list_issues(path, args, bcolor, False, output_format, revision, sort,
+                getattr(options, 'reverse', False), limit, offset)
     elif command == 'show':
-        show_issue(path, args[0].strip(), bcolor)
+        show_issue(path, args[0].strip(), bcolor, output_format, revision)
     elif command == 'edit':
         edit_issue(path, args[0].strip())
-    elif command in ('remove', 'delete'):
-        remove_issue(path, args[0].strip())
+    elif command == 'comment':
+        comment_issue(path, args[0].strip(), ' '.join(args[1:]))
+    elif command == 'search':
+        search(path, args, bcolor)
+    elif command == 'archive':
+        if not args:
+            print('A milestone is required')
+            sys.exit(1)
+        print('{0} issues archived'.format(archive_milestone(path,
+            args[0].strip())))
+    elif command == 'stats':
+        show_stats(path, args, bcolor, output_format,
+                getattr(options, 'history', False))
+    elif command == 'compact':
+        compact(path)
+    elif command == 'batch':
+        try:
+            run_batch(path, sys.stdin)
+        except ValueError as error:
+            print(error)
+            sys.exit(1)
+    elif command == 'import':
+        import_path = args[0] if args else '-'
+        import_format = getattr(options, 'format', None)
+        if import_format in (None, 'text'):
+            import_format = 'jsonl'
+            for extension in ('csv', 'tsv'):
+                if import_path.lower().endswith('.' + extension):
+                    import_format = extension
+        if import_format not in ('jsonl', 'csv', 'tsv'):
+            print('Cannot import the {0} format'.format(import_format))
+            sys.exit(1)
+        try:
+            if import_path == '-':
+                import_issues(path, sys.stdin, import_format)
+            else:
+                with io.open(import_path, 'r', encoding='utf-8',
+                        newline='') as import_file:
+                    import_issues(path, import_file, import_format)
+        except (IOError, ValueError) as error:
+            print(error)
+            sys.exit(1)
+    elif command == 'serve':
+        serve(path)
     elif command == 'milestone':
         if len(args) == 0:
             show_milestone(path)
@@ -3,10 +3,22 @@ import unittest
 import tempfile
 import shutil
 import os
+import sys
+import io
+import json
+import errno
+import optparse
+import threading
+import subprocess
 from subprocess import call
 from collections import namedtuple
 
 
+# The tests change the working directory, and gitli.__file__ is relative on
+# Python 2 when the tests are run from the directory of gitli.
+GITLI_DIR = os.path.dirname(os.path.abspath(gitli.__file__))
+
+
 def read_file(file_type):
     content = ''
     with open(os.path.join(gitli.GITLIDIR, file_type)) as f:
@@ -25,11 +37,19 @@ def exists(file_type):
     return os.path.exists(os.path.join(gitli.GITLIDIR, file_type))
 
 
+def text_file(text):
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return io.StringIO(text)
+
+
 class TestGitli(unittest.TestCase):
 
     def setUp(self):
         self.tempdirpath = tempfile.mkdtemp()
         os.chdir(self.tempdirpath)
+        self.environ = dict(os.environ)
+        os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp()
         self.gitlipath = os.path.join(self.tempdirpath, gitli.GITLIDIR)
         self.Options = namedtuple('Options', 'edit up')
         self.bcolor = gitli.BColors()
@@ -37,6 +57,9 @@ class TestGitli(unittest.TestCase):
 
     def tearDown(self):
         shutil.rmtree(self.tempdirpath)
+        shutil.rmtree(os.environ['XDG_CACHE_HOME'])
+        os.environ.clear()
+        os.environ.update(self.environ)
 
     def test_init(self):
         call(['git', 'init'])
@@ -101,6 +124,49 @@ class TestGitli(unittest.TestCase):
         issues = gitli.list_issues(self.gitlipath, ['close'], self.bcolor)
         self.assertEqual(1, len(issues))
 
+    def test_list_sort(self):
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        gitli.run_batch(self.gitlipath, [
+            'new "Hello World 1" bug 0.2',
+            'new "Hello World 2" task 0.1',
+            'new "Hello World 3" bug 0.1',
+            'new "Hello World 4" enhancement 0.3',
+            'new "Hello World 5" task 0.2',
+            'new "Hello World 6" bug 0.1',
+            'close 3',
+        ])
+
+        def numbers(filters, **kwargs):
+            return [int(issue[0]) for issue in gitli.list_issues(
+                self.gitlipath, filters, self.bcolor, **kwargs)]
+
+        self.assertEqual([6, 5, 4, 3, 2, 1], numbers(['all'], reverse=True))
+        self.assertEqual([6, 5], numbers(['all'], reverse=True, limit=2))
+        self.assertEqual([4, 2], numbers(['open'], reverse=True, limit=2,
+            offset=2))
+        self.assertEqual([6, 3], numbers(['bug'], reverse=True, limit=2))
+        self.assertEqual([3, 4], numbers(['all'], sort='number', limit=2,
+            offset=2))
+        self.assertEqual([2, 3, 6, 1, 5, 4], numbers(['all'],
+            sort='milestone'))
+        self.assertEqual([4, 5, 1], numbers(['all'], sort='milestone',
+            reverse=True, limit=3))
+        self.assertEqual([1, 3, 6], numbers(['all'], sort='type', limit=3,
+            offset=2))
+        self.assertEqual([], numbers(['all'], limit=0))
+
+        # The issues file is read backwards by blocks.
+        records = list(gitli.read_issue_records(self.gitlipath))
+        records.reverse()
+        self.assertEqual(records, list(gitli.read_issue_records_reversed(
+            self.gitlipath, 7)))
+
+        # Archived issues are merged in the reverse order too.
+        gitli.archive_milestone(self.gitlipath, '0.1')
+        self.assertEqual([6, 5, 4, 3], numbers(['all'], reverse=True,
+            limit=4))
+
     def test_list_issues_default(self):
         options = self.Options(edit=False, up=False)
         call(['git', 'init'])
@@ -150,3 +216,982 @@ class TestGitli(unittest.TestCase):
         self.assertEqual('0.1', lines[7].strip())
         self.assertEqual('0.2', lines[11].strip())
         self.assertEqual('0.2', read_file(gitli.CURRENT))
+
+    def test_get_issue(self):
+        options = self.Options(edit=False, up=False)
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        gitli.main(options, ['new', 'Hello World 2'], None)
+        gitli.main(options, ['new', 'Hello World 3'], None)
+        issue = gitli.get_issue(self.gitlipath, '2')
+        self.assertEqual(('2', 'Hello World 2', 1, '0.1'), issue)
+        self.assertTrue(exists(os.path.join(gitli.CACHE, gitli.OFFSETS)))
+        self.assertEqual('*\n', read_file(os.path.join(gitli.CACHE,
+            gitli.IGNORE)))
+        self.assertFalse(exists(gitli.IGNORE))
+        self.assertEqual(None, gitli.get_issue(self.gitlipath, '4'))
+        self.assertEqual(None, gitli.get_issue(self.gitlipath, 'foo'))
+        gitli.main(options, ['new', 'Hello World 4'], None)
+        issue = gitli.get_issue(self.gitlipath, '4')
+        self.assertEqual('Hello World 4', issue[1])
+        gitli.main(options, ['remove', '1'], None)
+        self.assertEqual(None, gitli.get_issue(self.gitlipath, '1'))
+        issue = gitli.get_issue(self.gitlipath, '3')
+        self.assertEqual('Hello World 3', issue[1])
+
+    def test_edit(self):
+        options = self.Options(edit=False, up=False)
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        gitli.main(options, ['new', 'Hello World 2'], None)
+        answers = iter(['A much longer title', '2', '0.2'])
+        old_rinput = gitli.rinput
+        gitli.rinput = lambda prompt: next(answers)
+        try:
+            gitli.main(options, ['edit', '1'], None)
+        finally:
+            gitli.rinput = old_rinput
+        lines = read_lines(gitli.ISSUES)
+        self.assertEqual('A much longer title', lines[1].strip())
+        self.assertEqual('2', lines[2].strip())
+        self.assertEqual('0.2', lines[3].strip())
+        self.assertEqual('Hello World 2', lines[5].strip())
+        issue = gitli.get_issue(self.gitlipath, '2')
+        self.assertEqual(('2', 'Hello World 2', 1, '0.1'), issue)
+
+    def test_issue_filter(self):
+        open_issues = ['1', '3', '']
+        issue_filter = gitli.IssueFilter(['open', 'bug', '0.2'], open_issues,
+                ['0.2'], ['bug'])
+        self.assertTrue(issue_filter(('1', 'Title', 2, '0.2')))
+        self.assertFalse(issue_filter(('2', 'Title', 2, '0.2')))
+        self.assertFalse(issue_filter(('3', 'Title', 1, '0.2')))
+        self.assertFalse(issue_filter(('3', 'Title', 2, '0.1')))
+        (filters, milestones, itypes) = gitli.parse_filters(
+                [' Close', 'TASK', '0.3'])
+        self.assertEqual(['close', 'task', '0.3'], filters)
+        self.assertEqual(['0.3'], milestones)
+        self.assertEqual(['task'], itypes)
+        self.assertEqual(([], [], []), gitli.parse_filters(['all', 'bug']))
+
+    def test_iter_issues(self):
+        options = self.Options(edit=False, up=False)
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        # Only '\n' ends a record: other line separators stay in the title.
+        gitli.main(options, ['new', 'Hello\u2028World 2'], None)
+        issues = gitli.iter_issues(self.gitlipath)
+        self.assertEqual(('1', 'Hello World 1', 1, '0.1'), next(issues))
+        self.assertEqual(('2', 'Hello\u2028World 2', 1, '0.1'),
+                next(issues))
+        self.assertRaises(StopIteration, next, issues)
+        issues = gitli.list_issues(self.gitlipath, ['all'], self.bcolor,
+                False)
+        self.assertEqual(None, issues)
+
+    def test_config(self):
+        call(['git', 'init'])
+        call(['git', 'config', '--add', 'gitli.list.option', 'Open'])
+        call(['git', 'config', '--add', 'gitli.color', 'auto'])
+        config = gitli.get_config()
+        self.assertEqual('Open', config[gitli.LIST])
+        self.assertEqual('open', gitli.get_default_list_filter())
+        self.assertTrue(gitli.is_colored_output())
+        self.assertTrue(config is gitli.get_config())
+
+    def test_journal(self):
+        options = self.Options(edit=False, up=True)
+        call(['git', 'init'])
+        call(['git', 'config', '--add', 'gitli.storage', 'journal'])
+        gitli.main(None, ['init', ], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        gitli.main(options, ['new', 'Hello World 2'], None)
+        gitli.main(options, ['new', 'Hello World 3'], None)
+        issues_content = read_file(gitli.ISSUES)
+        open_content = read_file(gitli.OPEN)
+        gitli.main(options, ['close', '2'], None)
+        gitli.main(options, ['remove', '3'], None)
+        gitli.main(options, ['milestone', '0.2'], None)
+        gitli.main(options, ['new', 'Hello World 4'], None)
+        gitli.main(options, ['reopen', '2'], None)
+        self.assertEqual(issues_content, read_file(gitli.ISSUES)[:len(
+            issues_content)])
+        self.assertEqual(open_content, read_file(gitli.OPEN)[:len(
+            open_content)])
+        self.assertEqual(['1', '4', '2'], gitli.get_open_issues(
+            self.gitlipath))
+        issues = gitli.list_issues(self.gitlipath, ['all'], self.bcolor)
+        self.assertEqual([('1', 'Hello World 1', 1, '0.2'),
+            ('2', 'Hello World 2', 1, '0.1'),
+            ('4', 'Hello World 4', 1, '0.2')], issues)
+        self.assertEqual(None, gitli.get_issue(self.gitlipath, '3'))
+        self.assertEqual('0.2', gitli.get_issue(self.gitlipath, '1')[3])
+        moved = gitli.list_issues(self.gitlipath, ['0.2'], self.bcolor)
+        self.assertEqual(['1', '4'], [issue[0] for issue in moved])
+
+        gitli.main(options, ['compact'], None)
+        self.assertEqual('', read_file(gitli.JOURNAL))
+        self.assertEqual(issues, gitli.list_issues(self.gitlipath, ['all'],
+            self.bcolor))
+        self.assertEqual(['1', '4', '2'], read_file(gitli.OPEN).split())
+        lines = read_lines(gitli.ISSUES)
+        self.assertEqual(12, len(lines))
+        self.assertEqual('0.2', lines[3].strip())
+
+    def test_journal_disabled(self):
+        options = self.Options(edit=False, up=False)
+        call(['git', 'init'])
+        call(['git', 'config', '--add', 'gitli.storage', 'journal'])
+        gitli.main(None, ['init', ], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        gitli.main(options, ['new', 'Hello World 2'], None)
+        gitli.main(options, ['close', '1'], None)
+        self.assertTrue(gitli.has_journal(self.gitlipath))
+        call(['git', 'config', '--unset', 'gitli.storage'])
+        gitli._config_cache.clear()
+        gitli.main(options, ['close', '2'], None)
+        self.assertFalse(gitli.has_journal(self.gitlipath))
+        self.assertEqual('', read_file(gitli.OPEN).strip())
+
+    def test_batch(self):
+        options = self.Options(edit=False, up=False)
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        gitli.add_comment(self.gitlipath, '3', 'Removed with the issue',
+                'Alice', '2012-04-01 14:00')
+        commands = [
+            'new "Hello World 2" bug',
+            '# A comment',
+            '',
+            "new 'Hello World 3' 3 0.3",
+            'close 1',
+            "edit 2 '' task 0.2",
+            'remove 3',
+            'new "Hello World 4"',
+            'milestone 0.5 up',
+        ]
+        self.assertEqual(7, gitli.run_batch(self.gitlipath, commands))
+        issues = gitli.list_issues(self.gitlipath, ['all'], self.bcolor)
+        self.assertEqual([('1', 'Hello World 1', 1, '0.1'),
+            ('2', 'Hello World 2', 1, '0.5'),
+            ('4', 'Hello World 4', 1, '0.5')], issues)
+        self.assertEqual(['2', '4'], read_file(gitli.OPEN).split())
+        self.assertEqual('4', read_file(gitli.LAST))
+        self.assertEqual('0.5', read_file(gitli.CURRENT))
+        self.assertEqual([], gitli.get_comments(self.gitlipath, '3'))
+
+        content = read_file(gitli.ISSUES)
+        self.assertRaises(ValueError, gitli.run_batch, self.gitlipath,
+                ['new "Hello World 5"', 'edit 9 "Unknown"'])
+        self.assertRaises(ValueError, gitli.run_batch, self.gitlipath,
+                ['new ""'])
+        self.assertRaises(ValueError, gitli.run_batch, self.gitlipath,
+                ['reopen 3'])
+        self.assertRaises(ValueError, gitli.run_batch, self.gitlipath,
+                ['reopen 9'])
+        self.assertEqual(['2', '4'], read_file(gitli.OPEN).split())
+        self.assertEqual(content, read_file(gitli.ISSUES))
+        self.assertEqual('4', read_file(gitli.LAST))
+
+        self.assertEqual(1, gitli.run_batch(self.gitlipath,
+            [b'new "Caf\xc3\xa9 au lait"\n']))
+        self.assertEqual(b'Caf\xc3\xa9 au lait'.decode('utf-8'),
+                gitli.get_issue(self.gitlipath, '5')[1])
+
+    def test_import(self):
+        options = self.Options(edit=False, up=False)
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        gitli.main(options, ['milestone', '0.2'], None)
+        records = text_file(
+            '{"title": "Hello World 2", "type": "bug", "status": "closed"}\n'
+            '\n'
+            '{"number": 9, "title": "Hello World 3", "milestone": "0.3"}\n')
+        self.assertEqual(2, gitli.import_issues(self.gitlipath, records))
+        records = text_file(b'title,type,milestone,status\n'
+                b'"Hello\nWorld 4",3,Caf\xc3\xa9,open\n')
+        self.assertEqual(1, gitli.import_issues(self.gitlipath, records,
+            'csv'))
+        issues = gitli.list_issues(self.gitlipath, ['all'], self.bcolor)
+        self.assertEqual([('1', 'Hello World 1', 1, '0.1'),
+            ('2', 'Hello World 2', 2, '0.2'),
+            ('3', 'Hello World 3', 1, '0.3'),
+            ('4', 'Hello World 4', 3, b'Caf\xc3\xa9'.decode('utf-8'))],
+            issues)
+        self.assertEqual(['1', '3', '4'], read_file(gitli.OPEN).split())
+        self.assertEqual('4', read_file(gitli.LAST))
+
+        content = read_file(gitli.ISSUES)
+        records = text_file('{"title": "Hello World 5"}\n'
+                '{"title": "Hello World 6", "type": "story"}\n')
+        self.assertRaises(ValueError, gitli.import_issues, self.gitlipath,
+                records)
+        self.assertEqual(content, read_file(gitli.ISSUES))
+        self.assertEqual(['1', '3', '4'], read_file(gitli.OPEN).split())
+        self.assertEqual('4', read_file(gitli.LAST))
+        self.assertEqual([], [name for name in os.listdir(self.gitlipath)
+            if name.endswith('.tmp')])
+
+        # The last number is saved before the issue files are replaced.
+        replace = gitli.replace
+
+        def interrupted(source, destination):
+            if destination.endswith(gitli.ISSUES):
+                raise OSError(errno.EIO, 'interrupted')
+            replace(source, destination)
+
+        gitli.replace = interrupted
+        try:
+            self.assertRaises(OSError, gitli.import_issues, self.gitlipath,
+                    text_file('{"title": "Hello World 7"}\n'))
+        finally:
+            gitli.replace = replace
+        self.assertEqual(content, read_file(gitli.ISSUES))
+        self.assertEqual('5', read_file(gitli.LAST))
+        self.assertEqual([], [name for name in os.listdir(self.gitlipath)
+            if name.endswith('.tmp')])
+
+    def test_parallel_writers(self):
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        options = self.Options(edit=False, up=False)
+        for index in range(1, 41):
+            gitli.main(options, ['new', 'Hello World {0}'.format(index)],
+                    None)
+
+        # Each writer creates issues and closes its own share of the first
+        # 40 issues, in a separate process.
+        script = (
+            'import collections, gitli, sys\n'
+            'writer = int(sys.argv[1])\n'
+            'Options = collections.namedtuple("Options", "edit up")\n'
+            'options = Options(edit=False, up=False)\n'
+            'for index in range(10):\n'
+            '    gitli.main(options, ["new", "Writer {0} {1}".format(writer,'
+            ' index)], None)\n'
+            '    gitli.main(options, ["close", str(writer * 10 + index % 5 +'
+            ' 1)], None)\n')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = GITLI_DIR
+        writers = [subprocess.Popen([sys.executable, '-c', script,
+            str(writer)], env=env) for writer in range(4)]
+        self.assertEqual([0] * 4, [writer.wait() for writer in writers])
+
+        issues = gitli.list_issues(self.gitlipath, ['all'], self.bcolor)
+        numbers = [int(issue[0]) for issue in issues]
+        self.assertEqual(list(range(1, 81)), sorted(numbers))
+        self.assertEqual(sorted('Writer {0} {1}'.format(writer, index) for
+            writer in range(4) for index in range(10)),
+            sorted(issue[1] for issue in issues[40:]))
+        self.assertEqual('80', read_file(gitli.LAST))
+        closed = set(writer * 10 + index + 1 for writer in range(4) for
+                index in range(5))
+        self.assertEqual(sorted(set(range(1, 81)) - closed),
+                sorted(int(number) for number in
+                    read_file(gitli.OPEN).split()))
+
+    def test_bulk(self):
+        options = self.Options(edit=False, up=False)
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        for index in range(1, 9):
+            gitli.main(options, ['new', 'Hello World {0}'.format(index)],
+                    None)
+        gitli.main(options, ['milestone', '0.2'], None)
+        gitli.main(options, ['new', 'Hello World 9'], None)
+        self.assertEqual(['2', '3', '4', '7'],
+                gitli.select_issues(self.gitlipath, ['2-4', '7', '12']))
+        gitli.main(options, ['close', '2-4', '7'], None)
+        self.assertEqual(['1', '5', '6', '8', '9'],
+                read_file(gitli.OPEN).split())
+        gitli.main(options, ['reopen', '3', '4'], None)
+        self.assertEqual(['1', '5', '6', '8', '9', '3', '4'],
+                read_file(gitli.OPEN).split())
+        gitli.main(options, ['close', 'open', '0.1', '5-9'], None)
+        self.assertEqual(['1', '9', '3', '4'], read_file(gitli.OPEN).split())
+        gitli.main(options, ['remove', '1-2', '9'], None)
+        self.assertEqual(['3', '4'], read_file(gitli.OPEN).split())
+        issues = gitli.list_issues(self.gitlipath, ['all'], self.bcolor)
+        self.assertEqual(['3', '4', '5', '6', '7', '8'],
+                [issue[0] for issue in issues])
+
+    def test_snapshot(self):
+        options = self.Options(edit=False, up=False)
+        call(['git', 'init'])
+        call(['git', 'config', '--add', 'gitli.snapshot', 'true'])
+        gitli.main(None, ['init', ], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        gitli.main(options, ['new', 'Hello W\u00f6rld 2'], None)
+        gitli.main(options, ['milestone', '0.2'], None)
+        gitli.main(options, ['new', 'Hello World 3'], None)
+        gitli.main(options, ['close', '1'], None)
+        issues = gitli.list_issues(self.gitlipath, ['all'], self.bcolor)
+        self.assertTrue(exists(os.path.join(gitli.CACHE, gitli.SNAPSHOT)))
+        self.assertEqual([('1', 'Hello World 1', 1, '0.1'),
+            ('2', 'Hello W\u00f6rld 2', 1, '0.1'),
+            ('3', 'Hello World 3', 1, '0.2')], issues)
+        issues = gitli.list_issues(self.gitlipath, ['open', '0.1'],
+                self.bcolor)
+        self.assertEqual(['2'], [issue[0] for issue in issues])
+        issues = gitli.list_issues(self.gitlipath, ['close', 'task'],
+                self.bcolor)
+        self.assertEqual(['1'], [issue[0] for issue in issues])
+        self.assertEqual([], gitli.list_issues(self.gitlipath, ['bug'],
+            self.bcolor))
+        gitli.main(options, ['remove', '2'], None)
+        issues = gitli.list_issues(self.gitlipath, ['open'], self.bcolor)
+        self.assertEqual(['3'], [issue[0] for issue in issues])
+
+    def test_postings(self):
+        options = self.Options(edit=False, up=True)
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        gitli.main(options, ['new', 'Hello World 2'], None)
+        issues = gitli.list_issues(self.gitlipath, ['0.1'], self.bcolor)
+        self.assertEqual(['1', '2'], [issue[0] for issue in issues])
+        self.assertTrue(gitli.are_postings_fresh(self.gitlipath))
+
+        gitli.main(options, ['new', 'Hello World 3'], None)
+        gitli.main(options, ['close', '1'], None)
+        self.assertTrue(gitli.are_postings_fresh(self.gitlipath))
+        gitli.main(options, ['milestone', '0.2'], None)
+        self.assertTrue(gitli.are_postings_fresh(self.gitlipath))
+        self.assertEqual([1], list(gitli.read_posting(self.gitlipath, 'm',
+            '0.1')))
+        self.assertEqual([2, 3], list(gitli.read_posting(self.gitlipath, 'm',
+            '0.2')))
+
+        answers = iter(['', 'bug', '0.3'])
+        old_rinput = gitli.rinput
+        gitli.rinput = lambda prompt: next(answers)
+        try:
+            gitli.main(options, ['edit', '3'], None)
+        finally:
+            gitli.rinput = old_rinput
+        gitli.main(options, ['remove', '2'], None)
+        self.assertTrue(gitli.are_postings_fresh(self.gitlipath))
+        self.assertEqual([], gitli.list_issues(self.gitlipath, ['0.2'],
+            self.bcolor))
+        issues = gitli.list_issues(self.gitlipath, ['open', 'bug', '0.3'],
+                self.bcolor)
+        self.assertEqual([('3', 'Hello World 3', 2, '0.3')], issues)
+        issues = gitli.list_issues(self.gitlipath, ['close', 'task'],
+                self.bcolor)
+        self.assertEqual(['1'], [issue[0] for issue in issues])
+
+        with open(os.path.join(gitli.GITLIDIR, gitli.ISSUES), 'a') as f:
+            f.write('4\nHello World 4\n1\n0.3\n')
+        self.assertFalse(gitli.are_postings_fresh(self.gitlipath))
+        issues = gitli.list_issues(self.gitlipath, ['0.3'], self.bcolor)
+        self.assertEqual(['3', '4'], [issue[0] for issue in issues])
+
+    def test_up_incremental(self):
+        options = self.Options(edit=False, up=True)
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        for index in range(1, 6):
+            gitli.main(options, ['new', 'Hello World {0}'.format(index)],
+                    None)
+        gitli.main(options, ['close', '1', '3'], None)
+        gitli.get_issue(self.gitlipath, '1')
+        offsets = os.path.join(self.gitlipath, gitli.CACHE, gitli.OFFSETS)
+        stamp = os.stat(offsets).st_ino
+
+        # Same length: the records are patched in place.
+        gitli.main(options, ['milestone', '0.2'], None)
+        self.assertEqual(stamp, os.stat(offsets).st_ino)
+        self.assertEqual(('4', 'Hello World 4', 1, '0.2'),
+                gitli.get_issue(self.gitlipath, '4'))
+        self.assertEqual(['0.1', '0.2', '0.1', '0.2', '0.2'],
+                [line.strip() for line in read_lines(gitli.ISSUES)[3::4]])
+
+        # Different length: the file is rewritten.
+        gitli.main(options, ['milestone', '1.0-beta'], None)
+        self.assertEqual(['0.1', '1.0-beta', '0.1', '1.0-beta', '1.0-beta'],
+                [line.strip() for line in read_lines(gitli.ISSUES)[3::4]])
+        self.assertEqual(('5', 'Hello World 5', 1, '1.0-beta'),
+                gitli.get_issue(self.gitlipath, '5'))
+        issues = gitli.list_issues(self.gitlipath, ['1.0-beta'], self.bcolor)
+        self.assertEqual(['2', '4', '5'], [issue[0] for issue in issues])
+
+    def test_search(self):
+        options = self.Options(edit=False, up=False)
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        gitli.main(options, ['new', 'Crash when parsing the issues file'],
+                None)
+        gitli.main(options, ['new', 'Add a parser for the journal'], None)
+        gitli.main(options, ['new', 'Parse issue ranges'], None)
+        issues = gitli.search(self.gitlipath, ['pars*'], self.bcolor)
+        self.assertEqual(['3', '2', '1'], [issue[0] for issue in issues])
+        self.assertTrue(gitli.is_token_index_fresh(self.gitlipath))
+        issues = gitli.search(self.gitlipath, ['parser'], self.bcolor)
+        self.assertEqual(['2'], [issue[0] for issue in issues])
+        issues = gitli.search(self.gitlipath, ['Issue*', 'pars*'],
+                self.bcolor)
+        self.assertEqual(['3', '1'], [issue[0] for issue in issues])
+        self.assertEqual([], gitli.search(self.gitlipath, ['nothing'],
+            self.bcolor))
+
+        gitli.main(options, ['new', 'Parser crash'], None)
+        gitli.main(options, ['remove', '1'], None)
+        self.assertTrue(gitli.is_token_index_fresh(self.gitlipath))
+        issues = gitli.search(self.gitlipath, ['crash'], self.bcolor)
+        self.assertEqual(['4'], [issue[0] for issue in issues])
+        issues = gitli.search(self.gitlipath, ['parser'], self.bcolor)
+        self.assertEqual(['4', '2'], [issue[0] for issue in issues])
+
+        gitli.build_token_index(self.gitlipath)
+        issues = gitli.search(self.gitlipath, ['parser'], self.bcolor)
+        self.assertEqual(['4', '2'], [issue[0] for issue in issues])
+        self.assertEqual([], gitli.search(self.gitlipath, ['zzz*'],
+            self.bcolor))
+        self.assertEqual([], gitli.search(self.gitlipath, ['a*', 'aaa'],
+            self.bcolor))
+
+        # Moving the open issues does not change their titles.
+        gitli.move_issues(self.gitlipath, '0.2')
+        self.assertTrue(gitli.is_token_index_fresh(self.gitlipath))
+        delta = gitli.get_tokens_path(self.gitlipath, gitli.TOKENS_DELTA)
+        self.assertEqual(0, os.path.getsize(delta))
+        issues = gitli.search(self.gitlipath, ['parser'], self.bcolor)
+        self.assertEqual(['4', '2'], [issue[0] for issue in issues])
+
+    def test_server(self):
+        options = self.Options(edit=False, up=False)
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        server = gitli.Server(self.gitlipath)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        old_cache = gitli._records_cache
+        gitli._records_cache = {}
+        stdout = sys.stdout
+        try:
+            self.assertTrue(gitli.is_server_running(self.gitlipath))
+            options = optparse.Values({'edit': False, 'up': False})
+            self.assertFalse(gitli.forward(options, ['edit', '1']))
+            sys.stdout = gitli.CapturedOutput()
+            self.assertTrue(gitli.forward(options, ['new', 'Hello World 2']))
+            self.assertTrue(gitli.forward(options, ['close', '1']))
+            self.assertTrue(gitli.forward(options, ['list', 'all']))
+            output = sys.stdout.getvalue()
+            sys.stdout = gitli.CapturedOutput()
+            self.assertTrue(gitli.forward(options, ['show', '9']))
+            missing = sys.stdout.getvalue()
+
+            # Only the forwarded commands are executed by the server.
+            self.assertEqual(1, server.execute(['remove', '1'],
+                {'edit': False})['status'])
+            self.assertEqual(1, server.execute(['new', 'Hello World 3'],
+                {'edit': True})['status'])
+
+            # A command sent to the server is never executed again locally.
+            def fail(args, options):
+                raise ValueError('failed')
+
+            (server.execute, server.handle_error) = (fail,
+                    lambda request, client_address: None)
+            self.assertRaises(SystemExit, gitli.forward, options,
+                    ['new', 'Hello World 3'])
+            self.assertEqual('2', read_file(gitli.LAST))
+        finally:
+            sys.stdout = stdout
+            gitli._records_cache = old_cache
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.assertEqual(2, len(output.splitlines()))
+        self.assertTrue('Hello World 1' in output)
+        self.assertTrue('closed' in output.splitlines()[0])
+        self.assertTrue('Hello World 2' in output.splitlines()[1])
+        self.assertEqual('Issue #9 not found\n', missing)
+        self.assertFalse(gitli.is_server_running(self.gitlipath))
+        self.assertEqual(os.path.join(os.getcwd(), '.git', 'config'),
+                server.config_paths[0])
+
+        # The config of a repository whose .git is a file is found too.
+        git_dir = os.path.join(self.tempdirpath, 'separate')
+        os.mkdir('linked')
+        call(['git', 'init', '-q', '--separate-git-dir', git_dir, 'linked'])
+        os.chdir('linked')
+        self.assertEqual(os.path.join(git_dir, 'config'),
+                gitli.get_config_paths()[0])
+
+    def test_print_issues(self):
+        issues = [('1', 'Hello World 1', 2, '0.1'),
+                ('10', 'Hello World 10', 3, '0.2')]
+        for bcolor in (gitli.BColors(), self.bcolor):
+            expected = ''
+            for (number, title, type_id, milestone) in issues:
+                (open_text, color) = ('open', bcolor.YELLOW) if number == \
+                        '1' else ('closed', bcolor.GREEN)
+                expected += ('{5}#{0:<4}{9} {6}{1:<48}{9} {7}{2:<6} {3:<7}{9}'
+                    ' - {8}{4}{9}\n').format(number, title,
+                    '[' + gitli.ITYPES[type_id - 1] + ']',
+                    '[' + milestone + ']', open_text, bcolor.CYAN,
+                    bcolor.WHITE, bcolor.BLUE, color, bcolor.ENDC)
+            stdout = sys.stdout
+            sys.stdout = gitli.CapturedOutput()
+            try:
+                gitli.print_issues(iter(issues), frozenset(['1']), bcolor)
+                output = sys.stdout.getvalue()
+            finally:
+                sys.stdout = stdout
+            self.assertEqual(expected, output)
+
+    def test_comments(self):
+        call(['git', 'init'])
+        options = self.Options(edit=False, up=False)
+        gitli.main(options, ['init'], None)
+        for index in range(1, 4):
+            gitli.main(options, ['new', 'Hello World {0}'.format(index)],
+                    None)
+        self.assertEqual([], gitli.get_comments(self.gitlipath, '1'))
+
+        def read_index(name):
+            with open(os.path.join(self.gitlipath, gitli.CACHE, name),
+                    'rb') as index_file:
+                return index_file.read()
+
+        gitli.add_comment(self.gitlipath, '3', 'First', 'Alice',
+                '2012-04-01 14:00')
+        gitli.add_comment(self.gitlipath, '1', 'Second', 'Bob',
+                '2012-04-02 14:00')
+        gitli.add_comment(self.gitlipath, '3', 'Third\nline', 'Bob',
+                '2012-04-03 14:00')
+        self.assertEqual([('3', '2012-04-01 14:00', 'Alice', 'First'),
+            ('3', '2012-04-03 14:00', 'Bob', 'Third\nline')],
+            gitli.get_comments(self.gitlipath, '3'))
+        self.assertEqual([], gitli.get_comments(self.gitlipath, '2'))
+        self.assertEqual([], gitli.get_comments(self.gitlipath, '99'))
+
+        # The index is updated incrementally and matches a full rebuild.
+        slots = read_index(gitli.COMMENTS_SLOTS)
+        gitli.add_comment(self.gitlipath, '1', 'Fourth', 'Alice',
+                '2012-04-04 14:00')
+        incremental = (read_index(gitli.COMMENTS_SLOTS),
+                read_index(gitli.COMMENTS_ENTRIES))
+        self.assertNotEqual(slots, incremental[0])
+        gitli.build_comment_index(self.gitlipath)
+        self.assertEqual(incremental, (read_index(gitli.COMMENTS_SLOTS),
+            read_index(gitli.COMMENTS_ENTRIES)))
+        self.assertEqual(['Second', 'Fourth'], [comment[3] for comment in
+            gitli.get_comments(self.gitlipath, '1')])
+
+        stdout = sys.stdout
+        sys.stdout = gitli.CapturedOutput()
+        try:
+            gitli.main(options, ['comment', '2', 'Looks', 'good'], None)
+            gitli.main(options, ['comment', '9', 'Unknown'], None)
+            gitli.show_issue(self.gitlipath, '3', self.bcolor)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual('Issue #9 unknown', output.splitlines()[0])
+        self.assertTrue(output.endswith('\n\n    2012-04-01 14:00 Alice\n'
+            '    First\n\n    2012-04-03 14:00 Bob\n    Third\n'
+            '    line\n'))
+        self.assertEqual(['Looks good'], [comment[3] for comment in
+            gitli.get_comments(self.gitlipath, '2')])
+
+        gitli.main(options, ['remove', '3'], None)
+        self.assertEqual([], gitli.get_comments(self.gitlipath, '3'))
+        self.assertEqual(['Second', 'Fourth'], [comment[3] for comment in
+            gitli.get_comments(self.gitlipath, '1')])
+
+    def test_revision(self):
+        call(['git', 'init'])
+        call(['git', 'config', 'user.name', 'Test'])
+        call(['git', 'config', 'user.email', 'test@example.com'])
+        options = self.Options(edit=False, up=False)
+        gitli.main(options, ['init'], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        gitli.main(options, ['new', 'Hello World 2'], None)
+        gitli.main(options, ['close', '2'], None)
+        call(['git', 'add', '.gitli'])
+        call(['git', 'commit', '-q', '-m', 'First'])
+        gitli.main(options, ['new', 'Hello World 3'], None)
+        gitli.main(options, ['reopen', '2'], None)
+        gitli.main(options, ['remove', '1'], None)
+
+        issues = gitli.list_issues(self.gitlipath, ['all'], self.bcolor,
+                revision='HEAD')
+        self.assertEqual([('1', 'Hello World 1', 1, '0.1'),
+            ('2', 'Hello World 2', 1, '0.1')], issues)
+        self.assertEqual([('2', 'Hello World 2', 1, '0.1')],
+                gitli.list_issues(self.gitlipath, ['close'], self.bcolor,
+                    revision='HEAD'))
+        (snapshot, state) = gitli.get_revision(self.gitlipath, 'HEAD')
+        self.assertEqual(['1'], list(state.open_issues))
+        self.assertEqual(1, len(os.listdir(os.path.join(self.gitlipath,
+            gitli.CACHE, gitli.REVISIONS))))
+
+        # A revision is cached by the SHA of its files.
+        gitli._revision_cache.clear()
+        gitli._snapshot_cache.clear()
+        self.assertEqual(issues, gitli.list_issues(self.gitlipath, ['all'],
+            self.bcolor, revision='HEAD'))
+        self.assertEqual(1, len(os.listdir(os.path.join(self.gitlipath,
+            gitli.CACHE, gitli.REVISIONS))))
+
+        stdout = sys.stdout
+        sys.stdout = gitli.CapturedOutput()
+        try:
+            gitli.show_issue(self.gitlipath, '1', self.bcolor, 'json',
+                    'HEAD')
+            gitli.show_issue(self.gitlipath, '3', self.bcolor, 'json',
+                    'HEAD')
+            gitli.show_issue(self.gitlipath, 'foo', self.bcolor, 'json',
+                    'HEAD')
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual([{'number': 1, 'title': 'Hello World 1',
+            'type': 'Task', 'milestone': '0.1', 'status': 'open',
+            'comments': []}, None, None],
+            [json.loads(line) for line in output.splitlines()])
+        self.assertRaises(ValueError, gitli.get_revision, self.gitlipath,
+                'unknown')
+
+    def test_stats(self):
+        call(['git', 'init'])
+        call(['git', 'config', 'user.name', 'Test'])
+        call(['git', 'config', 'user.email', 'test@example.com'])
+        options = self.Options(edit=False, up=False)
+        gitli.main(options, ['init'], None)
+        gitli.main(options, ['new', 'Hello World 1'], None)
+        gitli.main(options, ['new', 'Hello World 2'], None)
+        call(['git', 'add', '.gitli'])
+        call(['git', 'commit', '-q', '-m', 'First'])
+        gitli.main(options, ['close', '1'], None)
+        gitli.main(options, ['milestone', '0.2'], None)
+        gitli.main(options, ['new', 'Hello World 3'], None)
+        call(['git', 'commit', '-q', '-a', '-m', 'Second'])
+
+        self.assertEqual([
+            {'milestone': '0.1', 'open': 1, 'closed': 1, 'total': 2},
+            {'milestone': '0.2', 'open': 1, 'closed': 0, 'total': 1}],
+            gitli.get_stats(self.gitlipath))
+
+        history = gitli.get_history(self.gitlipath)
+        self.assertEqual([(2, 2, {'0.1': 2}), (2, 3, {'0.1': 1, '0.2': 1})],
+                [(record['open'], record['total'], record['milestones']) for
+                    record in history])
+
+        # Only the new commits are processed on the next call.
+        gitli.main(self.Options(edit=False, up=True), ['milestone', '0.3'],
+                None)
+        gitli.main(options, ['reopen', '1'], None)
+        call(['git', 'commit', '-q', '-a', '-m', 'Third'])
+        gitli.main(options, ['remove', '2'], None)
+        call(['git', 'commit', '-q', '-a', '-m', 'Fourth'])
+        incremental = gitli.get_history(self.gitlipath)
+        self.assertEqual(history, incremental[:2])
+        os.remove(os.path.join(self.gitlipath, gitli.CACHE, gitli.HISTORY))
+        self.assertEqual(incremental, gitli.get_history(self.gitlipath))
+        self.assertEqual([(3, {'0.1': 1, '0.3': 2}),
+            (2, {'0.1': 1, '0.3': 1})],
+                [(record['open'], record['milestones']) for record in
+                    incremental[2:]])
+
+    def test_counters(self):
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        gitli.run_batch(self.gitlipath, [
+            'new "Hello World 1" bug 0.1',
+            'new "Hello World 2" task 0.1',
+            'new "Hello World 3" bug 0.2',
+        ])
+        gitli.get_counters(self.gitlipath)
+
+        def check(function, *args):
+            function(self.gitlipath, *args)
+            # The counters were updated, not invalidated.
+            counts = gitli.get_fresh_counters(self.gitlipath)
+            self.assertNotEqual(None, counts)
+            self.assertEqual(gitli.build_counters(self.gitlipath), counts)
+
+        check(gitli.append_issue, 'Hello World 4', 3, '0.2')
+        check(gitli.close_issues, ['1', '3', '9'])
+        check(gitli.close_issues, ['1'])
+        check(gitli.reopen_issues, ['3'])
+        check(gitli.save_issue, ('2', 'Hello World 2', 2, '0.3'))
+        check(gitli.move_issues, '0.4')
+        check(gitli.remove_issues, ['3', '4'])
+        check(gitli.append_issue, 'Hello World 5', 1, '0.1')
+        check(gitli.archive_milestone, '0.1')
+        self.assertEqual({('0.1', 1): [0, 1], ('0.4', 2): [0, 1]},
+                gitli.get_counters(self.gitlipath))
+
+        self.assertEqual([
+            {'milestone': '0.1', 'open': 1, 'closed': 1, 'total': 2},
+            {'milestone': '0.4', 'open': 1, 'closed': 0, 'total': 1}],
+            gitli.get_stats(self.gitlipath))
+        self.assertEqual([
+            {'milestone': '0.1', 'open': 0, 'closed': 1, 'total': 1},
+            {'milestone': '0.4', 'open': 1, 'closed': 0, 'total': 1}],
+            gitli.get_stats(self.gitlipath, [2]))
+
+        # Stale counters are rebuilt, e.g., after a change in the journal.
+        call(['git', 'config', 'gitli.storage', 'journal'])
+        gitli._config_cache.clear()
+        gitli.close_issues(self.gitlipath, ['5'])
+        self.assertEqual(None, gitli.get_fresh_counters(self.gitlipath))
+        self.assertEqual({('0.1', 1): [1, 0], ('0.4', 2): [0, 1]},
+                gitli.get_counters(self.gitlipath))
+        self.assertNotEqual(None, gitli.get_fresh_counters(self.gitlipath))
+
+    def test_find_work_tree(self):
+        root = os.path.realpath(self.tempdirpath)
+        deep = os.path.join(root, 'a', 'b', 'c')
+        os.makedirs(deep)
+        os.chdir(deep)
+        self.assertEqual(None, gitli.find_work_tree())
+        call(['git', 'init', root])
+        self.assertEqual(os.path.join(root, '.gitli'),
+                gitli.find_gitli_path())
+
+        # The second lookup only stamps the working directory and the .git
+        # of the cached work tree.
+        checked = []
+        (get_stamp, exists) = (gitli.get_stamp, gitli.exists)
+
+        def counting_get_stamp(path):
+            checked.append(path)
+            return get_stamp(path)
+
+        def counting_exists(path):
+            checked.append(path)
+            return exists(path)
+
+        (gitli.get_stamp, gitli.exists) = (counting_get_stamp,
+                counting_exists)
+        try:
+            self.assertEqual(root, gitli.find_work_tree())
+            self.assertEqual([deep, os.path.join(root, '.git')], checked)
+
+            # A miss checks each parent once.
+            os.remove(gitli.get_roots_cache_path())
+            del checked[:]
+            self.assertEqual(root, gitli.find_work_tree())
+            self.assertEqual([deep, os.path.join(deep, '.git'),
+                os.path.join(root, 'a', 'b', '.git'),
+                os.path.join(root, 'a', '.git'), os.path.join(root, '.git'),
+                os.path.join(root, '.git')], [path for path in checked if
+                    path.startswith(root)])
+        finally:
+            (gitli.get_stamp, gitli.exists) = (get_stamp, exists)
+
+        # A repository created in the working directory is found.
+        call(['git', 'init', '-q', deep])
+        self.assertEqual(deep, gitli.find_work_tree())
+        shutil.rmtree(os.path.join(deep, '.git'))
+        self.assertEqual(root, gitli.find_work_tree())
+
+        # A stale entry is ignored.
+        shutil.rmtree(os.path.join(root, '.git'))
+        with open(os.path.join(root, 'a', '.git'), 'w') as git_file:
+            git_file.write('gitdir: ../.git/worktrees/a\n')
+        self.assertEqual(os.path.join(root, 'a'), gitli.find_work_tree())
+
+        os.environ['GIT_CEILING_DIRECTORIES'] = os.path.join(root, 'a')
+        self.assertEqual(None, gitli.find_work_tree())
+        os.environ['GIT_WORK_TREE'] = root
+        self.assertEqual(root, gitli.find_work_tree())
+        del os.environ['GIT_WORK_TREE']
+        os.environ['GIT_DIR'] = os.path.join(root, '.git')
+        self.assertEqual(deep, gitli.find_work_tree())
+
+    def test_trace(self):
+        call(['git', 'init'])
+        gitli.main(None, ['init', ], None)
+        options = self.Options(edit=False, up=False)
+        for index in range(1, 6):
+            gitli.main(options, ['new', 'Hello World {0}'.format(index)],
+                    None)
+
+        profile_path = os.path.join(self.tempdirpath, 'profile')
+        os.environ['GITLI_TRACE'] = 'json'
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            with gitli.tracing(profile_path):
+                gitli.main(options, ['close', '2'], None)
+                gitli.main(options, ['list', 'open'], None)
+            trace = json.loads(sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+
+        self.assertEqual(None, gitli._trace)
+        phases = trace['phases']
+        for name in ('main', 'lock', 'write', 'open', 'parse', 'filter',
+                'render'):
+            self.assertTrue(name in phases)
+        self.assertEqual(1, phases['lock']['calls'])
+        self.assertEqual(trace['subprocesses'], sum(phase['subprocesses']
+            for phase in phases.values()))
+        self.assertTrue(sum(phase['seconds'] for phase in phases.values()) <=
+                trace['seconds'])
+        if os.path.exists(gitli.PROC_IO):
+            self.assertTrue(phases['write']['bytes_written'] > 0)
+            self.assertTrue(phases['render']['bytes_read'] == 0)
+        self.assertTrue(os.path.getsize(profile_path) > 0)
+
+        # Tracing is off without GITLI_TRACE.
+        del os.environ['GITLI_TRACE']
+        sys.stderr = io.StringIO()
+        try:
+            with gitli.tracing():
+                gitli.main(options, ['list', 'open'], None)
+            self.assertEqual('', sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+
+    def test_archive(self):
+        call(['git', 'init'])
+        options = self.Options(edit=False, up=False)
+        gitli.main(options, ['init'], None)
+        for index in range(1, 6):
+            gitli.main(options, ['new', 'Hello World {0}'.format(index)],
+                    None)
+        gitli.main(options, ['milestone', '0.2'], None)
+        gitli.main(options, ['new', 'Hello World 6'], None)
+        gitli.main(options, ['close', '1', '3', '4', '6'], None)
+        everything = gitli.list_issues(self.gitlipath, ['all'], self.bcolor)
+
+        self.assertEqual(3, gitli.archive_milestone(self.gitlipath, '0.1'))
+        self.assertEqual(0, gitli.archive_milestone(self.gitlipath, '0.1'))
+        self.assertEqual(['2', '5', '6'], read_file(gitli.ISSUES).split(
+            '\n')[::4][:-1])
+        self.assertEqual([{'name': '000001.gz', 'milestone': '0.1',
+            'count': 3, 'types': {'1': 3}, 'first': 1, 'last': 4}],
+            gitli.get_archive_segments(self.gitlipath))
+
+        self.assertEqual(everything, gitli.list_issues(self.gitlipath,
+            ['all'], self.bcolor))
+        self.assertEqual([('1', 'Hello World 1', 1, '0.1'),
+            ('3', 'Hello World 3', 1, '0.1'),
+            ('4', 'Hello World 4', 1, '0.1'),
+            ('6', 'Hello World 6', 1, '0.2')],
+            gitli.list_issues(self.gitlipath, ['close'], self.bcolor))
+        self.assertEqual([('6', 'Hello World 6', 1, '0.2')],
+            gitli.list_issues(self.gitlipath, ['close', '0.2'], self.bcolor))
+
+        # No segment is read when the filters exclude the archived issues.
+        read_archive_segment = gitli.read_archive_segment
+        gitli.read_archive_segment = None
+        try:
+            self.assertEqual([('2', 'Hello World 2', 1, '0.1'),
+                ('5', 'Hello World 5', 1, '0.1')], gitli.list_issues(
+                    self.gitlipath, ['open'], self.bcolor))
+            gitli.list_issues(self.gitlipath, ['0.2'], self.bcolor)
+        finally:
+            gitli.read_archive_segment = read_archive_segment
+
+        self.assertEqual(('3', 'Hello World 3', 1, '0.1'),
+                gitli.get_archived_issue(self.gitlipath, '3'))
+        self.assertEqual(None, gitli.get_archived_issue(self.gitlipath, '2'))
+        self.assertEqual([
+            {'milestone': '0.1', 'open': 2, 'closed': 3, 'total': 5},
+            {'milestone': '0.2', 'open': 0, 'closed': 1, 'total': 1}],
+            gitli.get_stats(self.gitlipath))
+
+        # Archived issues are read only.
+        self.assertEqual(set(['1', '3']), gitli.get_archived_numbers(
+            self.gitlipath, ['1', '2', '3', '6']))
+        self.assertRaises(ValueError, gitli.reopen_issues, self.gitlipath,
+                ['1'])
+        self.assertRaises(ValueError, gitli.remove_issues, self.gitlipath,
+                ['2', '3'])
+        self.assertRaises(ValueError, gitli.close_issues, self.gitlipath,
+                ['4'])
+        self.assertRaises(ValueError, gitli.run_batch, self.gitlipath,
+                ['close 2\n', 'reopen 4\n'])
+        self.assertEqual(['2', '5'], [number for number in
+            gitli.get_open_issues(self.gitlipath) if number])
+        self.assertEqual(['2', '5', '6'], read_file(gitli.ISSUES).split(
+            '\n')[::4][:-1])
+        stdout = sys.stdout
+        sys.stdout = gitli.CapturedOutput()
+        try:
+            gitli.main(options, ['comment', '3', 'Too', 'late'], None)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual('Archived issues cannot be modified: #3\n', output)
+        self.assertFalse(exists(gitli.COMMENTS) and read_file(
+            gitli.COMMENTS))
+
+    def test_output_formats(self):
+        call(['git', 'init'])
+        options = self.Options(edit=False, up=False)
+        gitli.main(options, ['init'], None)
+        gitli.main(options, ['new', 'Hello, "World"'], None)
+        gitli.main(options, ['new', 'Tab\there'], None)
+        gitli.main(options, ['close', '2'], None)
+
+        def run(*args):
+            stdout = sys.stdout
+            sys.stdout = gitli.CapturedOutput()
+            try:
+                gitli.main(FormatOptions(edit=False, up=False,
+                    format=args[0]), list(args[1:]), None)
+                return sys.stdout.getvalue()
+            finally:
+                sys.stdout = stdout
+
+        FormatOptions = namedtuple('FormatOptions', 'edit up format')
+        first = {'number': 1, 'title': 'Hello, "World"', 'type': 'Task',
+                'milestone': '0.1', 'status': 'open'}
+        second = {'number': 2, 'title': 'Tab\there', 'type': 'Task',
+                'milestone': '0.1', 'status': 'closed'}
+        self.assertEqual([first, second],
+                [json.loads(line) for line in
+                    run('jsonl', 'list').splitlines()])
+        self.assertEqual([first, second], json.loads(run('json', 'list')))
+        self.assertEqual([], json.loads(run('json', 'list', '9.9')))
+        second['comments'] = []
+        self.assertEqual(second, json.loads(run('json', 'show', '2')))
+        self.assertEqual(None, json.loads(run('json', 'show', '9')))
+        self.assertEqual('number,title,type,milestone,status\n'
+                '1,"Hello, ""World""",Task,0.1,open\n'
+                '2,Tab\there,Task,0.1,closed\n', run('csv', 'list'))
+        self.assertEqual('number\ttitle\ttype\tmilestone\tstatus\n'
+                '2\t"Tab\there"\tTask\t0.1\tclosed\n',
+                run('tsv', 'list', 'close'))
+        self.assertRaises(SystemExit, run, 'xml', 'list')
+
+        title = b'Caf\xc3\xa9'.decode('utf-8')
+        gitli.main(options, ['new', title], None)
+        self.assertEqual('3,' + title + ',Task,0.1,open\n',
+                run('csv', 'list', 'open').splitlines(True)[-1])
+
+    def test_print_issues_broken_pipe(self):
+        class ClosedPipe(object):
+            def write(self, text):
+                raise IOError(errno.EPIPE, 'Broken pipe')
+
+            def flush(self):
+                pass
+
+        def issues():
+            for number in range(gitli.OUTPUT_CHUNK * 10):
+                read.append(number)
+                yield ('{0}'.format(number), 'Title', 1, '0.1')
+
+        read = []
+        stdout = sys.stdout
+        sys.stdout = ClosedPipe()
+        try:
+            gitli.print_issues(issues(), frozenset(), self.bcolor)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(gitli.OUTPUT_CHUNK, len(read))